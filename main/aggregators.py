@@ -0,0 +1,226 @@
+"""
+aggregators.py
+
+Aggregates of data entries, computed together in a single pass over the input: each chart of analysis_search.py
+registers the aggregator it needs with an Engine, and the engine reads the data entries once, a batch at a time, and
+hands every batch to every aggregator. Decoding the entries is most of the cost of an analysis, so adding an aggregator
+doesn't add another scan of the input.
+
+An aggregator has:
+    - fields: the data entry fields it reads, so that a columnar input (see columnar.py) only decodes those
+    - add(data_entries): update the aggregate with a batch of data entries (a list)
+    - result(): the aggregate so far
+Counting aggregators only have to say what to count: CountAggregator.keys yields the keys of a batch, and they are
+counted with collections.Counter, in C.
+
+Usage, with a new aggregator:
+    class MentionCounts(CountAggregator):
+        fields = ("mentions",)
+
+        def keys(self, data_entries):
+            return (mention for entry in data_entries for mention in entry["mentions"])
+
+    engine = Engine()
+    hashtags = engine.register(HashtagCounts())
+    mentions = engine.register(MentionCounts())
+    engine.run(analysis_search.iter_data_entries(path))
+    hashtags.result(), mentions.result()
+"""
+import collections
+import random
+
+from batching import chunks
+
+BATCH_SIZE = 1000
+
+
+class Aggregator:
+    """
+    An aggregate of data entries, updated a batch at a time.
+    """
+    fields = ()
+
+    def add(self, data_entries):
+        """
+        :param data_entries: list of data entries
+        """
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+
+class CountAggregator(Aggregator):
+    """
+    Counts the keys of the data entries.
+    """
+    def __init__(self):
+        self.counts = collections.Counter()
+
+    def keys(self, data_entries):
+        """
+        :param data_entries: list of data entries
+        :return: iterable of the keys to count, any number of them per entry
+        """
+        raise NotImplementedError
+
+    def add(self, data_entries):
+        self.counts.update(self.keys(data_entries))
+
+    def result(self):
+        """
+        :return: dictionary of counts, in the order the keys were first seen
+        """
+        return dict(self.counts)
+
+
+class HashtagCounts(CountAggregator):
+    """
+    The number of occurrences of every hashtag.
+    """
+    fields = ("hashtags",)
+
+    def keys(self, data_entries):
+        return (hashtag for entry in data_entries for hashtag in entry["hashtags"])
+
+
+class SourceCounts(CountAggregator):
+    """
+    The number of entries from every source.
+    """
+    fields = ("source",)
+
+    def keys(self, data_entries):
+        return (entry["source"] for entry in data_entries)
+
+
+class PosTagCounts(CountAggregator):
+    """
+    The number of part of speech tags in total, of every kind.
+    """
+    fields = ("tags",)
+
+    def keys(self, data_entries):
+        return (tag[1] for entry in data_entries for tag in entry["tags"])
+
+
+def sentiment_label(polarity_score):
+    """
+    :param polarity_score: float, polarity of a data entry, from -1 to 1
+    :return: string, "very negative", "negative", "neutral", "positive" or "very positive"
+    """
+    if polarity_score <= -0.6:
+        return "very negative"
+    elif polarity_score < -0.2:
+        return "negative"
+    elif polarity_score < 0.2:
+        return "neutral"
+    elif polarity_score < 0.6:
+        return "positive"
+    return "very positive"
+
+
+class SentimentCounts(CountAggregator):
+    """
+    The number of entries in every class of sentiment, see sentiment_label.
+    """
+    fields = ("polarity",)
+
+    def keys(self, data_entries):
+        return (sentiment_label(entry["polarity"]) for entry in data_entries)
+
+
+class SentSubjSample(Aggregator):
+    """
+    The (polarity, subjectivity) of every entry, or a uniform random sample of max_points of them with more entries
+    than that, so memory doesn't grow with the number of entries.
+
+    :param max_points: optional maximum number of points
+    :param seed: seed of the sample
+    """
+    fields = ("polarity", "subjectivity")
+
+    def __init__(self, max_points=None, seed=0):
+        self.max_points = max_points
+        self.rng = random.Random(seed)
+        self.points = []
+        self.num_seen = 0
+
+    def add(self, data_entries):
+        for entry in data_entries:
+            point = (entry["polarity"], entry["subjectivity"])
+            if self.max_points is None or self.num_seen < self.max_points:
+                self.points.append(point)
+            else:
+                # reservoir sampling
+                j = self.rng.randint(0, self.num_seen)
+                if j < self.max_points:
+                    self.points[j] = point
+            self.num_seen += 1
+
+    def result(self):
+        """
+        :return: list of (polarity, subjectivity) tuples
+        """
+        return self.points
+
+
+class Engine:
+    """
+    Feeds every registered aggregator in one pass over the data entries.
+
+    :param batch_size: number of data entries handed to the aggregators at a time
+    """
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.aggregators = []
+        self.num_entries = 0
+
+    def register(self, aggregator):
+        """
+        :param aggregator: Aggregator
+        :return: the aggregator, to read its result from after run
+        """
+        self.aggregators.append(aggregator)
+        return aggregator
+
+    def fields(self):
+        """
+        :return: tuple of the data entry fields the aggregators read, without duplicates
+        """
+        fields = []
+        for aggregator in self.aggregators:
+            fields.extend(field for field in aggregator.fields if field not in fields)
+        return tuple(fields)
+
+    def add(self, data_entries):
+        """
+        :param data_entries: list of data entries
+        """
+        self.num_entries += len(data_entries)
+        for aggregator in self.aggregators:
+            aggregator.add(data_entries)
+
+    def run(self, data_entries):
+        """
+        :param data_entries: iterable of data entries, read once
+        :return: number of data entries read
+        """
+        start = self.num_entries
+        for batch in chunks(data_entries, self.batch_size):
+            self.add(batch)
+        return self.num_entries - start
+
+
+def aggregate(data_entries, aggregator):
+    """
+    Run one aggregator over data entries.
+    :param data_entries: iterable of data entries
+    :param aggregator: Aggregator
+    :return: result of the aggregator
+    """
+    engine = Engine()
+    engine.register(aggregator)
+    engine.run(data_entries)
+    return aggregator.result()
+
@@ -1,121 +1,177 @@
 """
 analysis_search.py
 
-Read in the output from twitter_search.py, and run some analytics, plot some graphs, etc.
+Read in the output from twitter_search.py, and run some analytics, plot some graphs, etc. Every chart registers an
+aggregator, and they are all computed in a single pass over the input (see aggregators.py).
+
+The query and date of a crawl come from the catalog of its directory (see catalog.py). With --catalog, every crawl of a
+query in a date range is analysed together, eg. all the CNN crawls of June:
+    python analysis_search.py --catalog ../output/search -q cnn --since 2018-06-01 --until 2018-07-01 \
+        -o ../output/reports
 """
 import argparse
+import datetime
 import json
 import os
+import sys
+import blocks
+import catalog
+import columnar
 import plots
+from aggregators import (Engine, HashtagCounts, PosTagCounts, SentimentCounts, SentSubjSample, SourceCounts,
+                         aggregate)
+from serializers import read_entries
 
 FILE_DELIMITER_CHAR = "|"
+# the scatter plot shows a random sample of the entries of bigger files
+MAX_SCATTER_POINTS = 100000
 
 
 ###########
 # Helpers #
 ###########
+def iter_data_entries(input_filepath):
+    """
+    Stream the data entries of a twitter_search.py output file, in any of its formats (see serializers.py), or of its
+    block file (see blocks.py), one entry at a time, so that only one entry (or block) is in memory at once. A last
+    entry cut off by an interrupted crawl is skipped, with a warning.
+
+    :param input_filepath: string, path of the output file
+    :return: generator of data entries
+    """
+    if blocks.is_block_file(input_filepath):
+        return blocks.iter_entries(input_filepath)
+    return read_entries(input_filepath)
+
+
 def get_hashtag_counts(data_entries):
     """
     Count the number of occurrences of every hashtag in data_entries.
-    :param data_entries: list of data entries
+    :param data_entries: list or iterable of data entries
     :return: dictionary of counts
     """
-    counts = {}
-    for entry in data_entries:
-        for hashtag in entry["hashtags"]:
-            if hashtag in counts:
-                counts[hashtag] += 1
-            else:
-                counts[hashtag] = 1
-    return counts
+    return aggregate(data_entries, HashtagCounts())
 
 
 def get_source_counts(data_entries):
     """
     Count the number of each source for every entry in data_entries.
-    :param data_entries: list of data entries
+    :param data_entries: list or iterable of data entries
     :return: dictionary of counts
     """
-    counts = {}
-    for entry in data_entries:
-        source = entry["source"]
-        if source in counts:
-            counts[source] += 1
-        else:
-            counts[source] = 1
-    return counts
+    return aggregate(data_entries, SourceCounts())
 
 
 def get_pos_tag_counts(data_entries):
     """
     Count the number of part of speech tags in total for all data entries.
 
-    :param data_entries: list of data entries
+    :param data_entries: list or iterable of data entries
     :return: dictionary of counts
     """
-    counts = {}
-    for entry in data_entries:
-        for tag in entry["tags"]:
-            part_of_speech = tag[1]
-            if part_of_speech in counts:
-                counts[part_of_speech] += 1
-            else:
-                counts[part_of_speech] = 1
-
-    return counts
+    return aggregate(data_entries, PosTagCounts())
 
 
 def get_sentiment_counts(data_entries):
     """
     Each data entry has a sentiment score. Classify data entries as positive, negative, neutral, etc.
 
-    :param data_entries: list of data entries
+    :param data_entries: list or iterable of data entries
     :return: dictionary of counts
     """
-    counts = {}
-    for entry in data_entries:
-        polarity_score = entry["polarity"]
-        if polarity_score <= -0.6:
-            sentiment = "very negative"
-        elif polarity_score < -0.2:
-            sentiment = "negative"
-        elif polarity_score < 0.2:
-            sentiment = "neutral"
-        elif polarity_score < 0.6:
-            sentiment = "positive"
-        else:
-            sentiment = "very positive"
-
-        if sentiment in counts:
-            counts[sentiment] += 1
-        else:
-            counts[sentiment] = 1
-    return counts
+    return aggregate(data_entries, SentimentCounts())
 
 
-def get_sent_subj_data(data_entries):
+def get_sent_subj_data(data_entries, max_points=None):
     """
     Get both the polarity and subjectivity scores for all data entries.
     Return as a list of tuples, [(polarity, subjectivity)]
 
-    :param data_entries: list of data entries
+    :param data_entries: list or iterable of data entries
+    :param max_points: optional maximum number of tuples. With more data entries than that, a uniform random sample of
+                       them is returned instead, so memory doesn't grow with the number of entries.
     :return: list of tuples
     """
-    all_data = []
+    return aggregate(data_entries, SentSubjSample(max_points))
+
+
+def drop_near_duplicates(data_entries):
+    """
+    Keep only the first data entry of each near-duplicate cluster, for output files written with --near-duplicates.
+    Data entries without a cluster are all kept.
+
+    :param data_entries: list or iterable of data entries
+    :return: generator of data entries
+    """
+    seen = set()
     for entry in data_entries:
-        all_data.append((entry["polarity"], entry["subjectivity"]))
-    return all_data
+        if "cluster_id" in entry:
+            if entry["cluster_id"] in seen:
+                continue
+            seen.add(entry["cluster_id"])
+        yield entry
 
 
-def title_builder(main, query, date):
+class RunningAggregates:
+    """
+    The hashtag, source, part-of-speech tag and sentiment counts of a crawl, updated as new data entries come in,
+    instead of recomputed from the whole file.
+    """
+    # the data entry fields the counts are computed from
+    FIELDS = ("hashtags", "source", "tags", "polarity")
+
+    def __init__(self):
+        self.engine = Engine()
+        self.hashtag_counts = self.engine.register(HashtagCounts())
+        self.source_counts = self.engine.register(SourceCounts())
+        self.pos_tag_counts = self.engine.register(PosTagCounts())
+        self.sentiment_counts = self.engine.register(SentimentCounts())
+
+    @property
+    def num_entries(self):
+        return self.engine.num_entries
+
+    def add(self, data_entries):
+        """
+        Update the counts with new data entries.
+        :param data_entries: list of data entries
+        """
+        self.engine.add(data_entries)
+
+    def to_dict(self):
+        return {
+            "num_entries": self.num_entries,
+            "hashtags": self.hashtag_counts.result(),
+            "sources": self.source_counts.result(),
+            "pos_tags": self.pos_tag_counts.result(),
+            "sentiment": self.sentiment_counts.result()
+        }
+
+    def save(self, path):
+        """
+        Atomically write the counts to path as JSON, so readers never see a half written file.
+        :param path: string, output file path
+        """
+        data = self.to_dict()
+        data["updated"] = datetime.datetime.now().isoformat()
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps(data))
+        os.replace(tmp_path, path)
+
+
+def title_builder(main, query, date, until=None):
     """
     Build a string for a plot title.
 
     :param main: Main substance of the title.
     :param query: the query used
     :param date: timestamp
+    :param until: optional timestamp, the end of a date range starting at date
     :return: string, a plot title
     """
+    if until is not None:
+        return main + ", for the search query '" + query + "', " + "from (" + date + ") until (" + until + ")"
     return main + ", for the search query '" + query + "', " + "for the last 7 days starting at (" + date + ")"
 
 
@@ -173,54 +229,107 @@ def get_pos_name(tag):
 if __name__ == "__main__":
     # command line parsing
     parser = argparse.ArgumentParser(description="Preprocess CSV files")
-    parser.add_argument("-i", "--input", help="Specify input file path", required=True)
+    parser.add_argument("-i", "--input", help="Specify input file path, a twitter_search.py output file, its block "
+                                              "file (.blk) or its columnar copy (a .cols directory)")
+    parser.add_argument("-c", "--catalog", help="Instead of an input file, analyse the crawls of a twitter_search.py "
+                                                "output directory, selected from its catalog (see catalog.py)")
+    parser.add_argument("-q", "--query", help="With --catalog, only analyse crawls whose query has all these words")
+    parser.add_argument("--since", help="With --catalog, only analyse tweets created on or after this date (UTC), "
+                                        "eg. 2018-06-01")
+    parser.add_argument("--until", help="With --catalog, only analyse tweets created before this date (UTC)")
     parser.add_argument("-o", "--output", help="Specify output directory", required=True)
+    parser.add_argument("--dedupe", help="Only count the first tweet of each near-duplicate cluster",
+                        action="store_true")
     args = parser.parse_args()
-
-    input_filepath = args.input
-
-    # retrieve the original query used in the search
-    basename = os.path.basename(input_filepath)
-
-    query_list = basename.split(FILE_DELIMITER_CHAR)[:-1]
-    query_used = " ".join(query_list)
-
-    # retrieve the timestamp
-    timestamp = basename.split(FILE_DELIMITER_CHAR)[-1]
+    if (args.input is None) == (args.catalog is None):
+        parser.error("specify either an input file (-i) or an output directory to select crawls from (--catalog)")
+
+    partitions = None
+    is_columnar = False
+    title_dates = ()
+    if args.catalog is not None:
+        # the crawls of the query and dates, from the catalog, without opening the other files
+        data_catalog = catalog.Catalog(args.catalog)
+        data_catalog.update()
+        partitions = data_catalog.select("search", args.query, args.since, args.until)
+        if not partitions:
+            print("No crawls in %s match the query and dates" % args.catalog)
+            sys.exit(1)
+        print("Analysing %d crawls: %s" % (len(partitions), ", ".join(partition.name for partition in partitions)))
+        query_used = args.query or " / ".join(sorted(set(partition.query or "" for partition in partitions)))
+        # until is excluded, so by default it is the day after the newest tweet
+        last_date = datetime.date.fromisoformat(max(partition.last or partition.date for partition in partitions)[:10])
+        title_dates = (args.since or min(partition.first or partition.date for partition in partitions)[:10],
+                       args.until or str(last_date + datetime.timedelta(days=1)))
+        basename = FILE_DELIMITER_CHAR.join((args.query or "all").split() + list(title_dates))
+    else:
+        input_filepath = args.input.rstrip(os.sep)
+        is_columnar = os.path.isdir(input_filepath)
+
+        basename = os.path.basename(input_filepath)
+        if is_columnar and basename.endswith(columnar.COLUMNAR_SUFFIX):
+            basename = basename[:-len(columnar.COLUMNAR_SUFFIX)]
+        elif basename.endswith(blocks.BLOCKS_SUFFIX):
+            basename = basename[:-len(blocks.BLOCKS_SUFFIX)]
+
+        # retrieve the original query used in the search, and its date, from the catalog of its directory
+        data_filepath = os.path.join(os.path.dirname(input_filepath), basename) if is_columnar else input_filepath
+        partition = None
+        if os.path.isfile(data_filepath):
+            partition = catalog.Catalog(os.path.dirname(data_filepath) or os.curdir).lookup(data_filepath)
+        if partition is not None:
+            query_used = partition.query or ""
+            title_dates = (partition.date,)
+        else:
+            # a columnar copy without its output file: the query and date are in the name
+            query_used = " ".join(basename.split(FILE_DELIMITER_CHAR)[:-1])
+            title_dates = (basename.split(FILE_DELIMITER_CHAR)[-1],)
 
     # determine where output files should be placed
     output_filepath = os.path.join(args.output, basename)
 
-    with open(input_filepath, "r") as input_file:
-        # read in data as a list of dictionaries
-        data_entries = list(map(lambda e: json.loads(e), input_file.readlines()))
-
-        # bar graph of hashtag frequencies
-        hashtag_counts = get_hashtag_counts(data_entries)
-        plots.create_bar_graph(hashtag_counts, 12, "Hashtags", 0.15,
-                               title_builder("Hashtag frequencies", query_used, timestamp),
-                               output_filepath + "-hashtags")
-
-        # pie chart of source frequencies
-        source_counts = get_source_counts(data_entries)
-        plots.create_pie_chart(source_counts, 7, title_builder("Source of Tweets", query_used, timestamp),
-                               output_filepath + "-sources")
-
-        # bar graph of part-of-speech frequencies. for parts of speech, also get name mappings
-        pos_counts = get_pos_tag_counts(data_entries)
-        pos_counts = dict(map(lambda kv: (get_pos_name(kv[0]), kv[1]), pos_counts.items()))
-        plots.create_bar_graph(pos_counts, 12, "Part-of-speech Tags", 0.15,
-                               title_builder("Part-of-speech Tag Frequencies", query_used, timestamp),
-                               output_filepath + "-postags")
-
-        # pie chart for sentiment scores
-        sentiment_counts = get_sentiment_counts(data_entries)
-        plots.create_pie_chart_fixed_pieces(sentiment_counts,
-                                            title_builder("Sentiment Ratings", query_used, timestamp),
-                                            output_filepath + "-sentiment")
-
-        # scatter plot for sentiment and subjectivity
-        sent_subj_data = get_sent_subj_data(data_entries)
-        plots.create_scatter_plot(sent_subj_data,
-                                  title_builder("Polarity and Subjectivity", query_used, timestamp),
-                                  "Polarity", "Subjectivity", output_filepath + "-sentsubj")
+    def iter_input(*columns):
+        """
+        Stream the data entries once, for every chart. Only the given fields are read from columnar input.
+        """
+        if partitions is not None:
+            data_entries = catalog.iter_entries(args.catalog, partitions, args.since, args.until)
+        elif is_columnar:
+            data_entries = columnar.iter_entries(input_filepath, columns + (("cluster_id",) if args.dedupe else ()))
+        else:
+            data_entries = iter_data_entries(input_filepath)
+        return drop_near_duplicates(data_entries) if args.dedupe else data_entries
+
+    # every chart registers its aggregator, and they are all computed in one pass over the input
+    engine = Engine()
+    hashtag_counts = engine.register(HashtagCounts())
+    source_counts = engine.register(SourceCounts())
+    pos_counts = engine.register(PosTagCounts())
+    sentiment_counts = engine.register(SentimentCounts())
+    sent_subj_data = engine.register(SentSubjSample(MAX_SCATTER_POINTS))
+    engine.run(iter_input(*engine.fields()))
+
+    # bar graph of hashtag frequencies
+    plots.create_bar_graph(hashtag_counts.result(), 12, "Hashtags", 0.15,
+                           title_builder("Hashtag frequencies", query_used, *title_dates),
+                           output_filepath + "-hashtags")
+
+    # pie chart of source frequencies
+    plots.create_pie_chart(source_counts.result(), 7, title_builder("Source of Tweets", query_used, *title_dates),
+                           output_filepath + "-sources")
+
+    # bar graph of part-of-speech frequencies. for parts of speech, also get name mappings
+    pos_names = dict(map(lambda kv: (get_pos_name(kv[0]), kv[1]), pos_counts.result().items()))
+    plots.create_bar_graph(pos_names, 12, "Part-of-speech Tags", 0.15,
+                           title_builder("Part-of-speech Tag Frequencies", query_used, *title_dates),
+                           output_filepath + "-postags")
+
+    # pie chart for sentiment scores
+    plots.create_pie_chart_fixed_pieces(sentiment_counts.result(),
+                                        title_builder("Sentiment Ratings", query_used, *title_dates),
+                                        output_filepath + "-sentiment")
+
+    # scatter plot for sentiment and subjectivity
+    plots.create_scatter_plot(sent_subj_data.result(),
+                              title_builder("Polarity and Subjectivity", query_used, *title_dates),
+                              "Polarity", "Subjectivity", output_filepath + "-sentsubj")
@@ -13,10 +13,14 @@ trend_data = [
     },
     ...
 ]
+
+The date of a trends file comes from the catalog of its directory (see catalog.py). With --catalog, the reports are
+written for every trends file of a date range.
 """
 import argparse
-import json
 import os
+import catalog
+from serializers import read_entries
 
 
 def top_ten_all(trends_data, num_trends, output_filepath):
@@ -116,16 +120,30 @@ def common_trending(trends_data, num_results, output_filepath):
 if __name__ == "__main__":
     # command line parsing
     parser = argparse.ArgumentParser(description="Preprocess CSV files")
-    parser.add_argument("-i", "--input", help="Specify input file path", required=True)
+    parser.add_argument("-i", "--input", help="Specify input file path")
+    parser.add_argument("-c", "--catalog", help="Instead of an input file, analyse the trends files of a "
+                                                "twitter_trends.py output directory, selected from its catalog (see "
+                                                "catalog.py)")
+    parser.add_argument("--since", help="With --catalog, only analyse trends from this date on (UTC), eg. 2018-06-01")
+    parser.add_argument("--until", help="With --catalog, only analyse trends from before this date (UTC)")
     parser.add_argument("-o", "--output", help="Specify output directory", required=True)
     args = parser.parse_args()
+    if (args.input is None) == (args.catalog is None):
+        parser.error("specify either an input file (-i) or an output directory to select files from (--catalog)")
 
-    input_filepath = args.input
     output_dir = args.output
-    timestamp = "-".join(input_filepath.split("-")[1:])
-
-    with open(input_filepath, "r") as input_file:
-        trends_data = list(map(lambda x: json.loads(x), input_file.readlines()))
+    if args.catalog is not None:
+        data_catalog = catalog.Catalog(args.catalog)
+        data_catalog.update()
+        inputs = [(os.path.join(args.catalog, partition.name), partition.date)
+                  for partition in data_catalog.select("trends", since=args.since, until=args.until)]
+    else:
+        # the date of the trends, from the catalog of their directory
+        partition = catalog.Catalog(os.path.dirname(args.input) or os.curdir).lookup(args.input)
+        inputs = [(args.input, partition.date if partition is not None else "-".join(args.input.split("-")[1:]))]
+
+    for input_filepath, timestamp in inputs:
+        trends_data = list(read_entries(input_filepath))
 
         # get a report of the top 10 trends of these locations
         top_ten_all(trends_data, 10, os.path.join(output_dir, "trends-top10" + "-" + timestamp))
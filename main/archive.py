@@ -0,0 +1,154 @@
+"""
+archive.py
+
+A compressed, append-only archive of the raw tweets of a crawl, and offline re-enrichment from it.
+
+tweet_to_data_entry only keeps a few fields of every tweet. With an archive of the full tweet JSON (the "_json" of the
+tweepy Status objects), a change to the cleaning or feature extraction only means reprocessing the archive, instead of
+downloading everything again against the rate limit.
+
+The archive is a sequence of gzip members, one per page of search results, each holding one raw tweet JSON object per
+line. Concatenated gzip members are themselves a valid gzip file (so `zcat` works), appending a page never rewrites
+what is already there, and a member cut off by a crash is simply ignored when reading.
+
+Usage, to rebuild the data entries of a crawl from its archive:
+    python archive.py -i "../output/search/Tim|Hortons|2018-06-06.raw.gz" -o "Tim|Hortons|2018-06-06" -w 4
+"""
+import argparse
+import json
+import os
+import zlib
+
+import tweepy
+
+import twitter_util
+from enrich_cache import EnrichmentCache
+from near_duplicates import NearDuplicateIndex, MAX_CLUSTERS
+from serializers import FORMATS, get_serializer
+
+COMPRESS_LEVEL = 6
+READ_SIZE = 1 << 20
+CHUNK_SIZE = twitter_util.ENRICH_CHUNK_SIZE
+
+
+def write_page(archive_file, raw_tweets, compress_level=COMPRESS_LEVEL):
+    """
+    Append one page of raw tweets to an archive, as a single gzip member.
+
+    :param archive_file: file object, opened for binary appending
+    :param raw_tweets: list of raw tweet dictionaries, eg. [tweet._json for tweet in results]
+    :param compress_level: gzip compression level, 1 (fast) to 9 (small)
+    """
+    if not raw_tweets:
+        return
+    lines = "".join(json.dumps(raw, separators=(",", ":")) + "\n" for raw in raw_tweets)
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, 31)
+    archive_file.write(compressor.compress(lines.encode("utf-8")) + compressor.flush())
+    archive_file.flush()
+
+
+def iter_archive(path):
+    """
+    Read the raw tweets of an archive, in the order they were written. A last member that was cut off is skipped.
+
+    :param path: string, path of the archive
+    :return: generator of raw tweet dictionaries
+    """
+    with open(path, "rb") as f:
+        decompressor = zlib.decompressobj(31)
+        member = []
+        data = b""
+        while True:
+            if not data:
+                data = f.read(READ_SIZE)
+                if not data:
+                    return
+            try:
+                member.append(decompressor.decompress(data))
+            except zlib.error:
+                # garbage after the last complete member, eg. a torn write
+                return
+            data = b""
+            if decompressor.eof:
+                for line in b"".join(member).splitlines():
+                    yield json.loads(line)
+                member = []
+                data = decompressor.unused_data
+                decompressor = zlib.decompressobj(31)
+
+
+def raw_to_status(raw):
+    """
+    Turn a raw tweet dictionary back into a tweepy Status object, the same as the API would have returned.
+    :param raw: raw tweet dictionary
+    :return: tweepy Status
+    """
+    return tweepy.models.Status.parse(None, raw)
+
+
+def reprocess(input_path, output_path, num_workers=None, chunk_size=CHUNK_SIZE, serializer=None):
+    """
+    Rebuild the data entries of a crawl from its archive, without any network access, and write them in archive
+    order. TextBlob runs on a pool of processes, a chunk of tweets at a time.
+
+    :param input_path: string, path of the archive
+    :param output_path: string, path of the output file to write
+    :param num_workers: number of worker processes, defaults to the number of cores
+    :param chunk_size: number of tweets handed to a worker at a time
+    :param serializer: format of the output file (see serializers.py), JSON lines by default
+    :return: number of data entries written
+    """
+    if serializer is None:
+        serializer = get_serializer()
+    count = 0
+    statuses = map(raw_to_status, iter_archive(input_path))
+    with open(output_path, "wb") as f:
+        f.write(serializer.header)
+        for entry in twitter_util.tweets_to_data_entries(statuses, num_workers, chunk_size):
+            f.write(serializer.dumps(entry))
+            count += 1
+    return count
+
+
+if __name__ == "__main__":
+    # command line parsing
+    parser = argparse.ArgumentParser(description="Rebuild data entries from a raw tweet archive, offline")
+    parser.add_argument("-i", "--input", help="Specify input archive path", required=True)
+    parser.add_argument("-o", "--output", help="Specify output file path", required=True)
+    parser.add_argument("-w", "--workers", help="Number of worker processes, defaults to the number of cores",
+                        type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", help="Number of tweets handed to a worker at a time", type=int,
+                        default=CHUNK_SIZE)
+    parser.add_argument("--cache", help="Path of an enrichment cache file, shared across runs")
+    parser.add_argument("--sentiment", help="Sentiment backend: TextBlob, or the batch lexicon scorer, which is "
+                                            "faster and gives the same scores (see lexicon_sentiment.py)",
+                        choices=twitter_util.SENTIMENT_BACKENDS, default="textblob")
+    parser.add_argument("--near-duplicates", help="Group near-duplicate tweets into clusters, only enrich the first "
+                                                  "tweet of each, and record the cluster on every data entry",
+                        action="store_true")
+    parser.add_argument("--max-clusters", help="Maximum number of near-duplicate clusters kept in memory", type=int,
+                        default=MAX_CLUSTERS)
+    parser.add_argument("--format", help="Format of the output file, see serializers.py", choices=FORMATS,
+                        default="json", dest="output_format")
+    args = parser.parse_args()
+    try:
+        serializer = get_serializer(args.output_format)
+    except ValueError as e:
+        parser.error(str(e))
+
+    twitter_util.set_sentiment_backend(args.sentiment)
+    cache = None
+    if args.cache:
+        cache = EnrichmentCache(path=args.cache)
+        twitter_util.set_enrichment_cache(cache)
+    index = None
+    if args.near_duplicates:
+        index = NearDuplicateIndex(max_clusters=args.max_clusters)
+        twitter_util.set_near_duplicate_index(index)
+
+    num_entries = reprocess(args.input, args.output, args.workers, args.chunk_size, serializer)
+    print("Rebuilt [%d] data entries. Saved to %s" % (num_entries, args.output))
+    if cache is not None:
+        print(cache.report())
+    if index is not None:
+        print(index.report())
@@ -0,0 +1,50 @@
+"""
+batching.py
+
+Splitting a stream of work into chunks, and running a function over the chunks on a process pool, in input order.
+
+Only uses the standard library, so that storage readers (blocks.py, corpus_reader.py) and the analysis scripts can use
+it without importing tweepy and TextBlob along with twitter_util.py.
+"""
+import collections
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def chunks(iterable, size):
+    """
+    Split an iterable into lists of at most size elements.
+    :return: generator of lists
+    """
+    chunk = []
+    for elem in iterable:
+        chunk.append(elem)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def map_chunks(function, work, num_workers=None):
+    """
+    Run function on a process pool, over a stream of (context, argument) pairs, and yield (context, result) pairs in
+    input order. Only a few chunks per worker are in flight at any time, so the input can be a generator of any length
+    without it all being pulled into memory.
+
+    :param function: picklable function of one argument
+    :param work: iterable of (context, argument) tuples, context stays in this process
+    :param num_workers: number of worker processes, defaults to the number of cores
+    :return: generator of (context, result) tuples
+    """
+    num_workers = num_workers or os.cpu_count()
+    pending = collections.deque()
+    with ProcessPoolExecutor(num_workers) as executor:
+        for context, argument in work:
+            pending.append((context, executor.submit(function, argument)))
+            if len(pending) >= 2 * num_workers:
+                context, future = pending.popleft()
+                yield context, future.result()
+        while pending:
+            context, future = pending.popleft()
+            yield context, future.result()
@@ -0,0 +1,44 @@
+"""
+benchmark_clean.py
+
+Microbenchmark for tweet cleaning: the step by step cleaner (clean_tweet_stepwise) against the fused clean_tweet and
+the clean_tweets batch version, on the texts of synthetic tweets from the replay server. Checks that all of them agree
+before timing anything.
+
+Usage:
+    python benchmark_clean.py --tweets 50000 --repeat 5
+"""
+import argparse
+import timeit
+
+import replay_server
+import twitter_util
+
+
+if __name__ == "__main__":
+    # command line parsing
+    parser = argparse.ArgumentParser(description="Benchmark the tweet cleaners")
+    parser.add_argument("--tweets", help="Number of synthetic tweet texts to clean", type=int, default=20000)
+    parser.add_argument("--repeat", help="Number of timed runs, the best one is reported", type=int, default=5)
+    parser.add_argument("--seed", help="Seed of the synthetic tweets", type=int, default=0)
+    args = parser.parse_args()
+
+    texts = [raw["full_text"] for raw in replay_server.synthetic_tweets(args.tweets, seed=args.seed)]
+    cleaners = [
+        ("stepwise", lambda: [twitter_util.clean_tweet_stepwise(s) for s in texts]),
+        ("fused", lambda: [twitter_util.clean_tweet(s) for s in texts]),
+        ("batch", lambda: twitter_util.clean_tweets(texts)),
+    ]
+
+    expected = cleaners[0][1]()
+    for name, clean in cleaners[1:]:
+        if clean() != expected:
+            raise SystemExit("%s: output differs from clean_tweet_stepwise" % name)
+
+    print("Cleaning [%d] tweet texts, best of %d" % (len(texts), args.repeat))
+    baseline = None
+    for name, clean in cleaners:
+        seconds = min(timeit.repeat(clean, number=1, repeat=args.repeat))
+        baseline = baseline or seconds
+        print("%-10s %8.1f ms %10.0f tweets/s %6.2fx" % (name, seconds * 1000, len(texts) / seconds,
+                                                          baseline / seconds))
@@ -0,0 +1,54 @@
+"""
+benchmark_enrich.py
+
+Throughput benchmark for batch enrichment (twitter_util.tweets_to_data_entries), on synthetic tweets from the replay
+server. Enriches the same tweets with 1, 2, ... up to N worker processes, and reports tweets/sec and the speedup over
+the sequential search_results_to_data_entries.
+
+Usage:
+    python benchmark_enrich.py --tweets 20000 -w 8
+    python benchmark_enrich.py --tweets 5000 -w 4 --chunk-size 100
+"""
+import argparse
+import os
+import time
+
+import archive
+import replay_server
+import twitter_util
+
+
+def time_enrichment(function):
+    """
+    :param function: function of no arguments, returning a list of data entries
+    :return: (data entries, seconds)
+    """
+    start = time.perf_counter()
+    data_entries = function()
+    return data_entries, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    # command line parsing
+    parser = argparse.ArgumentParser(description="Benchmark batch enrichment over a range of worker counts")
+    parser.add_argument("--tweets", help="Number of synthetic tweets to enrich", type=int, default=10000)
+    parser.add_argument("-w", "--workers", help="Maximum number of worker processes", type=int,
+                        default=os.cpu_count())
+    parser.add_argument("--chunk-size", help="Number of tweets handed to a worker at a time", type=int,
+                        default=twitter_util.ENRICH_CHUNK_SIZE)
+    parser.add_argument("--seed", help="Seed of the synthetic tweets", type=int, default=0)
+    args = parser.parse_args()
+
+    tweets = [archive.raw_to_status(raw) for raw in replay_server.synthetic_tweets(args.tweets, seed=args.seed)]
+    print("Enriching [%d] tweets, chunks of %d, %d cores" % (len(tweets), args.chunk_size, os.cpu_count()))
+
+    expected, baseline = time_enrichment(lambda: twitter_util.search_results_to_data_entries(tweets))
+    print("%-12s %10.1f tweets/s" % ("sequential", len(tweets) / baseline))
+
+    for num_workers in range(1, args.workers + 1):
+        data_entries, seconds = time_enrichment(
+            lambda: list(twitter_util.tweets_to_data_entries(tweets, num_workers, args.chunk_size)))
+        if data_entries != expected:
+            raise SystemExit("%d workers: data entries differ from search_results_to_data_entries" % num_workers)
+        print("%-12s %10.1f tweets/s %6.2fx" % ("%d workers" % num_workers, len(tweets) / seconds,
+                                                 baseline / seconds))
@@ -0,0 +1,164 @@
+"""
+benchmark_search.py
+
+End-to-end ingest benchmark for the search crawlers, run against the local replay server instead of the Twitter API.
+
+The replay server runs in a separate process, so that its memory (the whole replayed corpus) doesn't count towards
+the peak memory of the crawler. The benchmark runs the full fetch -> search_results_to_data_entries -> JSONL write
+loop, and reports tweets/sec, time spent per stage, and peak memory.
+
+Targets:
+    main    the crawl loop of main/twitter_search.py
+    tweety  tweety/twitter/search.py::twitter_search, followed by writing its results out as JSON lines
+
+Usage:
+    python benchmark_search.py --tweets 20000 --latency 0.05
+    python benchmark_search.py --target tweety --tweets 5000
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import replay_server
+import twitter_search
+from serializers import FORMATS, get_serializer
+from stats import StageStats
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "project")
+
+
+def serve(args, port_queue):
+    """
+    Run a replay server until the process is terminated. Puts the server url on port_queue once listening.
+
+    :param args: parsed command line arguments
+    :param port_queue: multiprocessing.Queue
+    """
+    if args.recording:
+        tweets = replay_server.load_recorded_tweets(args.recording)
+    else:
+        tweets = replay_server.synthetic_tweets(args.tweets, seed=args.seed)
+    server = replay_server.ReplayServer(tweets, latency=args.latency,
+                                        rate_limits={replay_server.SEARCH_PATH: args.rate_limit},
+                                        window=args.window)
+    port_queue.put(server.url)
+    server.serve_forever()
+
+
+class TimedAPI:
+    """
+    Wrap an API object, charging the time spent in search() to the "fetch" stage.
+    Used for crawlers that don't report their own stage timings.
+    """
+    def __init__(self, api, stats):
+        self.api = api
+        self.stats = stats
+
+    def search(self, *args, **kwargs):
+        with self.stats.time("fetch"):
+            results = self.api.search(*args, **kwargs)
+        self.stats.count("fetch", len(results))
+        return results
+
+
+def run_main(api, args, output_file, stats, serializer):
+    """
+    Benchmark the crawl loop of twitter_search.py.
+    :return: number of tweets downloaded
+    """
+    query = twitter_search.build_query(args.query)
+    writer = twitter_search.PageWriter(output_file, serializer, stats=stats)
+    if args.workers > 0:
+        return twitter_search.crawl_pipelined(api, query, writer, args.max_tweets, args.workers, args.processes)
+    return twitter_search.crawl(api, query, writer, args.max_tweets)
+
+
+def run_tweety(api, args, output_file, stats, serializer):
+    """
+    Benchmark the twitter_search function of the tweety Django app.
+    :return: number of tweets downloaded
+    """
+    sys.path.insert(0, os.path.abspath(PROJECT_DIR))
+    from tweety.twitter import search as tweety_search
+
+    start = time.perf_counter()
+    timed_api = TimedAPI(api, stats)
+    data_entries = tweety_search.twitter_search(args.query, args.max_tweets, api=timed_api)
+    # everything that wasn't spent fetching, was spent enriching
+    stats.add("enrich", time.perf_counter() - start - stats.seconds.get("fetch", 0.0), len(data_entries))
+
+    with stats.time("write", len(data_entries)):
+        for entry in data_entries:
+            output_file.write(serializer.dumps(entry))
+        output_file.flush()
+    return len(data_entries)
+
+
+def max_rss_mb():
+    """
+    :return: float, peak resident set size of this process so far, in MB
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+if __name__ == "__main__":
+    # command line parsing
+    parser = argparse.ArgumentParser(description="Benchmark the search crawlers against a local replay server")
+    parser.add_argument("--target", help="Crawler to benchmark", choices=["main", "tweety"], default="main")
+    parser.add_argument("-q", "--query", help="Query to search for", default="benchmark")
+    parser.add_argument("--recording", help="File of raw tweets to replay, one JSON object per line")
+    parser.add_argument("--tweets", help="Number of synthetic tweets to serve", type=int, default=10000)
+    parser.add_argument("--seed", help="Random seed for synthetic tweets", type=int, default=0)
+    parser.add_argument("--max-tweets", help="Stop the crawl after this many tweets", type=int,
+                        default=twitter_search.MAX_TWEETS)
+    parser.add_argument("--latency", help="Seconds to delay every response", type=float, default=0.0)
+    parser.add_argument("--rate-limit", help="Search requests allowed per window, 0 for no limit", type=int,
+                        default=0)
+    parser.add_argument("--window", help="Rate limit window, in seconds", type=int,
+                        default=replay_server.RATE_LIMIT_WINDOW)
+    parser.add_argument("-w", "--workers", help="Enrichment workers for the main target, 0 for the sequential crawl",
+                        type=int, default=0)
+    parser.add_argument("--processes", help="Use worker processes instead of threads for enrichment",
+                        action="store_true")
+    parser.add_argument("-o", "--output", help="Output file, defaults to a temporary file")
+    parser.add_argument("--format", help="Format of the output file, see serializers.py", choices=FORMATS,
+                        default="json", dest="output_format")
+    args = parser.parse_args()
+    try:
+        serializer = get_serializer(args.output_format)
+    except ValueError as e:
+        parser.error(str(e))
+
+    port_queue = multiprocessing.Queue()
+    server_process = multiprocessing.Process(target=serve, args=(args, port_queue), daemon=True)
+    server_process.start()
+    try:
+        replay_api = replay_server.ReplayAPI(port_queue.get(timeout=120))
+        stats = StageStats()
+        runner = run_main if args.target == "main" else run_tweety
+
+        output_path = args.output or tempfile.mkstemp(prefix="benchmark-search-")[1]
+        rss_before = max_rss_mb()
+        start = time.perf_counter()
+        with open(output_path, "wb") as f:
+            f.write(serializer.header)
+            tweet_count = runner(replay_api, args, f, stats, serializer)
+        total = time.perf_counter() - start
+        output_size = os.path.getsize(output_path)
+        if not args.output:
+            os.remove(output_path)
+    finally:
+        server_process.terminate()
+        server_process.join()
+
+    print("")
+    print("target:     %s" % args.target)
+    print("tweets:     %d in %.3fs, %.1f tweets/s" % (tweet_count, total, tweet_count / total if total else 0.0))
+    print("output:     %.1f MB" % (output_size / 1024.0 / 1024.0))
+    print("peak rss:   %.1f MB (%.1f MB before the crawl)" % (max_rss_mb(), rss_before))
+    for line in stats.report():
+        print(line)
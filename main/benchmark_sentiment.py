@@ -0,0 +1,113 @@
+"""
+benchmark_sentiment.py
+
+Benchmark of the lexicon sentiment backend against TextBlob: scores the same cleaned texts with both, and reports the
+throughput of each, and how closely the lexicon scores agree with TextBlob's.
+
+Without an input file, the cleaned texts of synthetic tweets from the replay server are used. They have no punctuation,
+so with --punctuation, periods, emoticons and other punctuation are scattered through them, at the start and end of
+words and between them, to compare the two on the texts that TextBlob's tokenizer handles specially.
+
+Usage:
+    python benchmark_sentiment.py -i "../output/search/Tim|Hortons|2018-06-06"
+    python benchmark_sentiment.py --tweets 50000 --punctuation
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+from textblob import TextBlob
+
+import archive
+import replay_server
+import twitter_util
+from lexicon_sentiment import get_scorer
+from serializers import read_entries
+
+TOLERANCE = 1e-9
+PUNCTUATION_PIECES = [".", "..", "...", "!", "!!", "?", ",", ";", ":", "'", "\"", "(", ")", "-", "\u201d", ":)", ":(",
+                      ";)", "<3", ":-)", ": )", ":D", "x D", "(!)", "e.g.", "Mr.", "u.s."]
+
+
+def punctuate(texts, seed=0):
+    """
+    :param texts: list of strings
+    :param seed: seed of the punctuation
+    :return: list of strings, the texts with punctuation scattered through them
+    """
+    rng = random.Random(seed)
+    punctuated = []
+    for text in texts:
+        words = text.split()
+        for i, word in enumerate(words):
+            r = rng.random()
+            if r < 0.2:
+                words[i] = rng.choice(PUNCTUATION_PIECES) + word
+            elif r < 0.4:
+                words[i] = word + rng.choice(PUNCTUATION_PIECES)
+            elif r < 0.5:
+                words[i] = word + " " + rng.choice(PUNCTUATION_PIECES)
+        punctuated.append(" ".join(words))
+    return punctuated
+
+
+def textblob_scores(texts):
+    """
+    :param texts: list of cleaned tweet texts
+    :return: tuple of 2 arrays, the TextBlob polarity and subjectivity of every text
+    """
+    sentiments = [TextBlob(text).sentiment for text in texts]
+    return (np.array([s.polarity for s in sentiments], dtype=np.float64),
+            np.array([s.subjectivity for s in sentiments], dtype=np.float64))
+
+
+def timed(function, *args):
+    """
+    :return: (result of function, seconds it took)
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    # command line parsing
+    parser = argparse.ArgumentParser(description="Benchmark the lexicon sentiment backend against TextBlob")
+    parser.add_argument("-i", "--input", help="Specify a twitter_search.py output file to take the texts from")
+    parser.add_argument("--tweets", help="Number of synthetic tweets, without an input file", type=int, default=20000)
+    parser.add_argument("--seed", help="Seed of the synthetic tweets", type=int, default=0)
+    parser.add_argument("--batch-size", help="Number of texts scored at a time by the lexicon backend", type=int,
+                        default=twitter_util.ENRICH_CHUNK_SIZE)
+    parser.add_argument("--punctuation", help="Scatter punctuation and emoticons through the texts",
+                        action="store_true")
+    args = parser.parse_args()
+
+    if args.input:
+        texts = [entry["cleaned"] for entry in read_entries(args.input)]
+    else:
+        tweets = map(archive.raw_to_status, replay_server.synthetic_tweets(args.tweets, seed=args.seed))
+        texts = [twitter_util.clean_tweet(tweet.full_text) for tweet in tweets]
+    if args.punctuation:
+        texts = punctuate(texts, args.seed)
+
+    scorer = get_scorer()
+    (expected_polarity, expected_subjectivity), textblob_time = timed(textblob_scores, texts)
+
+    def lexicon_scores():
+        batches = [scorer.score(batch) for batch in twitter_util.chunks(texts, args.batch_size)]
+        return np.concatenate([b[0] for b in batches]), np.concatenate([b[1] for b in batches])
+
+    (polarity, subjectivity), lexicon_time = timed(lexicon_scores)
+
+    difference = np.maximum(np.abs(polarity - expected_polarity), np.abs(subjectivity - expected_subjectivity))
+    agreeing = np.count_nonzero(difference <= TOLERANCE)
+    print("Scored [%d] texts" % len(texts))
+    print("%-10s %10.0f texts/s" % ("textblob", len(texts) / textblob_time))
+    print("%-10s %10.0f texts/s (%.1fx)" % ("lexicon", len(texts) / lexicon_time, textblob_time / lexicon_time))
+    print("%.4f%% of the texts agree within %g, max difference %g"
+          % (100.0 * agreeing / max(len(texts), 1), TOLERANCE, difference.max() if len(texts) else 0.0))
+    for i in np.flatnonzero(difference > TOLERANCE)[:10]:
+        print("  %r: textblob (%.4f, %.4f), lexicon (%.4f, %.4f)" % (texts[i], expected_polarity[i],
+                                                                    expected_subjectivity[i], polarity[i],
+                                                                    subjectivity[i]))
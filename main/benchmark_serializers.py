@@ -0,0 +1,86 @@
+"""
+benchmark_serializers.py
+
+Benchmark of the output file formats (see serializers.py): writes the same data entries in every format, and reports
+the encode and decode throughput of each, and the size of the file. Also checks that every format reads back the
+entries it was given.
+
+Without an input file, the data entries of synthetic tweets from the replay server are used.
+
+Usage:
+    python benchmark_serializers.py -i "../output/search/Tim|Hortons|2018-06-06"
+    python benchmark_serializers.py --tweets 50000 --repeat 5
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import archive
+import replay_server
+import twitter_util
+from serializers import FORMATS, get_serializer, read_entries
+
+
+def encode(serializer, data_entries, path):
+    """
+    :return: seconds it took to write data_entries to path
+    """
+    start = time.perf_counter()
+    with open(path, "wb") as f:
+        f.write(serializer.header)
+        for entry in data_entries:
+            f.write(serializer.dumps(entry))
+    return time.perf_counter() - start
+
+
+def decode(path):
+    """
+    :return: (list of the entries of path, seconds it took to read them)
+    """
+    start = time.perf_counter()
+    entries = list(read_entries(path))
+    return entries, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    # command line parsing
+    parser = argparse.ArgumentParser(description="Benchmark the output file formats")
+    parser.add_argument("-i", "--input", help="Specify a twitter_search.py output file to take the entries from")
+    parser.add_argument("--tweets", help="Number of synthetic tweets, without an input file", type=int, default=20000)
+    parser.add_argument("--seed", help="Seed of the synthetic tweets", type=int, default=0)
+    parser.add_argument("--formats", help="Formats to compare", nargs="+", choices=FORMATS, default=list(FORMATS))
+    parser.add_argument("--repeat", help="Number of runs of each format, the fastest one counts", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.input:
+        data_entries = list(read_entries(args.input))
+    else:
+        tweets = map(archive.raw_to_status, replay_server.synthetic_tweets(args.tweets, seed=args.seed))
+        # lists instead of tuples, as they are in an output file
+        data_entries = [json.loads(json.dumps(entry)) for entry in twitter_util.tweets_to_data_entries(tweets)]
+
+    print("Loaded [%d] entries" % len(data_entries))
+    print("%-10s %12s %12s %10s  %s" % ("format", "encode/s", "decode/s", "size MB", "round trip"))
+    fd, path = tempfile.mkstemp(prefix="benchmark-serializers-")
+    os.close(fd)
+    try:
+        for name in args.formats:
+            try:
+                serializer = get_serializer(name)
+            except ValueError as e:
+                print("%-10s skipped, %s" % (name, e))
+                continue
+            encode_time = min(encode(serializer, data_entries, path) for _ in range(args.repeat))
+            decode_time = None
+            for _ in range(args.repeat):
+                entries, seconds = decode(path)
+                decode_time = seconds if decode_time is None else min(decode_time, seconds)
+            mismatches = sum(1 for a, b in zip(entries, data_entries) if a != b)
+            mismatches += abs(len(entries) - len(data_entries))
+            print("%-10s %12.0f %12.0f %10.2f  %s" % (name, len(data_entries) / encode_time,
+                                                      len(data_entries) / decode_time, os.path.getsize(path) / 1e6,
+                                                      "ok" if not mismatches else "%d entries differ" % mismatches))
+    finally:
+        os.remove(path)
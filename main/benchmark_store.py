@@ -0,0 +1,97 @@
+"""
+benchmark_store.py
+
+Ingest rate of the tweet store (see tweet_store.py and project/tweety/store.py), against the database of the given
+Django settings: the data entries of synthetic tweets are written with batched bulk_create, once as new tweets, then
+again from an overlapping query, whose tweets are already stored, and a sample is written one row at a time, with
+save(), for comparison.
+
+The tweets are deleted again at the end. The database needs the tables of the tweety app:
+    cd ../project && python manage.py migrate tweety
+
+Usage:
+    python benchmark_store.py --tweets 20000
+    python benchmark_store.py --batch-size 1000
+"""
+import argparse
+import time
+
+import archive
+import replay_server
+import twitter_util
+from tweet_store import SETTINGS_MODULE, setup_django
+
+QUERY = "benchmark store"
+OVERLAP_QUERY = "benchmark store overlap"
+
+
+def timed(function, *args):
+    """
+    :return: (result of function, seconds it took)
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def save_one_by_one(store, pairs, query):
+    """
+    Write tweets one row at a time, the way a naive ingestion would.
+    :param pairs: list of (tweet id, data entry) tuples
+    """
+    for tweet_id, entry in pairs:
+        tweet, hashtags, mentions = store.entry_to_rows(tweet_id, entry)
+        tweet.save()
+        for row in hashtags + mentions:
+            row.save()
+        tweet.queries.add(query)
+
+
+if __name__ == "__main__":
+    # command line parsing
+    parser = argparse.ArgumentParser(description="Benchmark ingestion into the tweet store")
+    parser.add_argument("--tweets", help="Number of synthetic tweets", type=int, default=20000)
+    parser.add_argument("--seed", help="Seed of the synthetic tweets", type=int, default=0)
+    parser.add_argument("--one-by-one", help="Number of tweets written one row at a time, for comparison", type=int,
+                        default=1000)
+    parser.add_argument("--batch-size", help="Number of tweets written at a time", type=int, default=None)
+    parser.add_argument("--settings", help="Django settings module of the database", default=SETTINGS_MODULE)
+    args = parser.parse_args()
+
+    setup_django(args.settings)
+    from django.db import connection
+    from tweety import store
+    from tweety.models import Query, Tweet
+    batch_size = args.batch_size or store.BATCH_SIZE
+
+    tweets = list(map(archive.raw_to_status, replay_server.synthetic_tweets(args.tweets, seed=args.seed)))
+    pairs = list(zip([tweet.id for tweet in tweets], twitter_util.tweets_to_data_entries(tweets)))
+    if Tweet.objects.filter(id__in=[tweet_id for tweet_id, _ in pairs[:1000]]).exists():
+        raise SystemExit("the database already has some of the synthetic tweets, use another --seed")
+
+    print("Ingesting [%d] tweets into %s (%s)" % (len(pairs), connection.settings_dict["NAME"], connection.vendor))
+    sample, bulk = pairs[:args.one_by_one], pairs[args.one_by_one:]
+    try:
+        new_count, seconds = timed(store.ingest_entries, bulk, QUERY, batch_size)
+        print("%-12s %8d tweets %8.2fs %10.0f tweets/s, %d new" % ("bulk", len(bulk), seconds,
+                                                                    len(bulk) / seconds, new_count))
+
+        # half of the tweets were already found by the first query
+        overlap = bulk[len(bulk) // 2:] + sample
+        new_count, seconds = timed(store.ingest_entries, overlap, OVERLAP_QUERY, batch_size)
+        print("%-12s %8d tweets %8.2fs %10.0f tweets/s, %d new" % ("overlapping", len(overlap), seconds,
+                                                                    len(overlap) / seconds, new_count))
+
+        Tweet.objects.filter(id__in=[tweet_id for tweet_id, _ in sample]).delete()
+        if sample:
+            _, seconds = timed(save_one_by_one, store, sample, store.get_query(QUERY))
+            print("%-12s %8d tweets %8.2fs %10.0f tweets/s" % ("one by one", len(sample), seconds,
+                                                                len(sample) / seconds))
+
+        stored = Tweet.objects.filter(queries__text__in=[QUERY, OVERLAP_QUERY]).distinct().count()
+        print("stored:      %d distinct tweets, %d for '%s'" % (stored, len(store.query_data_entries(OVERLAP_QUERY)),
+                                                               OVERLAP_QUERY))
+    finally:
+        for start in range(0, len(pairs), batch_size):
+            Tweet.objects.filter(id__in=[tweet_id for tweet_id, _ in pairs[start:start + batch_size]]).delete()
+        Query.objects.filter(text__in=[QUERY, OVERLAP_QUERY]).delete()
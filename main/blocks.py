@@ -0,0 +1,478 @@
+"""
+blocks.py
+
+A block-compressed container for data entries, with an index, so that a date range or a single entry of a big crawl
+can be read without decompressing the whole file (as a gzip stream would need).
+
+A block file (output file name + ".blk") is:
+    - BLOCKS_HEADER, then the name of the format of the entries (see serializers.py) on a line of its own
+    - blocks of up to block_size data entries, each compressed on its own with zlib, and prefixed with BLOCK_PREFIX:
+      the compressed size, and the number of entries. Inside a block, the entries are in the format of the file,
+      without its header.
+    - the index, a JSON list with, for every block: its offset, compressed size, number of entries, position of its
+      first entry in the file, and the min/max created_at of its entries (seconds since the epoch, or null when the
+      entries don't have a created_at)
+    - FOOTER: the size of the index, and FOOTER_MAGIC
+Tweets are written newest first, so every block covers a short stretch of time, and a date range only touches the few
+blocks whose min/max created_at overlap it.
+
+The index is only written when the file is closed. A file without one (a writer that died) is still readable: the
+index is rebuilt by walking the block prefixes, and a block that was cut off is dropped. Reopening such a file with
+BlockWriter does the same, and continues after the last complete block.
+
+Blocks are independent, so they can be read in parallel: BlockReader.iter_entries decompresses blocks ahead on a pool
+of threads (zlib releases the GIL), and BlockReader.map_blocks decodes blocks and runs a function over each one on a
+pool of processes, so that only its (small) results come back, eg. the hashtag counts of every block.
+
+Usage, to convert an output file:
+    python blocks.py -i "../output/search/Tim|Hortons|2018-06-06"
+and to read from it:
+    with BlockReader("../output/search/Tim|Hortons|2018-06-06.blk") as reader:
+        entry = reader.entry(150000)
+        for entry in reader.date_range("2018-06-05", "2018-06-06"):
+            ...
+"""
+import argparse
+import bisect
+import collections
+import io
+import json
+import os
+import struct
+import sys
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from batching import map_chunks
+from records import parse_created_at
+from serializers import FORMATS, get_serializer, read_entries
+
+BLOCKS_SUFFIX = ".blk"
+BLOCKS_HEADER = b"\x00tweets-blocks\x01\n"
+BLOCK_PREFIX = struct.Struct("<II")
+FOOTER = struct.Struct("<Q8s")
+FOOTER_MAGIC = b"TWBLKIDX"
+BLOCK_SIZE = 5000
+COMPRESS_LEVEL = 6
+
+
+def block_path(output_filepath):
+    """
+    :param output_filepath: string, the output file of a crawl
+    :return: string, path of the block file of the output file
+    """
+    return output_filepath + BLOCKS_SUFFIX
+
+
+def is_block_file(path):
+    """
+    :param path: string, path of a file
+    :return: True if the file is a block file
+    """
+    if not os.path.isfile(path):
+        return False
+    with open(path, "rb") as f:
+        return f.read(len(BLOCKS_HEADER)) == BLOCKS_HEADER
+
+
+class Block:
+    """
+    The index entry of a block.
+
+    :param offset: int, position of the block prefix in the file
+    :param size: int, compressed size of the block, without its prefix
+    :param num_entries: int, number of entries in the block
+    :param first_entry: int, position of the first entry of the block among all the entries of the file
+    :param min_created_at: int, earliest created_at of the block, in seconds since the epoch, or None
+    :param max_created_at: int, latest created_at of the block, or None
+    """
+    __slots__ = ("offset", "size", "num_entries", "first_entry", "min_created_at", "max_created_at")
+
+    def __init__(self, offset, size, num_entries, first_entry, min_created_at=None, max_created_at=None):
+        self.offset = offset
+        self.size = size
+        self.num_entries = num_entries
+        self.first_entry = first_entry
+        self.min_created_at = min_created_at
+        self.max_created_at = max_created_at
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    @staticmethod
+    def from_dict(d):
+        return Block(**d)
+
+    def end(self):
+        """
+        :return: int, position just after the block in the file
+        """
+        return self.offset + BLOCK_PREFIX.size + self.size
+
+    def overlaps(self, since, until):
+        """
+        :param since: int, seconds since the epoch, or None for no lower bound
+        :param until: int, seconds since the epoch (excluded), or None for no upper bound
+        :return: True if the block may hold entries created in [since, until)
+        """
+        if self.min_created_at is None:
+            return True
+        return (since is None or self.max_created_at >= since) and (until is None or self.min_created_at < until)
+
+
+############
+# Encoding #
+############
+def created_at_range(data_entries):
+    """
+    :return: tuple (min, max) created_at of the data entries, in seconds since the epoch, or (None, None) if they
+             don't all have one
+    """
+    if not data_entries or any("created_at" not in entry for entry in data_entries):
+        return None, None
+    timestamps = [parse_created_at(entry["created_at"]) for entry in data_entries]
+    return min(timestamps), max(timestamps)
+
+
+def decode_block(data, output_format):
+    """
+    :param data: bytes, a decompressed block
+    :param output_format: string, name of the format of its entries
+    :return: list of data entries
+    """
+    return list(get_serializer(output_format).load_stream(io.BytesIO(data)))
+
+
+def map_block(argument):
+    """
+    Decompress and decode one block, and run a function over its entries. Runs in a worker process.
+
+    :param argument: tuple (function, compressed bytes of the block, name of the format of its entries)
+    :return: result of the function
+    """
+    function, data, output_format = argument
+    return function(decode_block(zlib.decompress(data), output_format))
+
+
+def scan_blocks(f, offset, size, output_format):
+    """
+    Rebuild the index of a block file without one, by walking the block prefixes. Every block is decompressed, for
+    its created_at range.
+
+    :param f: binary file object of the block file
+    :param offset: int, position of the first block
+    :param size: int, size of the file
+    :param output_format: string, format of the entries
+    :return: list of Blocks
+    """
+    blocks = []
+    first_entry = 0
+    while offset + BLOCK_PREFIX.size <= size:
+        f.seek(offset)
+        block_size, num_entries = BLOCK_PREFIX.unpack(f.read(BLOCK_PREFIX.size))
+        data = f.read(block_size)
+        if len(data) < block_size:
+            break
+        try:
+            payload = zlib.decompress(data)
+        except zlib.error:
+            break
+        entries = decode_block(payload, output_format)
+        if len(entries) != num_entries:
+            break
+        blocks.append(Block(offset, block_size, num_entries, first_entry, *created_at_range(entries)))
+        first_entry += num_entries
+        offset = blocks[-1].end()
+    return blocks
+
+
+def read_index(f):
+    """
+    :param f: binary file object of a block file
+    :return: tuple (list of Blocks, name of the format, position of the first block, True if the index was read from
+             the footer)
+    """
+    if f.read(len(BLOCKS_HEADER)) != BLOCKS_HEADER:
+        raise ValueError("%s isn't a block file" % getattr(f, "name", f))
+    output_format = f.readline().decode("ascii").strip()
+    if output_format not in FORMATS:
+        raise ValueError("%s has an unknown format %r" % (getattr(f, "name", f), output_format))
+    start = f.tell()
+    size = f.seek(0, os.SEEK_END)
+    if size >= start + FOOTER.size:
+        f.seek(size - FOOTER.size)
+        index_size, magic = FOOTER.unpack(f.read(FOOTER.size))
+        if magic == FOOTER_MAGIC:
+            f.seek(size - FOOTER.size - index_size)
+            index = json.loads(f.read(index_size).decode("utf-8"))
+            return [Block.from_dict(block) for block in index], output_format, start, True
+    return scan_blocks(f, start, size, output_format), output_format, start, False
+
+
+###########
+# Writing #
+###########
+class BlockWriter:
+    """
+    Writes data entries to a block file, a block at a time. An existing block file is continued, in its own format.
+
+    :param path: string, path of the block file
+    :param block_size: number of data entries in a block
+    :param output_format: string, format of the entries inside a new file's blocks, see serializers.py
+    :param compress_level: zlib compression level, 1 (fast) to 9 (small)
+    """
+    def __init__(self, path, block_size=BLOCK_SIZE, output_format="json", compress_level=COMPRESS_LEVEL):
+        self.path = path
+        self.block_size = block_size
+        self.compress_level = compress_level
+        self.pending = []
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self.file = open(path, "r+b")
+            self.blocks, output_format, start, _ = read_index(self.file)
+            # the index (or a block that was cut off) is rewritten from here
+            self.file.truncate(self.blocks[-1].end() if self.blocks else start)
+            self.file.seek(0, os.SEEK_END)
+        else:
+            self.file = open(path, "wb")
+            self.file.write(BLOCKS_HEADER + output_format.encode("ascii") + b"\n")
+            self.blocks = []
+        self.output_format = output_format
+        self.serializer = get_serializer(output_format)
+
+    def __len__(self):
+        """
+        :return: number of entries written so far, including the ones not flushed yet
+        """
+        return sum(block.num_entries for block in self.blocks) + len(self.pending)
+
+    def write(self, data_entries):
+        """
+        Add data entries, and write out every full block.
+        :param data_entries: list or iterable of data entries
+        """
+        self.pending.extend(data_entries)
+        while len(self.pending) >= self.block_size:
+            self.flush_block(self.pending[:self.block_size])
+            self.pending = self.pending[self.block_size:]
+
+    def flush_block(self, data_entries):
+        """
+        Compress data entries and write them as a new block.
+        """
+        data = zlib.compress(b"".join(self.serializer.dumps(entry) for entry in data_entries), self.compress_level)
+        first_entry = self.blocks[-1].first_entry + self.blocks[-1].num_entries if self.blocks else 0
+        block = Block(self.file.tell(), len(data), len(data_entries), first_entry, *created_at_range(data_entries))
+        self.file.write(BLOCK_PREFIX.pack(len(data), len(data_entries)))
+        self.file.write(data)
+        self.blocks.append(block)
+
+    def close(self):
+        """
+        Write out the last, partial, block, and the index.
+        """
+        if self.file is None:
+            return
+        if self.pending:
+            self.flush_block(self.pending)
+            self.pending = []
+        index = json.dumps([block.to_dict() for block in self.blocks]).encode("utf-8")
+        self.file.write(index)
+        self.file.write(FOOTER.pack(len(index), FOOTER_MAGIC))
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def convert(input_path, path=None, block_size=BLOCK_SIZE, output_format="json", compress_level=COMPRESS_LEVEL):
+    """
+    Write the block file of an existing output file, replacing any previous one.
+
+    :param input_path: string, path of a twitter_search.py output file, in any format (see serializers.py)
+    :param path: string, path of the block file, next to the output file by default
+    :param block_size: number of data entries in a block
+    :param output_format: string, format of the entries inside the blocks
+    :param compress_level: zlib compression level
+    :return: string, path of the block file
+    """
+    path = path or block_path(input_path)
+    if os.path.exists(path):
+        os.remove(path)
+    with BlockWriter(path, block_size, output_format, compress_level) as writer:
+        batch = []
+        for entry in read_entries(input_path):
+            batch.append(entry)
+            if len(batch) >= block_size:
+                writer.write(batch)
+                batch = []
+        writer.write(batch)
+    return path
+
+
+###########
+# Reading #
+###########
+class BlockReader:
+    """
+    Random access to the entries of a block file. Only the blocks a read touches are decompressed. Not safe to share
+    between threads.
+
+    :param path: string, path of the block file
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.blocks, self.output_format, _, has_index = read_index(self.file)
+        if not has_index:
+            print("%s has no index, it was rebuilt from the blocks" % path, file=sys.stderr)
+        self.serializer = get_serializer(self.output_format)
+        self.starts = [block.first_entry for block in self.blocks]
+        # number of blocks decompressed so far
+        self.blocks_read = 0
+
+    def __len__(self):
+        return self.blocks[-1].first_entry + self.blocks[-1].num_entries if self.blocks else 0
+
+    def read_raw(self, block):
+        """
+        :param block: Block
+        :return: bytes, the compressed block
+        """
+        self.file.seek(block.offset + BLOCK_PREFIX.size)
+        return self.file.read(block.size)
+
+    def read_block(self, i):
+        """
+        :param i: int, number of the block
+        :return: list of the data entries of the block
+        """
+        self.blocks_read += 1
+        return decode_block(zlib.decompress(self.read_raw(self.blocks[i])), self.output_format)
+
+    def entry(self, n):
+        """
+        :param n: int, position of the entry in the file
+        :return: data entry
+        """
+        if not 0 <= n < len(self):
+            raise IndexError("entry %d out of range, the file has %d" % (n, len(self)))
+        i = bisect.bisect_right(self.starts, n) - 1
+        return self.read_block(i)[n - self.starts[i]]
+
+    def entries(self, start, stop):
+        """
+        :param start: int, position of the first entry
+        :param stop: int, position after the last entry
+        :return: generator of the data entries in [start, stop)
+        """
+        stop = min(stop, len(self))
+        if start >= stop:
+            return
+        for i in range(bisect.bisect_right(self.starts, start) - 1, bisect.bisect_left(self.starts, stop)):
+            block = self.blocks[i]
+            for entry in self.read_block(i)[max(start - block.first_entry, 0):stop - block.first_entry]:
+                yield entry
+
+    def date_range(self, since=None, until=None):
+        """
+        :param since: string, earliest created_at to keep, eg. "2018-06-05" or "2018-06-05 12:00:00" (UTC), or None
+        :param until: string, created_at to stop at (excluded), or None
+        :return: generator of the data entries created in [since, until), in file order. Entries without a
+                 created_at (written with --fields) are never in the range.
+        """
+        since = parse_created_at(since) if since is not None else None
+        until = parse_created_at(until) if until is not None else None
+        for i, block in enumerate(self.blocks):
+            if not block.overlaps(since, until):
+                continue
+            for entry in self.read_block(i):
+                if "created_at" not in entry:
+                    continue
+                created_at = parse_created_at(entry["created_at"])
+                if (since is None or created_at >= since) and (until is None or created_at < until):
+                    yield entry
+
+    def iter_entries(self, num_workers=1):
+        """
+        :param num_workers: number of threads decompressing blocks ahead of the one being decoded, 1 to do everything
+                            in this thread
+        :return: generator of every data entry, in file order
+        """
+        if num_workers == 1:
+            for i in range(len(self.blocks)):
+                for entry in self.read_block(i):
+                    yield entry
+            return
+        pending = collections.deque()
+        with ThreadPoolExecutor(num_workers) as executor:
+            for block in self.blocks:
+                pending.append(executor.submit(zlib.decompress, self.read_raw(block)))
+                if len(pending) > num_workers:
+                    self.blocks_read += 1
+                    for entry in decode_block(pending.popleft().result(), self.output_format):
+                        yield entry
+            while pending:
+                self.blocks_read += 1
+                for entry in decode_block(pending.popleft().result(), self.output_format):
+                    yield entry
+
+    def map_blocks(self, function, num_workers=None):
+        """
+        Decode every block on a pool of processes, and run function over the entries of each one, there.
+
+        :param function: picklable function of a list of data entries, eg. analysis_search.get_hashtag_counts
+        :param num_workers: number of worker processes, defaults to the number of cores
+        :return: generator of the results of function, one for each block, in file order
+        """
+        work = ((None, (function, self.read_raw(block), self.output_format)) for block in self.blocks)
+        for _, result in map_chunks(map_block, work, num_workers):
+            self.blocks_read += 1
+            yield result
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def iter_entries(path):
+    """
+    Stream every entry of a block file, the same as serializers.read_entries does for an output file.
+    :param path: string, path of the block file
+    :return: generator of data entries
+    """
+    with BlockReader(path) as reader:
+        for entry in reader.iter_entries():
+            yield entry
+
+
+if __name__ == "__main__":
+    # command line parsing
+    parser = argparse.ArgumentParser(description="Convert a twitter_search.py output file to a block file")
+    parser.add_argument("-i", "--input", help="Specify input file path", required=True)
+    parser.add_argument("-o", "--output", help="Specify output file path, next to the input file by default")
+    parser.add_argument("--block-size", help="Number of data entries in a block", type=int, default=BLOCK_SIZE)
+    parser.add_argument("--format", help="Format of the entries inside the blocks, see serializers.py",
+                        choices=FORMATS, default="json", dest="output_format")
+    parser.add_argument("--level", help="zlib compression level, 1 (fast) to 9 (small)", type=int,
+                        default=COMPRESS_LEVEL)
+    args = parser.parse_args()
+    try:
+        get_serializer(args.output_format)
+    except ValueError as e:
+        parser.error(str(e))
+
+    output_path = convert(args.input, args.output, args.block_size, args.output_format, args.level)
+    with BlockReader(output_path) as block_reader:
+        num_blocks = len(block_reader.blocks)
+    print("Converted %s to %s, [%d] blocks, %.1f MB to %.1f MB" % (args.input, output_path, num_blocks,
+                                                                 os.path.getsize(args.input) / 1e6,
+                                                                 os.path.getsize(output_path) / 1e6))
@@ -0,0 +1,527 @@
+"""
+catalog.py
+
+A catalog of the crawls in an output directory, so that analyses find the files of a query and a date range from it,
+instead of parsing file names (which breaks on queries with "|" or "-" in them) and opening every file.
+
+The catalog is a JSON file in the output directory (CATALOG_FILE), with a partition for every output file:
+    - its name in the directory, and its kind: "search" (twitter_search.py and twitter_follow.py output, or their
+      block files) or "trends" (twitter_trends.py output)
+    - the query, as the user entered it, for search crawls
+    - the first and last created_at of its entries (the "starting" date of trends), "YYYY-MM-DD HH:MM:SS" in UTC, and
+      the day of the last one, the date of the crawl
+    - the number of entries, the format (see serializers.py, or "blocks" for a block file), the size in bytes and the
+      modification time of the file, to tell when it changed
+
+The crawlers register their output files when they finish, with the number of entries and the date range their
+checkpoint kept track of as the pages were written (see register_crawl), so the file isn't read through again.
+Every change to the catalog file is made under a lock file (CATALOG_FILE + LOCK_SUFFIX), on a fresh read of the
+catalog, so crawls finishing at the same time in different processes don't lose each other's partitions.
+Catalog.update registers the files it doesn't know yet
+(eg. crawls from before the catalog), and describes again the ones that changed since: the query comes from the
+checkpoint of the crawl, and only if there isn't one, from the file name. A crawl that died before registering its
+file is picked up by the next update the same way.
+
+Catalog.select prunes partitions by query and time from the catalog alone, before any file is opened, and
+iter_entries streams the entries of the selected partitions, only checking the created_at of the entries of
+partitions that straddle the range (a block file is read with BlockReader.date_range, so that only the blocks in the
+range are decompressed).
+
+Usage, to catalog an output directory:
+    python catalog.py -d ../output/search
+to list the crawls of a query in June:
+    python catalog.py -d ../output/search -q cnn --since 2018-06-01 --until 2018-07-01
+and from code:
+    catalog = Catalog("../output/search")
+    catalog.update()
+    partitions = catalog.select(query="cnn", since="2018-06-01", until="2018-07-01")
+    for entry in iter_entries(catalog.directory, partitions, "2018-06-01", "2018-07-01"):
+        ...
+"""
+import argparse
+import contextlib
+import datetime
+import fcntl
+import json
+import os
+import sys
+
+import blocks
+from checkpoint import ARCHIVE_SUFFIX, CHECKPOINT_SUFFIX, checkpoint_path, load_checkpoint
+from records import format_created_at, parse_created_at
+from serializers import detect_format, read_entries
+
+CATALOG_FILE = "catalog.json"
+LOCK_SUFFIX = ".lock"
+KINDS = ("search", "trends")
+# files next to output files that are not output files themselves
+SKIPPED_SUFFIXES = (CHECKPOINT_SUFFIX, ARCHIVE_SUFFIX, ".aggregates", ".offsets.npz", ".tmp", ".json", LOCK_SUFFIX)
+FILE_DELIMITER_CHAR = "|"
+
+
+class Partition:
+    """
+    The catalog entry of one output file.
+    """
+    __slots__ = ("name", "kind", "query", "date", "first", "last", "num_entries", "output_format", "size", "mtime")
+
+    def __init__(self, name, kind, query, date, first, last, num_entries, output_format, size, mtime):
+        self.name = name
+        self.kind = kind
+        self.query = query
+        self.date = date
+        # created_at of the oldest and newest entries, None when the entries don't have one
+        self.first = first
+        self.last = last
+        self.num_entries = num_entries
+        self.output_format = output_format
+        self.size = size
+        self.mtime = mtime
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def is_current(self, path):
+        """
+        :param path: string, path of the file of the partition
+        :return: True if the file wasn't changed since it was described
+        """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        return stat.st_size == self.size and stat.st_mtime == self.mtime
+
+    def matches(self, query):
+        """
+        :param query: string, space separated words
+        :return: True if the query of the partition has every word of query, in any case
+        """
+        words = set((self.query or "").lower().split())
+        return all(word in words for word in query.lower().split())
+
+    def overlaps(self, since, until):
+        """
+        :param since: int, seconds since the epoch, or None
+        :param until: int, seconds since the epoch (excluded), or None
+        :return: False if no entry of the partition can be in [since, until)
+        """
+        if self.first is None:
+            return True
+        return ((since is None or parse_created_at(self.last) >= since) and
+                (until is None or parse_created_at(self.first) < until))
+
+    def within(self, since, until):
+        """
+        :return: True if every entry of the partition is in [since, until)
+        """
+        if self.first is None:
+            return since is None and until is None
+        return ((since is None or parse_created_at(self.first) >= since) and
+                (until is None or parse_created_at(self.last) < until))
+
+    def __repr__(self):
+        return "%-40s %-7s %-24s %s .. %s %8d entries %-8s %10d bytes" % (
+            self.name, self.kind, repr(self.query), self.first, self.last, self.num_entries, self.output_format,
+            self.size)
+
+
+##############
+# Describing #
+##############
+def entry_timestamp(entry):
+    """
+    :param entry: data entry, or trend data
+    :return: string, created_at of the entry, eg. "2018-06-06 20:07:10", or None if it doesn't have one
+    """
+    if "created_at" in entry:
+        return entry["created_at"]
+    if "starting" in entry:
+        # "2018-06-06T20:07:10Z"
+        return format_created_at(parse_created_at(entry["starting"].replace("Z", "")))
+    return None
+
+
+def entry_kind(entry):
+    """
+    :return: string, the kind of output file the entry comes from, or None if it isn't one
+    """
+    if "trend_list" in entry:
+        return "trends"
+    if "woeid" not in entry and any(name in entry for name in ("created_at", "cleaned", "raw", "hashtags")):
+        return "search"
+    return None
+
+
+def query_of(path, kind):
+    """
+    :param path: string, path of an output file
+    :param kind: string, one of KINDS
+    :return: string, the query of the crawl, from its checkpoint, or from the file name if there is none, or None
+    """
+    output_filepath = path[:-len(blocks.BLOCKS_SUFFIX)] if path.endswith(blocks.BLOCKS_SUFFIX) else path
+    try:
+        return load_checkpoint(checkpoint_path(output_filepath)).raw_query
+    except FileNotFoundError:
+        pass
+    if kind != "search":
+        return None
+    # "term1|term2|YYYY-MM-DD", see twitter_search.build_output_filepath
+    return " ".join(os.path.basename(output_filepath).split(FILE_DELIMITER_CHAR)[:-1]) or None
+
+
+def describe(path, kind=None, query=None):
+    """
+    Read an output file through, for its partition.
+
+    :param path: string, path of the output file
+    :param kind: string, one of KINDS, found from the entries if None
+    :param query: string, query of the crawl, found from its checkpoint (or file name) if None
+    :return: Partition, or None if the file isn't an output file
+    """
+    stat = os.stat(path)
+    first = last = None
+    num_entries = 0
+    if blocks.is_block_file(path):
+        output_format = "blocks"
+        with blocks.BlockReader(path) as reader:
+            num_entries = len(reader)
+            if kind is None and num_entries:
+                kind = entry_kind(reader.entry(0))
+            timestamps = [(block.min_created_at, block.max_created_at) for block in reader.blocks]
+        if timestamps and all(low is not None for low, _ in timestamps):
+            first = format_created_at(min(low for low, _ in timestamps))
+            last = format_created_at(max(high for _, high in timestamps))
+    else:
+        with open(path, "rb") as f:
+            output_format = detect_format(f).name
+        try:
+            has_timestamps = True
+            for entry in read_entries(path):
+                if kind is None:
+                    kind = entry_kind(entry)
+                    if kind is None:
+                        return None
+                num_entries += 1
+                timestamp = entry_timestamp(entry)
+                if timestamp is None:
+                    has_timestamps = False
+                elif has_timestamps:
+                    first = timestamp if first is None or timestamp < first else first
+                    last = timestamp if last is None or timestamp > last else last
+            if not has_timestamps:
+                first = last = None
+        except (ValueError, UnicodeDecodeError):
+            # not an output file
+            return None
+    if kind is None:
+        return None
+    return make_partition(path, stat, kind, query, first, last, num_entries, output_format)
+
+
+def summarize(path, kind, query, num_entries, first, last):
+    """
+    Same as describe, for a file whose entries are already known, without reading them.
+
+    :param path: string, path of the output file
+    :param kind: string, one of KINDS
+    :param query: string, query of the crawl, found from its checkpoint (or file name) if None
+    :param num_entries: int, number of entries in the file
+    :param first: string, created_at of the oldest entry, or None if the entries don't have one
+    :param last: string, created_at of the newest entry, or None
+    :return: Partition
+    """
+    stat = os.stat(path)
+    if blocks.is_block_file(path):
+        output_format = "blocks"
+    else:
+        with open(path, "rb") as f:
+            output_format = detect_format(f).name
+    return make_partition(path, stat, kind, query, first, last, num_entries, output_format)
+
+
+def make_partition(path, stat, kind, query, first, last, num_entries, output_format):
+    """
+    :param stat: os.stat_result of the file, taken before its entries were read
+    :return: Partition of an output file, see describe
+    """
+    if last is not None:
+        date = last[:10]
+    else:
+        date = datetime.datetime.fromtimestamp(stat.st_mtime).strftime("%Y-%m-%d")
+    return Partition(os.path.basename(path), kind, query if query is not None else query_of(path, kind), date,
+                     first, last, num_entries, output_format, stat.st_size, stat.st_mtime)
+
+
+###########
+# Catalog #
+###########
+class Catalog:
+    """
+    The catalog of an output directory.
+
+    :param directory: string, path of the output directory
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, CATALOG_FILE)
+        self.partitions = {}
+        self.reload()
+
+    def reload(self):
+        """
+        Read the catalog file again, dropping the partitions only known in memory.
+        """
+        self.partitions = {}
+        try:
+            with open(self.path, "r") as f:
+                for data in json.load(f)["partitions"]:
+                    partition = Partition.from_dict(data)
+                    self.partitions[partition.name] = partition
+        except FileNotFoundError:
+            pass
+
+    @contextlib.contextmanager
+    def locked(self):
+        """
+        :return: context manager holding the lock of the catalog file, so that no other process changes it meanwhile.
+                 Read the catalog again under the lock before changing it.
+        """
+        with open(self.path + LOCK_SUFFIX, "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def save(self):
+        """
+        Atomically replace the catalog file, so readers never see a half written one. Call with the lock held.
+        """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"partitions": [self.partitions[name].to_dict() for name in sorted(self.partitions)]}, f,
+                      indent=1)
+        os.replace(tmp_path, self.path)
+
+    def register(self, path, kind=None, query=None, num_entries=None, first=None, last=None):
+        """
+        Describe an output file of the directory, and save it in the catalog.
+
+        :param path: string, path of the output file
+        :param kind: string, one of KINDS, found from the entries if None
+        :param query: string, query of the crawl, found from its checkpoint (or file name) if None
+        :param num_entries: optional int, number of entries in the file, if the caller knows it. The file is only read
+                            through if it isn't given, along with kind.
+        :param first: string, created_at of the oldest entry, with num_entries, None if the entries don't have one
+        :param last: string, created_at of the newest entry, with num_entries
+        :return: Partition, or None if the file isn't an output file
+        """
+        if num_entries is not None and kind is not None:
+            partition = summarize(path, kind, query, num_entries, first, last)
+        else:
+            partition = describe(path, kind, query)
+        if partition is not None:
+            with self.locked():
+                self.reload()
+                self.partitions[partition.name] = partition
+                self.save()
+        return partition
+
+    def lookup(self, path):
+        """
+        :param path: string, path of an output file of the directory
+        :return: Partition of the file, registered first if it isn't in the catalog or changed since, or None if it
+                 isn't an output file
+        """
+        partition = self.partitions.get(os.path.basename(path))
+        if partition is not None and partition.is_current(path):
+            return partition
+        # keep the query of a file that grew
+        return self.register(path, query=partition.query if partition is not None else None)
+
+    def update(self):
+        """
+        Register the output files of the directory that aren't in the catalog, describe again the ones that changed,
+        and drop the ones that were deleted.
+        :return: tuple (number of partitions added, updated, removed)
+        """
+        added = updated = 0
+        names = set()
+        described = {}
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if name == CATALOG_FILE or name.endswith(SKIPPED_SUFFIXES) or not os.path.isfile(path):
+                continue
+            names.add(name)
+            partition = self.partitions.get(name)
+            if partition is not None and partition.is_current(path):
+                continue
+            new_partition = describe(path, query=partition.query if partition is not None else None)
+            if new_partition is None:
+                continue
+            described[name] = new_partition
+            if partition is None:
+                added += 1
+            else:
+                updated += 1
+        removed = [name for name in self.partitions if name not in names]
+        if added or updated or removed:
+            # the files were read without the lock, only the changes are applied to the catalog as it is now
+            with self.locked():
+                self.reload()
+                self.partitions.update(described)
+                for name in removed:
+                    self.partitions.pop(name, None)
+                self.save()
+        return added, updated, len(removed)
+
+    def select(self, kind="search", query=None, since=None, until=None):
+        """
+        Prune the partitions by query and time, without opening any file. A file that also has a block file (see
+        blocks.py) is only selected once, as the block file.
+
+        :param kind: string, one of KINDS
+        :param query: string, words the query of a crawl must all have, in any case, or None for every query
+        :param since: string, earliest created_at of interest, eg. "2018-06-05" or "2018-06-05 12:00:00" (UTC), or None
+        :param until: string, created_at to stop at (excluded), or None
+        :return: list of Partitions, oldest first
+        """
+        since = parse_created_at(since) if since is not None else None
+        until = parse_created_at(until) if until is not None else None
+        selected = [partition for partition in self.partitions.values()
+                    if partition.kind == kind and (query is None or partition.matches(query)) and
+                    partition.overlaps(since, until) and partition.name + blocks.BLOCKS_SUFFIX not in self.partitions]
+        return sorted(selected, key=lambda partition: (partition.first or "", partition.name))
+
+
+def register(path, kind=None, query=None, num_entries=None, first=None, last=None):
+    """
+    Register an output file in the catalog of its directory, see Catalog.register.
+    :return: Partition, or None if the file isn't an output file
+    """
+    return Catalog(os.path.dirname(path) or os.curdir).register(path, kind, query, num_entries, first, last)
+
+
+def register_crawl(checkpoint):
+    """
+    Register the output file of a search crawl, with the number of entries and the date range its checkpoint kept
+    track of. The file is read through only if the checkpoint is from before they were kept.
+
+    :param checkpoint: Checkpoint of the crawl
+    :return: Partition, or None if the file isn't an output file
+    """
+    return register(checkpoint.output_filepath, "search", checkpoint.raw_query, checkpoint.num_entries,
+                    checkpoint.first_created_at, checkpoint.last_created_at)
+
+
+def iter_entries(directory, partitions, since=None, until=None, distinct=True):
+    """
+    Stream the entries of partitions that were created in [since, until).
+
+    :param directory: string, path of the output directory of the partitions
+    :param partitions: list of Partitions, eg. from Catalog.select
+    :param since: string, earliest created_at to keep, or None
+    :param until: string, created_at to stop at (excluded), or None
+    :param distinct: if True, an entry that was already read from an earlier partition is skipped: crawls of the same
+                     query a few days apart find many of the same tweets. Entries are told apart by their tweet id,
+                     or, for data entries (which don't have one), by their created_at and raw text. Entries without
+                     those (eg. written with --fields) are never skipped. Needs a hash of every entry in memory.
+    :return: generator of data entries
+    """
+    since_timestamp = parse_created_at(since) if since is not None else None
+    until_timestamp = parse_created_at(until) if until is not None else None
+    seen = {} if distinct and len(partitions) > 1 else None
+    for partition in partitions:
+        path = os.path.join(directory, partition.name)
+        # one crawl doesn't find a tweet twice, so two entries of a partition with the same key are two tweets with the
+        # same text, posted in the same second: both are kept, and a later partition needs both to skip both
+        counts = {}
+        if partition.output_format == "blocks":
+            with blocks.BlockReader(path) as reader:
+                # entries without a created_at are all kept, as they are from other files
+                if partition.first is None or partition.within(since_timestamp, until_timestamp):
+                    entries = reader.iter_entries()
+                else:
+                    entries = reader.date_range(since, until)
+                for entry in entries:
+                    if seen is None or remember(seen, counts, entry):
+                        yield entry
+            merge_seen(seen, counts)
+            continue
+
+        check_time = not partition.within(since_timestamp, until_timestamp)
+        for entry in read_entries(path):
+            if check_time:
+                timestamp = entry_timestamp(entry)
+                if timestamp is not None:
+                    timestamp = parse_created_at(timestamp)
+                    if ((since_timestamp is not None and timestamp < since_timestamp) or
+                            (until_timestamp is not None and timestamp >= until_timestamp)):
+                        continue
+            if seen is None or remember(seen, counts, entry):
+                yield entry
+        merge_seen(seen, counts)
+
+
+def entry_key(entry):
+    """
+    :param entry: data entry
+    :return: hash that tells the tweet of the entry apart from others, or None if the entry doesn't have the fields to
+             tell it apart
+    """
+    if "id" in entry:
+        return hash(entry["id"])
+    if "created_at" in entry and "raw" in entry:
+        return hash((entry["created_at"], entry["raw"]))
+    return None
+
+
+def remember(seen, counts, entry):
+    """
+    :param seen: dictionary of the hashes of the entries of the earlier partitions, to how many times a partition had
+                 it at most
+    :param counts: dictionary of the hashes of the entries of the current partition so far, to how many times
+    :param entry: data entry of the current partition
+    :return: True if the entry wasn't read from an earlier partition
+    """
+    key = entry_key(entry)
+    if key is None:
+        return True
+    count = counts.get(key, 0) + 1
+    counts[key] = count
+    return count > seen.get(key, 0)
+
+
+def merge_seen(seen, counts):
+    """
+    Add the hashes of a partition that was read through to the ones of the earlier partitions.
+    """
+    if seen is None:
+        return
+    for key, count in counts.items():
+        if count > seen.get(key, 0):
+            seen[key] = count
+
+
+if __name__ == "__main__":
+    # command line parsing
+    parser = argparse.ArgumentParser(description="Catalog the crawls of an output directory, and select from it")
+    parser.add_argument("-d", "--directory", help="Specify output directory", required=True)
+    parser.add_argument("-k", "--kind", help="Kind of crawls to list", choices=KINDS, default="search")
+    parser.add_argument("-q", "--query", help="Only list crawls whose query has all these words")
+    parser.add_argument("--since", help="Only list crawls with tweets created on or after this date (UTC), "
+                                        "eg. 2018-06-01")
+    parser.add_argument("--until", help="Only list crawls with tweets created before this date (UTC)")
+    args = parser.parse_args()
+
+    catalog = Catalog(args.directory)
+    num_added, num_updated, num_removed = catalog.update()
+    print("Catalog of %s: [%d] partitions, %d added, %d updated, %d removed" % (
+        args.directory, len(catalog.partitions), num_added, num_updated, num_removed), file=sys.stderr)
+    for selected_partition in catalog.select(args.kind, args.query, args.since, args.until):
+        print(selected_partition)
@@ -0,0 +1,220 @@
+"""
+checkpoint.py
+
+Checkpoints for search crawls, so a crawl that dies part way through can be resumed instead of restarted.
+
+A checkpoint is a small JSON file next to the output file (output file name + ".checkpoint"). It records the cursor of
+the crawl: the query, the max_id to continue from, the id of the newest tweet seen (the since_id to poll forward
+from), the number of tweets downloaded so far, and the size of the output file when the checkpoint was taken.
+It is rewritten atomically after every page, once that page is safely on disk. If the crawl keeps a raw tweet
+archive, the size of the archive is recorded as well. The data entry fields and the tweet filter of the crawl are
+recorded too, so that following the crawl later (see twitter_follow.py) writes the same entries, and so are the number
+of entries written and their date range, for the catalog (see catalog.register_crawl).
+
+To resume, the output file is truncated back to the recorded size. This drops any partial line, or page written after
+the last checkpoint, which then gets fetched again - so no page is lost or duplicated.
+"""
+import glob
+import json
+import os
+
+CHECKPOINT_SUFFIX = ".checkpoint"
+# the raw tweet archive of a crawl, see archive.py
+ARCHIVE_SUFFIX = ".raw.gz"
+
+
+def archive_path(output_filepath):
+    """
+    :param output_filepath: string, the output file of a crawl
+    :return: string, path of the raw tweet archive of that crawl
+    """
+    return output_filepath + ARCHIVE_SUFFIX
+
+
+class Checkpoint:
+    """
+    The cursor of a crawl.
+
+    :param raw_query: string, the space separated query the user entered
+    :param query: string, the query sent to the API
+    :param output_filepath: string, the output file of the crawl
+    :param fields: optional list of the data entry fields the crawl writes, None for all of them
+    :param filter_options: optional dictionary, the arguments of the TweetFilter of the crawl (see
+                           TweetFilter.options), None for a checkpoint written before filters were recorded
+    :param gap_max_id: while a poll forward is part way through the gap since since_id, id of the oldest tweet of the
+                       gap written so far, see twitter_follow.py
+    :param gap_newest_id: id of the newest tweet of that gap, since_id moves to it once the whole gap is written
+    :param num_entries: number of data entries written, None if they weren't counted from the start of the crawl
+    :param first_created_at: created_at of the oldest data entry written, None if there is none, or the entries don't
+                             have one
+    :param last_created_at: created_at of the newest data entry written
+    """
+    def __init__(self, raw_query, query, output_filepath, max_id=-1, tweet_count=0, offset=0, finished=False,
+                 since_id=None, archive_offset=None, fields=None, filter_options=None, gap_max_id=None,
+                 gap_newest_id=None, num_entries=None, first_created_at=None, last_created_at=None):
+        self.raw_query = raw_query
+        self.query = query
+        self.output_filepath = output_filepath
+        self.max_id = max_id
+        self.since_id = since_id
+        self.tweet_count = tweet_count
+        self.offset = offset
+        self.finished = finished
+        self.archive_offset = archive_offset
+        self.fields = list(fields) if fields is not None else None
+        self.filter_options = filter_options
+        self.gap_max_id = gap_max_id
+        self.gap_newest_id = gap_newest_id
+        self.num_entries = num_entries
+        self.first_created_at = first_created_at
+        self.last_created_at = last_created_at
+
+    @property
+    def path(self):
+        """
+        :return: string, path of the checkpoint file
+        """
+        return checkpoint_path(self.output_filepath)
+
+    def to_dict(self):
+        return {
+            "raw_query": self.raw_query,
+            "query": self.query,
+            "output_filepath": self.output_filepath,
+            "max_id": self.max_id,
+            "since_id": self.since_id,
+            "tweet_count": self.tweet_count,
+            "offset": self.offset,
+            "finished": self.finished,
+            "archive_offset": self.archive_offset,
+            "fields": self.fields,
+            "filter_options": self.filter_options,
+            "gap_max_id": self.gap_max_id,
+            "gap_newest_id": self.gap_newest_id,
+            "num_entries": self.num_entries,
+            "first_created_at": self.first_created_at,
+            "last_created_at": self.last_created_at
+        }
+
+    def save(self):
+        """
+        Atomically replace the checkpoint file: write a temporary file, sync it, then rename it over the old one.
+        """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps(self.to_dict()))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def commit(self, output_file, max_id, tweet_count, newest_id=None, archive_file=None, data_entries=None):
+        """
+        Record that everything written to output_file so far is complete. Call after each page is written.
+
+        :param output_file: file object of the output file
+        :param max_id: id of the oldest tweet written so far
+        :param tweet_count: number of tweets downloaded so far
+        :param newest_id: id of the newest tweet of the page, advances since_id if it is newer
+        :param archive_file: file object of the raw tweet archive, if the crawl keeps one
+        :param data_entries: optional list of the data entries of the page, added to num_entries and the date range
+        """
+        if data_entries is not None and self.num_entries is not None:
+            self.num_entries += len(data_entries)
+            timestamps = [entry["created_at"] for entry in data_entries if "created_at" in entry]
+            if timestamps:
+                first, last = min(timestamps), max(timestamps)
+                if self.first_created_at is None or first < self.first_created_at:
+                    self.first_created_at = first
+                if self.last_created_at is None or last > self.last_created_at:
+                    self.last_created_at = last
+        output_file.flush()
+        os.fsync(output_file.fileno())
+        self.offset = output_file.tell()
+        if archive_file is not None:
+            archive_file.flush()
+            os.fsync(archive_file.fileno())
+            self.archive_offset = archive_file.tell()
+        self.max_id = max_id
+        self.tweet_count = tweet_count
+        if newest_id is not None and (self.since_id is None or newest_id > self.since_id):
+            self.since_id = newest_id
+        self.save()
+
+    def finish(self):
+        """
+        Mark the crawl as complete.
+        """
+        self.finished = True
+        self.save()
+
+    def open_output(self, header=b""):
+        """
+        Open the output file to continue writing from the checkpoint. Anything after the recorded offset, such as a
+        line that was cut off when the crawl died, is truncated.
+
+        :param header: bytes, written at the start of a new output file, see serializers.py
+        :return: binary file object, opened for appending
+        """
+        if self.offset == 0 and not os.path.exists(self.output_filepath):
+            f = open(self.output_filepath, "wb")
+        else:
+            size = os.path.getsize(self.output_filepath)
+            if size < self.offset:
+                raise ValueError("%s is shorter than its checkpoint (%d < %d bytes), can't resume" %
+                                 (self.output_filepath, size, self.offset))
+            os.truncate(self.output_filepath, self.offset)
+            f = open(self.output_filepath, "ab")
+        if f.tell() == 0:
+            f.write(header)
+        return f
+
+    def open_archive(self):
+        """
+        Open the raw tweet archive to continue writing from the checkpoint, truncating anything after the recorded
+        archive offset. A crawl that didn't keep an archive until now starts a new one.
+
+        :return: file object, opened for binary appending
+        """
+        path = archive_path(self.output_filepath)
+        if not self.archive_offset or not os.path.exists(path):
+            self.archive_offset = 0
+            return open(path, "wb")
+
+        os.truncate(path, self.archive_offset)
+        return open(path, "ab")
+
+
+def checkpoint_path(output_filepath):
+    """
+    :param output_filepath: string, the output file of a crawl
+    :return: string, path of the checkpoint file of that crawl
+    """
+    return output_filepath + CHECKPOINT_SUFFIX
+
+
+def load_checkpoint(path):
+    """
+    :param path: string, path of a checkpoint file
+    :return: Checkpoint
+    """
+    with open(path, "r") as f:
+        return Checkpoint(**json.loads(f.read()))
+
+
+def find_checkpoint(output_dir, raw_query, include_finished=False):
+    """
+    Find the most recent unfinished checkpoint in output_dir for raw_query.
+
+    :param output_dir: string, directory the crawl wrote to
+    :param raw_query: string, the space separated query the user entered
+    :param include_finished: also consider checkpoints of crawls that completed
+    :return: Checkpoint, or None if there is nothing to resume
+    """
+    candidates = []
+    for path in glob.glob(os.path.join(glob.escape(output_dir), "*" + CHECKPOINT_SUFFIX)):
+        checkpoint = load_checkpoint(path)
+        if checkpoint.raw_query == raw_query and (include_finished or not checkpoint.finished):
+            candidates.append((os.path.getmtime(path), checkpoint))
+    if not candidates:
+        return None
+    return max(candidates, key=lambda c: c[0])[1]
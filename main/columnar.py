@@ -0,0 +1,329 @@
+"""
+columnar.py
+
+A columnar on-disk format for data entries, so that an analysis only reads (and decodes) the fields it needs, instead of
+parsing every JSON line in full.
+
+A columnar file is a directory (output file name + ".cols") of row groups, "part-000000.npz", "part-000001.npz", ...
+Each row group is an uncompressed NumPy .npz archive of up to row_group_size data entries, holding one or more arrays
+per field:
+    - "raw", "cleaned": the UTF-8 bytes of every string, end to end, and their offsets
+    - "source": int32 codes into a dictionary of the distinct sources of the row group
+    - "hashtags", "mentions": offsets of each entry's list, and int32 codes into a dictionary
+    - "tags": offsets of each entry's list, and int32 codes into a dictionary of the distinct (word, tag) pairs
+    - "created_at": int64, seconds since the epoch (UTC)
+    - numbers: int64 or float64
+An .npz archive is a zip of .npy files, and np.load only reads the ones that are asked for, so reading one column of a
+row group doesn't touch the others.
+
+Row groups are written whole (to a temporary file, then renamed), so a crawl that dies only loses the rows it hadn't
+flushed yet, and those are still in the output file: ColumnarWriter.catch_up picks them up from there when
+the crawl is resumed.
+
+Usage, to convert an existing output file:
+    python columnar.py -i "../output/search/Tim|Hortons|2018-06-06"
+and to read it:
+    for entry in iter_entries("../output/search/Tim|Hortons|2018-06-06.cols", ["hashtags"]):
+        ...
+"""
+import argparse
+import glob
+import os
+
+import numpy as np
+
+from records import CLUSTER_FIELDS, DATA_FIELDS, format_created_at, parse_created_at
+from serializers import read_entries
+
+COLUMNAR_SUFFIX = ".cols"
+ROW_GROUP_SIZE = 10000
+ROW_GROUP_PATTERN = "part-%06d.npz"
+
+STRING_FIELDS = ("raw", "cleaned")
+DICTIONARY_FIELDS = ("source",)
+LIST_FIELDS = ("hashtags", "mentions")
+PAIR_LIST_FIELDS = ("tags",)
+TIMESTAMP_FIELDS = ("created_at",)
+INT_FIELDS = ("author_num_followers", "author_num_favourites", "retweets", "cluster_id", "cluster_size")
+FLOAT_FIELDS = ("polarity", "subjectivity")
+
+
+def columnar_path(output_filepath):
+    """
+    :param output_filepath: string, the output file of a crawl
+    :return: string, path of the columnar copy of the output file
+    """
+    return output_filepath + COLUMNAR_SUFFIX
+
+
+############
+# Encoding #
+############
+def encode_strings(arrays, name, strings):
+    """
+    Store a list of strings in arrays, as name + ".data" and name + ".offsets".
+    """
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    arrays[name + ".data"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    arrays[name + ".offsets"] = offsets
+
+
+def decode_strings(archive, name):
+    """
+    :return: list of the strings stored by encode_strings
+    """
+    data = archive[name + ".data"].tobytes()
+    offsets = archive[name + ".offsets"].tolist()
+    return [data[start:end].decode("utf-8") for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def encode_dictionary(arrays, name, values):
+    """
+    Store a list of hashable values in arrays, as int32 codes (name + ".codes") into a dictionary of the distinct
+    values, in order of first appearance.
+    :return: list, the dictionary
+    """
+    dictionary = {}
+    codes = np.array([dictionary.setdefault(value, len(dictionary)) for value in values], dtype=np.int32)
+    arrays[name + ".codes"] = codes
+    return list(dictionary)
+
+
+def encode_offsets(arrays, name, lists):
+    """
+    Store the lengths of a list of lists in arrays, as name + ".offsets".
+    :return: list, every element of every list, end to end
+    """
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    np.cumsum([len(values) for values in lists], out=offsets[1:])
+    arrays[name + ".offsets"] = offsets
+    return [value for values in lists for value in values]
+
+
+def split_offsets(values, offsets):
+    """
+    :return: list of tuples, values cut at offsets
+    """
+    offsets = offsets.tolist()
+    return [tuple(values[start:end]) for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def encode_row_group(data_entries):
+    """
+    :param data_entries: list of data entries, all with the same fields
+    :return: dictionary of array name to array, see the module docstring
+    """
+    arrays = {"num_rows": np.array(len(data_entries), dtype=np.int64)}
+    for name in data_entries[0] if data_entries else ():
+        values = [entry[name] for entry in data_entries]
+        if name in STRING_FIELDS:
+            encode_strings(arrays, name, values)
+        elif name in DICTIONARY_FIELDS:
+            encode_strings(arrays, name + ".dictionary", encode_dictionary(arrays, name, values))
+        elif name in LIST_FIELDS:
+            flat = encode_offsets(arrays, name, values)
+            encode_strings(arrays, name + ".dictionary", encode_dictionary(arrays, name, flat))
+        elif name in PAIR_LIST_FIELDS:
+            flat = encode_offsets(arrays, name, values)
+            pairs = encode_dictionary(arrays, name, (tuple(pair) for pair in flat))
+            encode_strings(arrays, name + ".words", [pair[0] for pair in pairs])
+            encode_strings(arrays, name + ".tags", [pair[1] for pair in pairs])
+        elif name in TIMESTAMP_FIELDS:
+            arrays[name] = np.array([parse_created_at(value) for value in values], dtype=np.int64)
+        elif name in INT_FIELDS:
+            arrays[name] = np.array(values, dtype=np.int64)
+        elif name in FLOAT_FIELDS:
+            arrays[name] = np.array(values, dtype=np.float64)
+        else:
+            raise ValueError("Can't store data entry field %r in columns" % name)
+    return arrays
+
+
+def decode_column(archive, name):
+    """
+    :param archive: NpzFile of a row group
+    :param name: string, data entry field
+    :return: list of the values of the field, as they are in a data entry, except that lists are tuples
+    """
+    if name in STRING_FIELDS:
+        return decode_strings(archive, name)
+    if name in DICTIONARY_FIELDS:
+        dictionary = decode_strings(archive, name + ".dictionary")
+        return [dictionary[code] for code in archive[name + ".codes"].tolist()]
+    if name in LIST_FIELDS:
+        dictionary = decode_strings(archive, name + ".dictionary")
+        return split_offsets([dictionary[code] for code in archive[name + ".codes"].tolist()],
+                             archive[name + ".offsets"])
+    if name in PAIR_LIST_FIELDS:
+        pairs = list(zip(decode_strings(archive, name + ".words"), decode_strings(archive, name + ".tags")))
+        return split_offsets([pairs[code] for code in archive[name + ".codes"].tolist()], archive[name + ".offsets"])
+    if name in TIMESTAMP_FIELDS:
+        return [format_created_at(value) for value in archive[name].tolist()]
+    return archive[name].tolist()
+
+
+def stored_fields(archive):
+    """
+    :param archive: NpzFile of a row group
+    :return: set of the data entry fields stored in the row group
+    """
+    return set(key.split(".")[0] for key in archive.files) - {"num_rows"}
+
+
+###########
+# Writing #
+###########
+class ColumnarWriter:
+    """
+    Appends data entries to a columnar file, a row group at a time.
+
+    :param path: string, directory of the columnar file, created if needed
+    :param row_group_size: number of data entries in a row group
+    """
+    def __init__(self, path, row_group_size=ROW_GROUP_SIZE):
+        self.path = path
+        self.row_group_size = row_group_size
+        self.pending = []
+        os.makedirs(path, exist_ok=True)
+        self.row_groups = row_group_paths(path)
+        self.num_rows = sum(row_group_size_of(p) for p in self.row_groups)
+
+    def catch_up(self, jsonl_path):
+        """
+        Bring the columnar file in line with the output file it is a copy of, when resuming a crawl: row groups past
+        the end of the output file are dropped, and the entries that were never flushed are read back.
+
+        :param jsonl_path: string, path of the output file, in any format (see serializers.py), already truncated to
+                           its checkpoint
+        """
+        num_entries = 0
+        if os.path.exists(jsonl_path):
+            num_entries = sum(1 for _ in read_entries(jsonl_path))
+        while self.num_rows > num_entries:
+            last = self.row_groups.pop()
+            self.num_rows -= row_group_size_of(last)
+            os.remove(last)
+
+        self.pending = []
+        if num_entries > self.num_rows:
+            for i, entry in enumerate(read_entries(jsonl_path)):
+                if i >= self.num_rows:
+                    self.pending.append(entry)
+
+    def write(self, data_entries):
+        """
+        Add data entries, and write out every full row group.
+        :param data_entries: list of data entries
+        """
+        self.pending.extend(data_entries)
+        while len(self.pending) >= self.row_group_size:
+            self.flush_row_group(self.pending[:self.row_group_size])
+            self.pending = self.pending[self.row_group_size:]
+
+    def flush_row_group(self, data_entries):
+        """
+        Atomically write data entries as a new row group.
+        """
+        path = os.path.join(self.path, ROW_GROUP_PATTERN % len(self.row_groups))
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **encode_row_group(data_entries))
+        os.replace(tmp_path, path)
+        self.row_groups.append(path)
+        self.num_rows += len(data_entries)
+
+    def close(self):
+        """
+        Write out the last, partial, row group.
+        """
+        if self.pending:
+            self.flush_row_group(self.pending)
+            self.pending = []
+
+
+def convert_jsonl(jsonl_path, path=None, row_group_size=ROW_GROUP_SIZE):
+    """
+    Write the columnar copy of an existing output file, replacing any previous one.
+
+    :param jsonl_path: string, path of a twitter_search.py output file, in any format (see serializers.py)
+    :param path: string, directory of the columnar file, next to the output file by default
+    :param row_group_size: number of data entries in a row group
+    :return: string, path of the columnar file
+    """
+    path = path or columnar_path(jsonl_path)
+    for row_group in row_group_paths(path):
+        os.remove(row_group)
+    writer = ColumnarWriter(path, row_group_size)
+    batch = []
+    for entry in read_entries(jsonl_path):
+        batch.append(entry)
+        if len(batch) >= row_group_size:
+            writer.write(batch)
+            batch = []
+    writer.write(batch)
+    writer.close()
+    return path
+
+
+###########
+# Reading #
+###########
+def row_group_paths(path):
+    """
+    :param path: string, directory of a columnar file
+    :return: list of the paths of its row groups, in order
+    """
+    return sorted(glob.glob(os.path.join(path, "part-*.npz")))
+
+
+def row_group_size_of(row_group_path):
+    """
+    :return: int, number of data entries in a row group
+    """
+    with np.load(row_group_path) as archive:
+        return int(archive["num_rows"])
+
+
+def read_columns(path, columns):
+    """
+    Read some fields of a columnar file, a row group at a time. Fields a row group doesn't have are left out.
+
+    :param path: string, directory of a columnar file
+    :param columns: iterable of data entry fields
+    :return: generator of dictionaries of field to the list of its values in a row group
+    """
+    for row_group in row_group_paths(path):
+        with np.load(row_group) as archive:
+            available = stored_fields(archive)
+            yield dict((name, decode_column(archive, name)) for name in columns if name in available)
+
+
+def iter_entries(path, columns=None):
+    """
+    :param path: string, directory of a columnar file
+    :param columns: optional iterable of data entry fields, all of them by default
+    :return: generator of data entries with only those fields, which the analysis_search.py helpers accept
+    """
+    for row_group in row_group_paths(path):
+        with np.load(row_group) as archive:
+            available = stored_fields(archive)
+            names = [name for name in (columns or DATA_FIELDS + CLUSTER_FIELDS) if name in available]
+            values = [decode_column(archive, name) for name in names]
+            num_rows = int(archive["num_rows"])
+        for row in zip(*values) if names else ({} for _ in range(num_rows)):
+            yield dict(zip(names, row))
+
+
+if __name__ == "__main__":
+    # command line parsing
+    parser = argparse.ArgumentParser(description="Convert a twitter_search.py output file to the columnar format")
+    parser.add_argument("-i", "--input", help="Specify input file path", required=True)
+    parser.add_argument("-o", "--output", help="Specify output directory, next to the input file by default")
+    parser.add_argument("--row-group-size", help="Number of data entries in a row group", type=int,
+                        default=ROW_GROUP_SIZE)
+    args = parser.parse_args()
+
+    output_path = convert_jsonl(args.input, args.output, args.row_group_size)
+    print("Converted %s to %s, [%d] row groups" % (args.input, output_path, len(row_group_paths(output_path))))
@@ -0,0 +1,340 @@
+"""
+corpus_reader.py
+
+Random access to the entries of a twitter_search.py output file (JSON lines or msgpack, see serializers.py), through a
+memory map of the file and an index of where every entry starts, so that entry N, or entries N to M, are read without
+going through the ones before them, and the file can be cut into ranges of whole entries for worker processes, without
+reading it twice.
+
+The offset index is a NumPy int64 array with the start of every entry, then the end of the last one, so entry n is the
+bytes offsets[n]:offsets[n + 1]. It is found in a single pass: for JSON lines, by looking for the newlines of the
+mapped file with NumPy, a chunk at a time; for msgpack, by following the length prefixes. It is cached next to the
+output file (output file name + ".offsets.npz"), with a checksum of the last indexed bytes.
+
+Output files only grow (a resumed crawl appends to them), so CorpusReader.refresh only scans the bytes after the last
+indexed entry, and maps the file again. A last entry that is still being written is left out until it is complete. If
+the file no longer ends with the bytes that were indexed (eg. a resumed crawl truncated it back to its checkpoint, and
+wrote other entries), the offsets are found again from the start.
+
+Worker processes are only handed byte ranges (see CorpusReader.splits): each one maps the file itself, so the entries
+are read from the page cache that every process shares, and never pickled.
+
+Usage, to build (or refresh) the offset index of an output file:
+    python corpus_reader.py -i "../output/search/Tim|Hortons|2018-06-06"
+and from code:
+    with CorpusReader("../output/search/Tim|Hortons|2018-06-06") as reader:
+        entry = reader.entry(150000)
+        for counts in reader.map_splits(analysis_search.get_hashtag_counts):
+            ...
+"""
+import argparse
+import mmap
+import os
+import sys
+import time
+import zlib
+
+import numpy as np
+
+from batching import map_chunks
+from blocks import BLOCKS_HEADER
+from serializers import LENGTH, MSGPACK_HEADER, get_serializer
+
+OFFSETS_SUFFIX = ".offsets.npz"
+# number of bytes looked at at once, when looking for the newlines of a JSON lines file
+SCAN_CHUNK_SIZE = 1 << 24
+# number of bytes at the end of the indexed part of a file that are checksummed
+FINGERPRINT_SIZE = 256
+
+
+def offsets_path(output_filepath):
+    """
+    :param output_filepath: string, the output file of a crawl
+    :return: string, path of the cached offset index of the output file
+    """
+    return output_filepath + OFFSETS_SUFFIX
+
+
+def buffer_format(buffer):
+    """
+    :param buffer: the mapped output file
+    :return: string, "json" or "msgpack"
+    """
+    if buffer[:len(MSGPACK_HEADER)] == MSGPACK_HEADER:
+        return "msgpack"
+    return "json"
+
+
+def header_size(output_format):
+    """
+    :return: int, number of bytes before the first entry of a file of the format
+    """
+    return len(MSGPACK_HEADER) if output_format == "msgpack" else 0
+
+
+def fingerprint(buffer, size):
+    """
+    :param buffer: the mapped output file
+    :param size: int, number of bytes of the file
+    :return: int, checksum of the last bytes before size
+    """
+    return zlib.crc32(buffer[max(size - FINGERPRINT_SIZE, 0):size])
+
+
+def scan_offsets(buffer, start, stop, output_format):
+    """
+    Find the entries in a range of a mapped output file.
+
+    :param buffer: the mapped output file
+    :param start: int, offset of the first entry of the range
+    :param stop: int, offset to stop at. An entry that doesn't end before stop is left out.
+    :param output_format: string, "json" or "msgpack"
+    :return: int64 array of the start of every entry of the range, then the end of the last one
+    """
+    if output_format == "msgpack":
+        offsets = [start]
+        while offsets[-1] + LENGTH.size <= stop:
+            end = offsets[-1] + LENGTH.size + LENGTH.unpack_from(buffer, offsets[-1])[0]
+            if end > stop:
+                break
+            offsets.append(end)
+        return np.array(offsets, dtype=np.int64)
+
+    ends = [np.array([start], dtype=np.int64)]
+    for chunk_start in range(start, stop, SCAN_CHUNK_SIZE):
+        chunk = np.frombuffer(buffer, dtype=np.uint8, count=min(SCAN_CHUNK_SIZE, stop - chunk_start),
+                              offset=chunk_start)
+        ends.append(np.flatnonzero(chunk == ord("\n")) + (chunk_start + 1))
+        # let go of the view, so the map can be closed
+        del chunk
+    return np.concatenate(ends)
+
+
+def iter_range(path, start, stop):
+    """
+    Stream the entries in a range of an output file, from a map of the file.
+
+    :param path: string, path of the output file
+    :param start: int, offset of the first entry
+    :param stop: int, offset after the last entry
+    :return: generator of data entries
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        serializer = get_serializer(buffer_format(buffer))
+        offsets = scan_offsets(buffer, start, stop, serializer.name).tolist()
+        for entry_start, entry_end in zip(offsets[:-1], offsets[1:]):
+            yield serializer.load_bytes(buffer[entry_start:entry_end])
+
+
+def map_split(argument):
+    """
+    Run a function over the entries of a range of an output file, in a worker process. The entries are streamed to
+    the function rather than decoded into a list first: building a list of tens of thousands of entries is several
+    times slower, mostly in the garbage collector.
+
+    :param argument: tuple (function of an iterable of data entries, path, start offset, stop offset)
+    :return: result of the function
+    """
+    function, path, start, stop = argument
+    return function(iter_range(path, start, stop))
+
+
+class Split:
+    """
+    A range of whole entries of an output file.
+    """
+    __slots__ = ("first_entry", "num_entries", "start", "stop")
+
+    def __init__(self, first_entry, num_entries, start, stop):
+        self.first_entry = first_entry
+        self.num_entries = num_entries
+        # byte offsets of the range
+        self.start = start
+        self.stop = stop
+
+    def __repr__(self):
+        return "Split(entries %d-%d, bytes %d-%d)" % (self.first_entry, self.first_entry + self.num_entries,
+                                                      self.start, self.stop)
+
+
+class CorpusReader:
+    """
+    Random access to the entries of an output file, through a memory map. Not safe to share between threads.
+
+    :param path: string, path of the output file
+    :param cache: True to read the offset index from its sidecar file, and to write it back when it changes
+    """
+    def __init__(self, path, cache=True):
+        self.path = path
+        self.cache = cache
+        self.buffer = None
+        self.size = 0
+        self.output_format = "json"
+        self.serializer = get_serializer()
+        self.offsets = np.zeros(1, dtype=np.int64)
+        # checksum of the bytes before the end of the last indexed entry
+        self.fingerprint = fingerprint(b"", 0)
+        if cache:
+            self.load_offsets()
+        self.refresh()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def load_offsets(self):
+        """
+        Read the cached offsets, if there are any.
+        """
+        try:
+            with np.load(offsets_path(self.path)) as archive:
+                self.offsets, self.fingerprint = archive["offsets"], int(archive["fingerprint"])
+        except FileNotFoundError:
+            pass
+
+    def save_offsets(self):
+        """
+        Atomically write the offsets to their sidecar file.
+        """
+        tmp_path = offsets_path(self.path) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, offsets=self.offsets, fingerprint=np.uint32(self.fingerprint))
+        os.replace(tmp_path, offsets_path(self.path))
+
+    def map(self):
+        """
+        Map the whole file, as it is now.
+        """
+        self.size = os.path.getsize(self.path)
+        self.unmap()
+        if not self.size:
+            return
+        with open(self.path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[:len(BLOCKS_HEADER)] == BLOCKS_HEADER:
+            self.unmap()
+            raise ValueError("%s is a block file, read it with blocks.BlockReader" % self.path)
+        self.output_format = buffer_format(self.buffer)
+        self.serializer = get_serializer(self.output_format)
+
+    def unmap(self):
+        """
+        Close the map of the file. A map that views from raw() are still held on can't be closed yet: it is only
+        dropped, and unmapped once they are released.
+        """
+        if self.buffer is None:
+            return
+        buffer, self.buffer = self.buffer, None
+        try:
+            buffer.close()
+        except BufferError:
+            pass
+
+    def refresh(self):
+        """
+        Index the entries appended to the file since the last refresh.
+        :return: number of new entries
+        """
+        if self.buffer is None or os.path.getsize(self.path) != self.size:
+            self.map()
+        end = int(self.offsets[-1])
+        if end > self.size or fingerprint(self.buffer or b"", end) != self.fingerprint:
+            print("%s changed since it was indexed, finding its entries again" % self.path, file=sys.stderr)
+            self.offsets = np.zeros(1, dtype=np.int64)
+        if len(self) == 0:
+            self.offsets = np.array([header_size(self.output_format)], dtype=np.int64)
+            self.fingerprint = fingerprint(self.buffer or b"", int(self.offsets[0]))
+        end = int(self.offsets[-1])
+        if end >= self.size:
+            return 0
+
+        new_offsets = scan_offsets(self.buffer, end, self.size, self.output_format)
+        if len(new_offsets) > 1:
+            self.offsets = np.concatenate([self.offsets, new_offsets[1:]])
+            self.fingerprint = fingerprint(self.buffer, int(self.offsets[-1]))
+            if self.cache:
+                self.save_offsets()
+        return len(new_offsets) - 1
+
+    def raw(self, n):
+        """
+        :param n: int, position of the entry in the file
+        :return: memoryview of the bytes of the entry in the map, without a copy
+        """
+        if not 0 <= n < len(self):
+            raise IndexError("entry %d out of range, the file has %d" % (n, len(self)))
+        return memoryview(self.buffer)[self.offsets[n]:self.offsets[n + 1]]
+
+    def entry(self, n):
+        """
+        :param n: int, position of the entry in the file
+        :return: data entry
+        """
+        if not 0 <= n < len(self):
+            raise IndexError("entry %d out of range, the file has %d" % (n, len(self)))
+        return self.serializer.load_bytes(self.buffer[self.offsets[n]:self.offsets[n + 1]])
+
+    def entries(self, start, stop):
+        """
+        :param start: int, position of the first entry
+        :param stop: int, position after the last entry
+        :return: generator of the data entries in [start, stop)
+        """
+        stop = min(stop, len(self))
+        if start >= stop:
+            return
+        offsets = self.offsets[start:stop + 1].tolist()
+        for entry_start, entry_end in zip(offsets[:-1], offsets[1:]):
+            yield self.serializer.load_bytes(self.buffer[entry_start:entry_end])
+
+    def splits(self, num_splits):
+        """
+        Cut the file into ranges of whole entries, of about the same number of bytes.
+        :param num_splits: int, number of ranges
+        :return: list of Splits, fewer than num_splits if the file has fewer entries
+        """
+        cuts = np.searchsorted(self.offsets, np.linspace(self.offsets[0], self.offsets[-1], num_splits + 1))
+        cuts = np.unique(np.clip(cuts, 0, len(self))).tolist()
+        return [Split(first, stop - first, int(self.offsets[first]), int(self.offsets[stop]))
+                for first, stop in zip(cuts[:-1], cuts[1:])]
+
+    def map_splits(self, function, num_splits=None, num_workers=None):
+        """
+        Run function over the entries of ranges of the file, on a pool of processes, so that only its (small) results
+        come back, eg. the hashtag counts of every range.
+
+        :param function: picklable function of an iterable of data entries, eg. analysis_search.get_hashtag_counts
+        :param num_splits: number of ranges, defaults to 4 per worker
+        :param num_workers: number of worker processes, defaults to the number of cores
+        :return: generator of the results of function, one for each range, in file order
+        """
+        num_workers = num_workers or os.cpu_count()
+        splits = self.splits(num_splits or 4 * num_workers)
+        work = ((split, (function, self.path, split.start, split.stop)) for split in splits)
+        for _, result in map_chunks(map_split, work, num_workers):
+            yield result
+
+    def close(self):
+        self.unmap()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == "__main__":
+    # command line parsing
+    parser = argparse.ArgumentParser(description="Build or refresh the offset index of an output file")
+    parser.add_argument("-i", "--input", help="Specify input file path", required=True)
+    parser.add_argument("--splits", help="Print the ranges the file would be cut into, for this many workers",
+                        type=int)
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    with CorpusReader(args.input) as corpus_reader:
+        print("Indexed [%d] entries of %s in %.2fs, %.1f MB of offsets" % (
+            len(corpus_reader), args.input, time.perf_counter() - start_time, corpus_reader.offsets.nbytes / 1e6))
+        if args.splits:
+            for corpus_split in corpus_reader.splits(args.splits):
+                print(corpus_split)
@@ -0,0 +1,25 @@
+"""
+enrich_cache.py
+
+A content-addressed cache of enrichment results (TextBlob polarity, subjectivity and PoS tags), keyed by a hash of the
+cleaned tweet text.
+
+Lots of tweets are the same text once cleaned - copy-paste campaigns, bots, "I'm at ..." templates - and TextBlob is
+by far the most expensive part of building a data entry, so every repeat is served from the cache instead.
+
+The cache is the one of the tweety app (see project/tweety/twitter/cache.py), imported from there so the crawlers and
+the app share one implementation, and one sqlite file format. It doesn't need Django.
+
+Usage:
+    cache = EnrichmentCache(path="../output/enrichment.sqlite3")
+    twitter_util.set_enrichment_cache(cache)
+"""
+import os
+import sys
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "project")
+
+if os.path.abspath(PROJECT_DIR) not in sys.path:
+    sys.path.insert(0, os.path.abspath(PROJECT_DIR))
+
+from tweety.twitter.cache import EnrichmentCache, MAX_BYTES, MAX_DISK_ENTRIES, features_size, text_key
@@ -0,0 +1,490 @@
+"""
+inverted_index.py
+
+An on-disk inverted index of the data entries of an output file (or block file), so that "which tweets have #coffee"
+or "which tweets contain latte" is answered from posting lists, instead of parsing every entry of the file.
+
+Terms:
+    - "#" + a hashtag of the entry, eg. "#coffee"
+    - "@" + a mention of the entry, eg. "@timhortons"
+    - every word of the cleaned text (runs of letters, digits and "_"), eg. "latte"
+all in lower case. An entry written without some of these fields (see --fields in twitter_search.py) is indexed by the
+ones it has.
+
+The index of an output file is a directory (output file name + ".idx") holding:
+    - "index.json": the format of the file, how many entries and bytes of it are indexed, a checksum of the last
+      indexed bytes (for a block file: its size and modification time, and a checksum of the block of the last
+      indexed entry), and the list of segments
+    - segments, "seg-000000.npz", ...: each one indexes a run of consecutive entries, in an uncompressed NumPy .npz
+      archive of:
+        - the sorted terms of the run, stored as in columnar.py
+        - the posting list of every term: the numbers (positions in the file) of the entries that have it, delta
+          encoded (the first one relative to the first entry of the segment), end to end, in the smallest unsigned
+          integer type that holds every delta, with the offsets of each list
+        - the byte offset of every entry of the run in the output file, to read back the matching entries with one
+          seek each (empty for a block file, whose entries are read back by number)
+
+Output files only grow (a resumed crawl appends to them), so InvertedIndex.update only reads the entries after the
+indexed bytes, and adds them as new segments. Segments are merged into one when there are more than max_segments of
+them. If the file no longer ends with the bytes that were indexed (eg. a resumed crawl truncated it back to its
+checkpoint, and wrote other entries), the index is rebuilt from scratch. The same goes for a block file whose block
+of the last indexed entry changed, eg. converted again from another output file.
+
+Usage, to build (or update) the index of an output file:
+    python inverted_index.py -i "../output/search/Tim|Hortons|2018-06-06"
+to search it, hashtags and words separated by spaces must all match, and OR separates alternatives:
+    python inverted_index.py -i "../output/search/Tim|Hortons|2018-06-06" -q "#coffee latte OR @timhortons"
+and from code:
+    with InvertedIndex("../output/search/Tim|Hortons|2018-06-06") as index:
+        index.update()
+        for entry in index.entries(index.search("#coffee latte")):
+            ...
+"""
+import argparse
+import bisect
+import collections
+import json
+import os
+import re
+import shutil
+import sys
+import time
+import zlib
+
+import numpy as np
+
+import blocks
+from columnar import decode_strings, encode_strings
+from serializers import detect_format, get_serializer
+
+INDEX_SUFFIX = ".idx"
+META_FILE = "index.json"
+SEGMENT_PATTERN = "seg-%06d.npz"
+SEGMENT_SIZE = 50000
+MAX_SEGMENTS = 8
+# number of bytes at the end of the indexed part of a file that are checksummed
+FINGERPRINT_SIZE = 256
+BLOCKS_FORMAT = "blocks"
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def index_path(output_filepath):
+    """
+    :param output_filepath: string, the output file of a crawl
+    :return: string, path of the index of the output file
+    """
+    return output_filepath + INDEX_SUFFIX
+
+
+def entry_terms(entry):
+    """
+    :param entry: data entry
+    :return: set of the terms of the entry
+    """
+    terms = set(TOKEN_PATTERN.findall(entry.get("cleaned", "").lower()))
+    terms.update("#" + hashtag.lower() for hashtag in entry.get("hashtags", ()))
+    terms.update("@" + name.lower() for name in entry.get("mentions", ()))
+    return terms
+
+
+def query_terms(word):
+    """
+    :param word: string, a word of a query, eg. "#Coffee" or "latte"
+    :return: list of the terms an entry must have to match the word
+    """
+    word = word.lower()
+    if word[:1] in ("#", "@"):
+        return [word]
+    return TOKEN_PATTERN.findall(word)
+
+
+############
+# Postings #
+############
+def encode_postings(postings, first_entry):
+    """
+    :param postings: dictionary of term to increasing numbers of the entries that have it
+    :param first_entry: int, number of the first entry of the segment
+    :return: dictionary of the arrays of the terms and posting lists
+    """
+    terms = sorted(postings)
+    lists = [np.asarray(postings[term], dtype=np.int64) for term in terms]
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    np.cumsum([len(numbers) for numbers in lists], out=offsets[1:])
+    numbers = np.concatenate(lists) if lists else np.zeros(0, dtype=np.int64)
+
+    deltas = numbers.copy()
+    deltas[1:] -= numbers[:-1]
+    # every list starts over from the first entry of the segment
+    deltas[offsets[:-1]] = numbers[offsets[:-1]] - first_entry
+    arrays = {
+        "postings.offsets": offsets,
+        "postings.deltas": deltas.astype(np.min_scalar_type(deltas.max() if len(deltas) else 0)),
+    }
+    encode_strings(arrays, "terms", terms)
+    return arrays
+
+
+class Segment:
+    """
+    The posting lists of a run of consecutive entries.
+
+    :param path: string, path of the segment archive
+    :param first_entry: int, number of the first entry of the run
+    :param num_entries: int, number of entries in the run
+    """
+    def __init__(self, path, first_entry, num_entries):
+        self.path = path
+        self.first_entry = first_entry
+        self.num_entries = num_entries
+        with np.load(path) as archive:
+            self.terms = dict((term, i) for i, term in enumerate(decode_strings(archive, "terms")))
+            self.offsets = archive["postings.offsets"]
+            self.deltas = archive["postings.deltas"]
+            self.entry_offsets = archive["entries.offsets"]
+
+    def postings(self, term):
+        """
+        :param term: string
+        :return: int64 array of the numbers of the entries of the segment that have the term, increasing
+        """
+        i = self.terms.get(term)
+        if i is None:
+            return np.zeros(0, dtype=np.int64)
+        numbers = np.cumsum(self.deltas[self.offsets[i]:self.offsets[i + 1]], dtype=np.int64)
+        numbers += self.first_entry
+        return numbers
+
+    def all_postings(self):
+        """
+        :return: dictionary of every term of the segment to its posting list
+        """
+        return dict((term, self.postings(term)) for term in self.terms)
+
+
+def write_segment(path, postings, first_entry, entry_offsets):
+    """
+    Write a segment whole, to a temporary file then renamed, so that a reader never sees half of it.
+
+    :param postings: dictionary of term to increasing numbers of the entries that have it
+    :param first_entry: int, number of the first entry of the segment
+    :param entry_offsets: list of the byte offsets of the entries of the segment, empty for a block file
+    """
+    arrays = encode_postings(postings, first_entry)
+    arrays["entries.offsets"] = np.asarray(entry_offsets, dtype=np.int64)
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(temporary_path, path)
+
+
+#########
+# Index #
+#########
+class InvertedIndex:
+    """
+    The inverted index of an output file, or of a block file (see blocks.py).
+
+    :param path: string, path of the output file
+    :param directory: string, path of the index, next to the output file by default
+    :param segment_size: maximum number of entries indexed by a new segment
+    :param max_segments: number of segments above which they are merged into one
+    """
+    def __init__(self, path, directory=None, segment_size=SEGMENT_SIZE, max_segments=MAX_SEGMENTS):
+        self.path = path
+        self.directory = directory or index_path(path)
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.file = None
+        self.block_reader = None
+        self.meta = self.load_meta()
+        self.segments = [Segment(os.path.join(self.directory, segment["name"]), segment["first_entry"],
+                                 segment["num_entries"]) for segment in self.meta["segments"]]
+        self._entry_offsets = None
+
+    def __len__(self):
+        """
+        :return: number of indexed entries
+        """
+        return self.meta["entries"]
+
+    def load_meta(self):
+        """
+        :return: dictionary, the contents of index.json, or the one of an empty index
+        """
+        try:
+            with open(os.path.join(self.directory, META_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"format": None, "entries": 0, "size": 0, "mtime": None, "fingerprint": None, "next_segment": 0,
+                    "segments": []}
+
+    def save_meta(self):
+        os.makedirs(self.directory, exist_ok=True)
+        temporary_path = os.path.join(self.directory, META_FILE + ".tmp")
+        with open(temporary_path, "w") as f:
+            json.dump(self.meta, f)
+        os.replace(temporary_path, os.path.join(self.directory, META_FILE))
+
+    def fingerprint(self, size):
+        """
+        :param size: int, number of bytes of the file
+        :return: int, checksum of the last bytes before size
+        """
+        with open(self.path, "rb") as f:
+            f.seek(max(size - FINGERPRINT_SIZE, 0))
+            return zlib.crc32(f.read(min(size, FINGERPRINT_SIZE)))
+
+    def block_fingerprint(self, reader, num_entries):
+        """
+        :param reader: BlockReader of the file
+        :param num_entries: int, number of indexed entries, at least one
+        :return: list of the offset and the checksum of the block of the last indexed entry. Appending to a block file
+                 leaves its blocks as they are.
+        """
+        block = reader.blocks[bisect.bisect_right(reader.starts, num_entries - 1) - 1]
+        return [block.offset, zlib.crc32(reader.read_raw(block))]
+
+    def is_stale(self):
+        """
+        :return: True if the file was rewritten since it was indexed, rather than appended to
+        """
+        if not self.meta["entries"]:
+            return False
+        if self.meta["format"] == BLOCKS_FORMAT:
+            stat = os.stat(self.path)
+            if stat.st_size == self.meta["size"] and stat.st_mtime == self.meta.get("mtime"):
+                return False
+            if stat.st_size < self.meta["size"]:
+                return True
+            with blocks.BlockReader(self.path) as reader:
+                return (len(reader) < self.meta["entries"] or
+                        self.block_fingerprint(reader, self.meta["entries"]) != self.meta["fingerprint"])
+        size = self.meta["size"]
+        return os.path.getsize(self.path) < size or self.fingerprint(size) != self.meta["fingerprint"]
+
+    def clear(self):
+        """
+        Drop every segment.
+        """
+        self.close()
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+        self.meta = self.load_meta()
+        self.segments = []
+        self._entry_offsets = None
+
+    ############
+    # Updating #
+    ############
+    def new_entries(self):
+        """
+        :return: generator of (number, byte offset or None, data entry) tuples, for the entries after the indexed ones
+        """
+        number = self.meta["entries"]
+        if blocks.is_block_file(self.path):
+            self.meta["format"] = BLOCKS_FORMAT
+            with blocks.BlockReader(self.path) as reader:
+                for entry in reader.entries(number, len(reader)):
+                    yield number, None, entry
+                    number += 1
+            return
+
+        with open(self.path, "rb") as f:
+            serializer = detect_format(f)
+            if self.meta["size"]:
+                f.seek(self.meta["size"])
+            self.meta["format"] = serializer.name
+            for offset, size, entry in serializer.load_stream_offsets(f, self.path):
+                yield number, offset, entry
+                number += 1
+                self.meta["size"] = offset + size
+
+    def add_segment(self, postings, first_entry, entry_offsets, num_entries):
+        name = SEGMENT_PATTERN % self.meta["next_segment"]
+        os.makedirs(self.directory, exist_ok=True)
+        write_segment(os.path.join(self.directory, name), postings, first_entry, entry_offsets)
+        self.meta["next_segment"] += 1
+        self.meta["segments"].append({"name": name, "first_entry": first_entry, "num_entries": num_entries})
+        self.segments.append(Segment(os.path.join(self.directory, name), first_entry, num_entries))
+
+    def update(self):
+        """
+        Index the entries appended to the file since the last update, or every entry the first time.
+        :return: number of entries that were indexed
+        """
+        if self.is_stale():
+            print("%s changed since it was indexed, rebuilding its index" % self.path, file=sys.stderr)
+            self.clear()
+
+        # taken before reading, so that entries appended meanwhile are looked at next time
+        stat = os.stat(self.path)
+        start = end = first_entry = self.meta["entries"]
+        postings = collections.defaultdict(list)
+        entry_offsets = []
+        for number, offset, entry in self.new_entries():
+            for term in entry_terms(entry):
+                postings[term].append(number)
+            if offset is not None:
+                entry_offsets.append(offset)
+            end = number + 1
+            if end - first_entry >= self.segment_size:
+                self.add_segment(postings, first_entry, entry_offsets, end - first_entry)
+                postings, entry_offsets, first_entry = collections.defaultdict(list), [], end
+        if end > first_entry:
+            self.add_segment(postings, first_entry, entry_offsets, end - first_entry)
+
+        self.meta["entries"] = end
+        if self.meta["format"] != BLOCKS_FORMAT:
+            self.meta["fingerprint"] = self.fingerprint(self.meta["size"])
+        elif end > 0:
+            self.meta["size"], self.meta["mtime"] = stat.st_size, stat.st_mtime
+            with blocks.BlockReader(self.path) as reader:
+                self.meta["fingerprint"] = self.block_fingerprint(reader, end)
+        if len(self.segments) > self.max_segments:
+            self.merge()
+        self.save_meta()
+        self._entry_offsets = None
+        return end - start
+
+    def merge(self):
+        """
+        Merge every segment into one. The old segments are deleted once the index points at the new one.
+        """
+        if len(self.segments) < 2:
+            return
+        postings = collections.defaultdict(list)
+        for segment in self.segments:
+            for term, numbers in segment.all_postings().items():
+                postings[term].append(numbers)
+        postings = dict((term, np.concatenate(lists)) for term, lists in postings.items())
+        entry_offsets = np.concatenate([segment.entry_offsets for segment in self.segments])
+        old_paths = [segment.path for segment in self.segments]
+
+        self.meta["segments"], self.segments = [], []
+        self.add_segment(postings, 0, entry_offsets, self.meta["entries"])
+        self.save_meta()
+        for path in old_paths:
+            os.remove(path)
+
+    #############
+    # Searching #
+    #############
+    def postings(self, term):
+        """
+        :param term: string, eg. "#coffee", "@timhortons" or "latte", in lower case
+        :return: int64 array of the numbers of the entries that have the term, increasing
+        """
+        lists = [segment.postings(term) for segment in self.segments]
+        return np.concatenate(lists) if lists else np.zeros(0, dtype=np.int64)
+
+    def match_all(self, terms):
+        """
+        :param terms: list of terms
+        :return: int64 array of the numbers of the entries that have every term, increasing
+        """
+        if not terms:
+            return np.zeros(0, dtype=np.int64)
+        # intersect the shortest lists first
+        lists = sorted((self.postings(term) for term in terms), key=len)
+        numbers = lists[0]
+        for other in lists[1:]:
+            if not len(numbers):
+                break
+            numbers = np.intersect1d(numbers, other, assume_unique=True)
+        return numbers
+
+    def search(self, query):
+        """
+        :param query: string, words that must all match, eg. "#coffee latte", with OR between alternatives, eg.
+                      "#coffee latte OR @timhortons"
+        :return: int64 array of the numbers of the matching entries, increasing
+        """
+        matches = [self.match_all([term for word in alternative.split() for term in query_terms(word)])
+                   for alternative in query.split(" OR ")]
+        return np.unique(np.concatenate(matches))
+
+    ###########
+    # Reading #
+    ###########
+    def entry_offsets(self):
+        """
+        :return: int64 array of the byte offset of every indexed entry
+        """
+        if self._entry_offsets is None:
+            self._entry_offsets = np.concatenate([segment.entry_offsets for segment in self.segments] or
+                                                 [np.zeros(0, dtype=np.int64)])
+        return self._entry_offsets
+
+    def entries(self, numbers):
+        """
+        :param numbers: increasing numbers of indexed entries, eg. from search
+        :return: generator of the data entries
+        """
+        if self.meta["format"] == BLOCKS_FORMAT:
+            if self.block_reader is None:
+                self.block_reader = blocks.BlockReader(self.path)
+            for entry in self.block_entries(numbers):
+                yield entry
+            return
+
+        if self.file is None:
+            self.file = open(self.path, "rb")
+        serializer = get_serializer(self.meta["format"])
+        offsets = self.entry_offsets()
+        for number in numbers:
+            yield serializer.load_entry(self.file, int(offsets[number]))
+
+    def block_entries(self, numbers):
+        """
+        Read entries of a block file, decompressing each block they are in once.
+        """
+        reader = self.block_reader
+        current, block_entries = None, None
+        for number in numbers:
+            i = bisect.bisect_right(reader.starts, number) - 1
+            if i != current:
+                current, block_entries = i, reader.read_block(i)
+            yield block_entries[number - reader.starts[i]]
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.block_reader is not None:
+            self.block_reader.close()
+            self.block_reader = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == "__main__":
+    # command line parsing
+    parser = argparse.ArgumentParser(description="Build or search the inverted index of an output file")
+    parser.add_argument("-i", "--input", help="Specify input file path", required=True)
+    parser.add_argument("-d", "--index", help="Specify index directory path, next to the input file by default")
+    parser.add_argument("-q", "--query", help="Search the index, eg. \"#coffee latte OR @timhortons\"")
+    parser.add_argument("-n", "--num-results", help="Number of matching tweets to print", type=int, default=10)
+    parser.add_argument("--rebuild", help="Build the index from scratch", action="store_true")
+    args = parser.parse_args()
+
+    with InvertedIndex(args.input, args.index) as index:
+        if args.rebuild:
+            index.clear()
+        start = time.perf_counter()
+        num_new = index.update()
+        print("Indexed [%d] new entries in %.2fs, [%d] in total, %d segments" % (
+            num_new, time.perf_counter() - start, len(index), len(index.segments)))
+
+        if args.query:
+            start = time.perf_counter()
+            numbers = index.search(args.query)
+            results = list(index.entries(numbers[:args.num_results]))
+            print("[%d] matches in %.1fms" % (len(numbers), (time.perf_counter() - start) * 1000))
+            for entry in results:
+                print("%s  %s" % (entry.get("created_at", ""), entry.get("raw", entry.get("cleaned", ""))))
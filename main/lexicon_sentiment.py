@@ -0,0 +1,260 @@
+"""
+lexicon_sentiment.py
+
+A batch version of TextBlob's default sentiment analysis (PatternAnalyzer), for reprocessing large numbers of tweets.
+
+TextBlob scores one text at a time, walking its words in a Python loop. LexiconSentiment loads the same lexicon
+(textblob/en/en-sentiment.xml) once into NumPy arrays, tokenizes a whole batch of texts, and then applies the same
+rules to every word of the batch at once, with array operations:
+    - only words in the lexicon are scored, and a text's polarity and subjectivity are the averages of its scores
+    - an adverb from the lexicon ("very", "really") multiplies the score of the next scored word by its intensity,
+      across short words ("really is a good")
+    - "no", "not" and "never" before a scored word (across words of 1 letter) turn its polarity into -0.5 times
+      itself, and invert the intensity it passes on ("not very good")
+    - each "!" multiplies the polarity of the score before it by 1.25
+    - emoticons such as ":)" or "<3" are scored by their mood
+
+Tokenizing: TextBlob's tokenizer splits punctuation off the ends of words, but it also keeps periods at the start of
+words ("...good" is one word) and after abbreviations ("e.g."), and joins the characters of emoticons back together
+across spaces ("; )" is ";)"). Texts without periods or emoticon characters, most cleaned tweets, are tokenized here by
+a regular expression that gives the same tokens. The others go through TextBlob's own tokenizer, which is slower, so
+that every text gets TextBlob's tokens.
+
+Tolerance: the scores are the same as TextBlob's up to floating point rounding (1e-9). benchmark_sentiment.py reports
+the agreement on a corpus, with --punctuation for texts full of punctuation and emoticons. TextBlob's PoS tags aren't
+used by its sentiment analysis either, so they aren't needed here.
+
+Usage:
+    polarity, subjectivity = get_scorer().score(["good coffee", "not very good coffee"])
+"""
+import itertools
+import re
+import threading
+
+import numpy as np
+from textblob._text import EMOTICONS, PUNCTUATION
+from textblob.en import sentiment as PATTERN_SENTIMENT
+
+# TextBlob's tokenizer splits "n't" into "n ' t", so it is never seen as a negation
+NEGATIONS = ("no", "not", "never")
+MODIFIER_TAG = "RB"
+EXCLAMATION_BOOST = 1.25
+NEGATION_FACTOR = -0.5
+SARCASM = "(!)"
+
+# token codes, for words that aren't in the lexicon. Emoticon k is EMOTICON_CODE - k.
+UNKNOWN_CODE = -1
+NEGATION_CODE = -2
+EXCLAMATION_CODE = -3
+EMOTICON_CODE = -4
+
+QUOTES = "'\"“”‘’"
+
+
+def build_token_pattern():
+    """
+    The tokenizer of texts without periods or emoticon characters: punctuation at the start and end of words is split
+    off one character at a time, and quotes are always split off, like TextBlob's tokenizer does.
+
+    :return: compiled regular expression, to use with findall on lowercase text
+    """
+    punctuation = re.escape(PUNCTUATION + QUOTES)
+    quotes = re.escape(QUOTES)
+    return re.compile(r"[%s]|[^\s%s](?:[^\s%s]*[^\s%s])?" % (punctuation, punctuation, quotes, punctuation))
+
+
+def build_special_pattern():
+    """
+    :return: compiled regular expression, that finds what TextBlob's tokenizer does more with than build_token_pattern:
+             periods, the characters of emoticons (except quotes, emoticons with a quote have other characters too),
+             and emoticons made of letters split by spaces ("x D")
+    """
+    faces = [face for faces in EMOTICONS.values() for face in faces]
+    characters = set(c for face in faces for c in face if not c.isalnum()) - set(QUOTES)
+    characters |= set(".()")
+    spaced = [r"\s+".join(re.escape(c) for c in face) for face in faces if face.isalnum() and len(face) > 1]
+    return re.compile("|".join(["[%s]" % re.escape("".join(sorted(characters)))] + spaced))
+
+
+def clip(values):
+    return np.clip(values, -1.0, 1.0)
+
+
+class LexiconSentiment:
+    """
+    Scores batches of texts with TextBlob's sentiment lexicon and rules, see the module docstring.
+    Build it once and reuse it, loading the lexicon takes a moment.
+    """
+    def __init__(self, lexicon=PATTERN_SENTIMENT):
+        # force the lazy lexicon to load
+        len(lexicon)
+        words = sorted(dict.keys(lexicon))
+        scores = np.array([dict.__getitem__(lexicon, w)[None] for w in words], dtype=np.float64).reshape(-1, 3)
+        self.polarity = scores[:, 0]
+        self.subjectivity = scores[:, 1]
+        self.intensity = scores[:, 2]
+        self.is_modifier = np.array([MODIFIER_TAG in dict.__getitem__(lexicon, w) for w in words], dtype=bool)
+        self.ends_with_ly = np.array([w.endswith("ly") for w in words], dtype=bool)
+
+        emoticons = []
+        emoticon_polarity = []
+        for (mood, polarity), faces in EMOTICONS.items():
+            # tokens are lowercase, TextBlob compares them to the lowercase emoticons, the first mood to have one wins
+            for face in sorted(set(face.lower() for face in faces)):
+                if face not in emoticons and not face.isalpha() and len(face) <= 5 and face not in PUNCTUATION:
+                    emoticons.append(face)
+                    emoticon_polarity.append(polarity)
+        # sarcasm is scored like an emoticon, neutral but subjective
+        emoticons.append(SARCASM)
+        emoticon_polarity.append(0.0)
+        self.emoticon_polarity = np.array(emoticon_polarity, dtype=np.float64)
+
+        self.codes = dict((w, i) for i, w in enumerate(words))
+        for negation in NEGATIONS:
+            self.codes.setdefault(negation, NEGATION_CODE)
+        self.codes.setdefault("!", EXCLAMATION_CODE)
+        for k, face in enumerate(emoticons):
+            self.codes.setdefault(face, EMOTICON_CODE - k)
+        self.token_pattern = build_token_pattern()
+        self.special_pattern = build_special_pattern()
+        self.tokenizer = lexicon.tokenizer
+
+    def tokenize(self, texts):
+        """
+        :param texts: list of strings
+        :return: tuple (list of every token of the batch, number of tokens of each text)
+        """
+        tokens = []
+        counts = []
+        findall = self.token_pattern.findall
+        special = self.special_pattern.search
+        for text in texts:
+            if special(text) is None:
+                # TextBlob splits "n't" off before it lowercases the text
+                text_tokens = findall(text.replace("n't", " n't").lower())
+            else:
+                text_tokens = " ".join(self.tokenizer(text)).lower().split()
+            tokens.extend(text_tokens)
+            counts.append(len(text_tokens))
+        return tokens, counts
+
+    def score(self, texts):
+        """
+        :param texts: list of cleaned tweet texts
+        :return: tuple of 2 arrays, the polarity and subjectivity of every text
+        """
+        num_texts = len(texts)
+        tokens, counts = self.tokenize(texts)
+        num_tokens = len(tokens)
+        codes = np.fromiter(map(self.codes.get, tokens, itertools.repeat(UNKNOWN_CODE)), dtype=np.int64,
+                            count=num_tokens)
+        lengths = np.fromiter(map(len, tokens), dtype=np.int64, count=num_tokens)
+        counts = np.array(counts, dtype=np.int64)
+        text_of = np.repeat(np.arange(num_texts), counts)
+        text_start = np.repeat(np.cumsum(counts) - counts, counts)
+        positions = np.arange(num_tokens)
+
+        def last_before(mask):
+            """
+            :return: for every token, the position of the last token of the same text before it for which mask is
+                     True, or -1
+            """
+            last = np.maximum.accumulate(np.where(mask, positions, -1)) if num_tokens else positions
+            before = np.empty_like(last)
+            before[:1] = -1
+            before[1:] = last[:-1]
+            before[before < text_start] = -1
+            return before
+
+        def none_between(mask, start):
+            """
+            :return: for every token, whether mask is False for every token strictly between start and itself
+            """
+            cumulative = np.cumsum(mask)
+            before = np.zeros(num_tokens, dtype=np.int64)
+            before[1:] = cumulative[:-1]
+            return before - cumulative[np.maximum(start, 0)] == 0
+
+        known = codes >= 0
+        word = np.where(known, codes, 0)
+        negation = codes == NEGATION_CODE
+        exclamation = codes == EXCLAMATION_CODE
+        emoticon = codes <= EMOTICON_CODE
+        unknown = ~known
+
+        # the last scored word before every token, and whether it is still modifying the next scored word
+        previous = last_before(known)
+        has_previous = previous >= 0
+        previous_word = word[np.maximum(previous, 0)]
+        modifier_before = has_previous & self.is_modifier[previous_word]
+        # a negation right after an adverb ending in "ly" negates the adverb itself ("really not good"), and keeps it
+        # modifying. Otherwise, words of more than 2 letters stop the adverb from modifying.
+        breaks_modifier = unknown & (lengths > 2) & ~negation
+        negates_modifier = negation & modifier_before & none_between(breaks_modifier, previous) & \
+            self.ends_with_ly[previous_word]
+        breaks_modifier |= negation & (lengths > 2) & ~negates_modifier
+        modified = known & modifier_before & none_between(breaks_modifier, previous)
+
+        # a negation lasts until the next scored word, or the next word of more than 1 letter
+        breaks_negation = known | (unknown & ~negation & (lengths > 1)) | negates_modifier
+        negated = known & (last_before(negation & ~negates_modifier) > last_before(breaks_negation))
+
+        # every scored word and emoticon starts a new score, except modified words: they replace the last score before
+        # them with their own, multiplied by the intensity of the word (or emoticon) that score came from
+        scored = known | emoticon
+        emoticon_index = EMOTICON_CODE - np.minimum(codes, EMOTICON_CODE)
+        token_polarity = np.where(known, self.polarity[word], self.emoticon_polarity[emoticon_index] * emoticon)
+        token_subjectivity = np.where(known, self.subjectivity[word], 1.0 * emoticon)
+        token_intensity = np.where(known, self.intensity[word], 1.0)
+        previous_scored = last_before(scored)
+
+        starts = emoticon | (known & ~modified)
+        group_of = np.cumsum(starts) - 1
+        scored_positions = positions[scored]
+        scored_groups = group_of[scored]
+        is_last = np.ones(len(scored_positions), dtype=bool)
+        is_last[:-1] = scored_groups[1:] != scored_groups[:-1]
+        last = scored_positions[is_last]
+        num_groups = len(last)
+
+        polarity = token_polarity[last]
+        subjectivity = token_subjectivity[last]
+        grouped = ~starts[last]
+        before_last = previous_scored[last][grouped]
+        intensity = token_intensity[before_last]
+        intensity = np.where(negated[before_last], 1.0 / intensity, intensity)
+        polarity[grouped] = clip(polarity[grouped] * intensity)
+        subjectivity[grouped] = clip(subjectivity[grouped] * intensity)
+
+        group_negated = np.bincount(group_of[negated], minlength=num_groups) > 0
+        group_negated |= np.bincount(group_of[previous_scored[negates_modifier]], minlength=num_groups) > 0
+
+        # every "!" boosts the score right before it, unless a modified word replaces that score later on
+        boosted = previous_scored[exclamation]
+        boosted = boosted[boosted >= 0]
+        boosted = boosted[last[group_of[boosted]] == boosted]
+        group_boosts = np.bincount(group_of[boosted], minlength=num_groups)
+        polarity = clip(polarity * EXCLAMATION_BOOST ** group_boosts)
+        polarity = np.where(group_negated, polarity * NEGATION_FACTOR, polarity)
+
+        # average every score of each text
+        group_texts = text_of[last]
+        num_scores = np.maximum(np.bincount(group_texts, minlength=num_texts), 1)
+        polarity = np.bincount(group_texts, weights=polarity, minlength=num_texts) / num_scores
+        subjectivity = np.bincount(group_texts, weights=subjectivity, minlength=num_texts) / num_scores
+        return polarity, subjectivity
+
+
+_scorer = None
+_scorer_lock = threading.Lock()
+
+
+def get_scorer():
+    """
+    :return: LexiconSentiment, the process-wide scorer, created on first use
+    """
+    global _scorer
+    with _scorer_lock:
+        if _scorer is None:
+            _scorer = LexiconSentiment()
+        return _scorer
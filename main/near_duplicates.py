@@ -0,0 +1,185 @@
+"""
+near_duplicates.py
+
+Near-duplicate detection for tweets, with MinHash and locality sensitive hashing (LSH), over their cleaned text.
+
+Viral queries are full of tweets that are the same once cleaned, up to an emoji, a word or a bit of punctuation. A
+NearDuplicateIndex groups them into clusters as they stream in, so that TextBlob runs once per cluster instead of once
+per tweet (see set_near_duplicate_index in twitter_util.py), and every data entry records its cluster:
+    - "cluster_id": id of the first tweet of the cluster
+    - "cluster_size": number of tweets in the cluster so far, this one included. Entries are written as the crawl goes,
+      so the size of the whole cluster is the largest cluster_size among its entries, see final_cluster_sizes.
+
+How it works: each text becomes a set of character shingles (punctuation and emoji removed, whitespace collapsed), and
+its MinHash signature estimates the Jaccard similarity of two such sets, as the fraction of equal values. The signature
+is cut into bands, and texts sharing any band are candidates; a candidate joins the cluster only if its estimated
+similarity is at least the threshold.
+
+Memory is bounded: only the max_clusters most recently seen clusters are kept, a near-duplicate of an evicted cluster
+starts a new one. Each cluster takes about 2KB, plus its text features.
+
+Usage:
+    index = NearDuplicateIndex()
+    cluster, size = index.assign("free coffee today at tim hortons", 1004215870011740161)
+"""
+import collections
+import re
+import threading
+import zlib
+
+import numpy as np
+
+MAX_CLUSTERS = 20000
+NUM_PERMUTATIONS = 64
+NUM_BANDS = 16
+THRESHOLD = 0.8
+SHINGLE_SIZE = 5
+SEED = 1
+
+# the MinHash permutations are x -> (a * x + b) mod PRIME, where every product fits in 64 bits
+PRIME = (1 << 31) - 1
+NOT_SHINGLED = re.compile(r"[^\w\s]+")
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    """
+    :param text: string, cleaned tweet text
+    :param size: number of characters in a shingle
+    :return: set of strings, the shingles of the text
+    """
+    normalized = " ".join(NOT_SHINGLED.sub("", text).split())
+    if not normalized:
+        # nothing but punctuation and emoji, only the same text is a duplicate
+        normalized = text
+    if len(normalized) <= size:
+        return {normalized}
+    return set(normalized[i:i + size] for i in range(len(normalized) - size + 1))
+
+
+class Cluster:
+    """
+    A group of near-duplicate texts.
+
+    :param cluster_id: int, id of the first tweet of the cluster
+    :param text: string, cleaned text of the first tweet, the one the cluster's features are computed from
+    :param signature: array, MinHash signature of text
+    """
+    __slots__ = ("id", "text", "signature", "band_keys", "size", "features")
+
+    def __init__(self, cluster_id, text, signature, band_keys):
+        self.id = cluster_id
+        self.text = text
+        self.signature = signature
+        self.band_keys = band_keys
+        self.size = 0
+        # (polarity, subjectivity, tags) of text, set by whoever enriches it first
+        self.features = None
+
+
+class NearDuplicateIndex:
+    """
+    Thread-safe, bounded index of the clusters of near-duplicate texts seen so far.
+
+    :param max_clusters: maximum number of clusters kept, the least recently seen ones are evicted first
+    :param threshold: minimum estimated Jaccard similarity of the shingles of two near-duplicate texts
+    :param num_permutations: length of the MinHash signatures
+    :param num_bands: number of LSH bands, must divide num_permutations. More bands find less similar candidates.
+    """
+    def __init__(self, max_clusters=MAX_CLUSTERS, threshold=THRESHOLD, num_permutations=NUM_PERMUTATIONS,
+                 num_bands=NUM_BANDS):
+        if num_permutations % num_bands:
+            raise ValueError("num_bands must divide num_permutations")
+        self.max_clusters = max_clusters
+        self.threshold = threshold
+        self.num_bands = num_bands
+        self.rows = num_permutations // num_bands
+        random = np.random.RandomState(SEED)
+        self._a = random.randint(1, PRIME, size=num_permutations).astype(np.uint64)
+        self._b = random.randint(0, PRIME, size=num_permutations).astype(np.uint64)
+        self._clusters = collections.OrderedDict()
+        # band key -> id of a cluster with that band
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.tweets = 0
+        self.evictions = 0
+
+    def signature(self, text):
+        """
+        :param text: string, cleaned tweet text
+        :return: array of num_permutations uint64, the MinHash signature of text
+        """
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles(text)), dtype=np.uint64)
+        hashes %= np.uint64(PRIME)
+        return ((np.outer(self._a, hashes) + self._b[:, None]) % np.uint64(PRIME)).min(axis=1)
+
+    def band_keys(self, signature):
+        """
+        :return: list of hashable keys, one for each band of signature
+        """
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+                for band in range(self.num_bands)]
+
+    def assign(self, text, tweet_id):
+        """
+        Add a tweet to the cluster of its near-duplicates, or to a new cluster of its own.
+
+        :param text: string, cleaned tweet text
+        :param tweet_id: int, id of the tweet, which becomes the id of a new cluster
+        :return: tuple (Cluster, size of the cluster with this tweet)
+        """
+        signature = self.signature(text)
+        band_keys = self.band_keys(signature)
+        with self._lock:
+            self.tweets += 1
+            best = None
+            best_similarity = self.threshold
+            for key in band_keys:
+                cluster_id = self._buckets.get(key)
+                if cluster_id is None or (best is not None and best.id == cluster_id):
+                    continue
+                candidate = self._clusters[cluster_id]
+                similarity = np.count_nonzero(candidate.signature == signature) / len(signature)
+                if similarity >= best_similarity:
+                    best, best_similarity = candidate, similarity
+
+            if best is None:
+                best = Cluster(tweet_id, text, signature, band_keys)
+                self._clusters[best.id] = best
+                for key in band_keys:
+                    self._buckets.setdefault(key, best.id)
+                if len(self._clusters) > self.max_clusters:
+                    self._evict()
+            else:
+                self._clusters.move_to_end(best.id)
+            best.size += 1
+            return best, best.size
+
+    def _evict(self):
+        """
+        Drop the least recently seen cluster. Call with the lock held.
+        """
+        _, cluster = self._clusters.popitem(last=False)
+        for key in cluster.band_keys:
+            if self._buckets.get(key) == cluster.id:
+                del self._buckets[key]
+        self.evictions += 1
+
+    def report(self):
+        """
+        :return: string, one line summary of the clusters found
+        """
+        with self._lock:
+            return ("near-duplicates: %d tweets, %d clusters kept, %d evicted"
+                    % (self.tweets, len(self._clusters), self.evictions))
+
+
+def final_cluster_sizes(data_entries):
+    """
+    :param data_entries: iterable of data entries, written with a NearDuplicateIndex
+    :return: dictionary of cluster id to the number of tweets in the cluster
+    """
+    sizes = {}
+    for entry in data_entries:
+        if "cluster_id" in entry:
+            sizes[entry["cluster_id"]] = max(sizes.get(entry["cluster_id"], 0), entry["cluster_size"])
+    return sizes
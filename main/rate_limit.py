@@ -0,0 +1,96 @@
+"""
+rate_limit.py
+
+A token bucket shared by everything that draws on the same Twitter app quota.
+
+The standard search endpoint allows 450 requests per 15 minute window with application-only auth. Instead of each
+crawl sleeping on its own when it runs out (and all of them waking up at the same time and fighting over the next
+window), every request takes a token from one bucket that refills at the rate the API allows.
+"""
+import threading
+import time
+
+SEARCH_REQUESTS_PER_WINDOW = 450
+TRENDS_REQUESTS_PER_WINDOW = 75
+RATE_LIMIT_WINDOW = 15 * 60
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. Holds at most capacity tokens, and refills continuously at capacity / window tokens
+    per second. Waiters are served in the order they arrived.
+
+    :param capacity: maximum number of tokens, ie. the number of requests allowed per window
+    :param window: float, length of the rate limit window in seconds
+    """
+    def __init__(self, capacity=SEARCH_REQUESTS_PER_WINDOW, window=RATE_LIMIT_WINDOW):
+        self.capacity = capacity
+        self.rate = capacity / float(window)
+        self.tokens = float(capacity)
+        self.paused_until = 0.0
+        self.waited = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        # waiters take a ticket, and are let through one at a time, in the order of their tickets
+        self._line = threading.Condition()
+        self._next_ticket = 0
+        self._now_serving = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """
+        Take one token, blocking until one is available.
+        :return: float, seconds spent waiting
+        """
+        waited = 0.0
+        with self._line:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            while self._now_serving != ticket:
+                self._line.wait()
+        # only the waiter at the head of the line sleeps on the bucket, the others queue up behind it
+        try:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if now >= self.paused_until and self.tokens >= 1:
+                        self.tokens -= 1
+                        self.waited += waited
+                        return waited
+                    delay = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+                time.sleep(delay)
+                waited += delay
+        finally:
+            with self._line:
+                self._now_serving += 1
+                self._line.notify_all()
+
+    def observe(self, remaining, reset):
+        """
+        Correct the bucket with the rate limit headers of a response, in case some other client is using the same
+        quota. Never adds tokens.
+
+        :param remaining: int, value of x-rate-limit-remaining
+        :param reset: int, value of x-rate-limit-reset, epoch seconds when the window resets
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, float(remaining))
+            if remaining <= 0:
+                self.paused_until = time.monotonic() + max(reset - time.time(), 0)
+
+    def observe_response(self, response):
+        """
+        Call observe() with the headers of a requests response, if it has rate limit headers.
+        :param response: requests.Response, or None
+        """
+        if response is None:
+            return
+        remaining = response.headers.get("x-rate-limit-remaining")
+        reset = response.headers.get("x-rate-limit-reset")
+        if remaining is not None and reset is not None:
+            self.observe(int(remaining), int(reset))
@@ -0,0 +1,37 @@
+"""
+records.py
+
+The shape of a data entry (see tweet_to_data_entry in twitter_util.py): its fields, in order, and the format of its
+created_at. Readers of output files (columnar.py, blocks.py, catalog.py, ...) import these from here rather than from
+twitter_util.py, which imports tweepy and TextBlob.
+"""
+import calendar
+import datetime
+
+# fields copied from the tweet, in the order of the fields in a data entry, see METADATA_EXTRACTORS in twitter_util.py
+METADATA_FIELDS = ("raw", "cleaned", "created_at", "author_num_followers", "author_num_favourites", "hashtags",
+                   "mentions", "retweets", "source")
+# fields computed by TextBlob from the cleaned text. Sentiment and PoS tagging are separate TextBlob stages.
+SENTIMENT_FIELDS = ("polarity", "subjectivity")
+TAG_FIELDS = ("tags",)
+DATA_FIELDS = METADATA_FIELDS + SENTIMENT_FIELDS + TAG_FIELDS
+# fields added to every data entry when near-duplicates are detected, see set_near_duplicate_index in twitter_util.py
+CLUSTER_FIELDS = ("cluster_id", "cluster_size")
+
+CREATED_AT_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def parse_created_at(created_at):
+    """
+    :param created_at: string, date of a data entry, eg. "2018-06-06 20:07:10" (UTC)
+    :return: int, seconds since the epoch
+    """
+    return calendar.timegm(datetime.datetime.fromisoformat(created_at).utctimetuple())
+
+
+def format_created_at(timestamp):
+    """
+    :param timestamp: int, seconds since the epoch
+    :return: string, date as it appears in a data entry
+    """
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime(CREATED_AT_FORMAT)
@@ -0,0 +1,495 @@
+"""
+replay_server.py
+
+A local stand-in for the parts of the Twitter API that the crawl scripts use, so they can be measured and tested
+without hitting the real API (or its rate limits).
+
+The server speaks plain HTTP and serves:
+    /1.1/search/tweets.json      pages of tweets, newest first, with max_id / since_id paging
+    /1.1/trends/available.json   the list of locations that have trends
+    /1.1/trends/place.json       the trends for one location (woeid)
+
+The tweets either come from a recording (a file with one raw tweet JSON object per line, eg. the "_json" of tweepy
+Status objects), or are generated synthetically. Every response can be delayed by a fixed latency, and every endpoint
+has its own rate limit window, reported back in the same x-rate-limit-* headers that Twitter sends.
+
+tweepy always talks https to api.twitter.com, so ReplayAPI is a minimal client exposing the same methods as
+tweepy.API (search, trends_available, trends_place) that talks to this server instead. It parses responses into the
+same tweepy model objects, and waits on rate limits the same way tweepy.API(wait_on_rate_limit=True) does.
+
+Usage:
+    python replay_server.py --port 8080 --tweets 50000 --latency 0.2
+"""
+import argparse
+import datetime
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import requests
+import tweepy
+
+DEFAULT_COUNT = 15
+MAX_COUNT = 100
+SEARCH_PATH = "/1.1/search/tweets.json"
+TRENDS_AVAILABLE_PATH = "/1.1/trends/available.json"
+TRENDS_PLACE_PATH = "/1.1/trends/place.json"
+
+# requests per window, per endpoint, for application-only auth
+RATE_LIMITS = {
+    SEARCH_PATH: 450,
+    TRENDS_AVAILABLE_PATH: 75,
+    TRENDS_PLACE_PATH: 75
+}
+RATE_LIMIT_WINDOW = 15 * 60
+
+TWITTER_DATE_FORMAT = "%a %b %d %H:%M:%S +0000 %Y"
+
+WORDS = ["good", "bad", "great", "terrible", "coffee", "news", "today", "really", "not", "very", "happy", "sad",
+         "game", "vote", "morning", "love", "hate", "new", "old", "people", "time", "amazing", "awful", "the", "a",
+         "is", "was", "we", "they", "this", "that", "and", "but", "so", "just", "never", "always", "best", "worst"]
+HASHTAGS = ["news", "breaking", "coffee", "mondaymotivation", "tbt", "canada", "worldcup", "election", "food"]
+SOURCES = ["Twitter for iPhone", "Twitter for Android", "Twitter Web Client", "TweetDeck", "Hootsuite", "IFTTT"]
+COUNTRIES = ["CA", "US", "GB", "AU", "IE", "NZ", "IN", "FR", "DE", "JP"]
+
+
+####################
+# Synthetic Tweets #
+####################
+def synthetic_tweets(num_tweets, seed=0, start_id=1000000000000000000, start_time=None):
+    """
+    Generate raw tweet JSON objects, in the shape returned by search/tweets with tweet_mode=extended.
+    Tweets are returned newest first, with strictly decreasing ids, one second apart.
+
+    :param num_tweets: number of tweets to generate
+    :param seed: random seed, the same seed always produces the same tweets
+    :param start_id: id of the newest tweet
+    :param start_time: datetime of the newest tweet, defaults to now
+    :return: list of dictionaries
+    """
+    rng = random.Random(seed)
+    if start_time is None:
+        start_time = datetime.datetime.utcnow().replace(microsecond=0)
+
+    tweets = []
+    tweet_id = start_id
+    for i in range(num_tweets):
+        tweet_id -= rng.randint(1, 1000)
+        tweets.append(synthetic_tweet(rng, tweet_id, start_time - datetime.timedelta(seconds=i)))
+    return tweets
+
+
+def synthetic_tweet(rng, tweet_id, created_at):
+    """
+    Generate a single raw tweet JSON object.
+
+    :param rng: random.Random instance
+    :param tweet_id: id of the tweet
+    :param created_at: datetime the tweet was made
+    :return: dictionary
+    """
+    words = [rng.choice(WORDS) for _ in range(rng.randint(4, 25))]
+    hashtags = rng.sample(HASHTAGS, rng.randint(0, 3))
+    mentions = ["user%d" % rng.randint(0, 5000) for _ in range(rng.randint(0, 2))]
+
+    text = " ".join(["@" + m for m in mentions] + words + ["#" + h for h in hashtags])
+    if rng.random() < 0.3:
+        text += " https://t.co/%08x" % rng.getrandbits(32)
+    if rng.random() < 0.1:
+        text = text.replace(" and ", " &amp; ")
+
+    user_id = rng.randint(1, 10 ** 9)
+    source = rng.choice(SOURCES)
+    return {
+        "created_at": created_at.strftime(TWITTER_DATE_FORMAT),
+        "id": tweet_id,
+        "id_str": str(tweet_id),
+        "full_text": text,
+        "truncated": False,
+        "display_text_range": [0, len(text)],
+        "entities": {
+            "hashtags": [{"text": h, "indices": [0, 0]} for h in hashtags],
+            "symbols": [],
+            "user_mentions": [{"screen_name": m, "name": m, "id": 0, "id_str": "0", "indices": [0, 0]}
+                              for m in mentions],
+            "urls": []
+        },
+        "metadata": {"iso_language_code": "en", "result_type": "recent"},
+        "source": '<a href="http://twitter.com" rel="nofollow">%s</a>' % source,
+        "user": {
+            "id": user_id,
+            "id_str": str(user_id),
+            "name": "user %d" % user_id,
+            "screen_name": "user%d" % user_id,
+            "followers_count": rng.randint(0, 100000),
+            "friends_count": rng.randint(0, 5000),
+            "favourites_count": rng.randint(0, 50000),
+            "statuses_count": rng.randint(1, 100000),
+            "created_at": created_at.strftime(TWITTER_DATE_FORMAT),
+            "lang": "en"
+        },
+        "is_quote_status": False,
+        "retweet_count": rng.randint(0, 500),
+        "favorite_count": rng.randint(0, 1000),
+        "favorited": False,
+        "retweeted": False,
+        "lang": "en"
+    }
+
+
+def synthetic_locations(countries=COUNTRIES, towns_per_country=5):
+    """
+    Generate the response of trends/available: the worldwide location, one entry per country, and a few towns
+    under each country.
+
+    :param countries: list of country codes
+    :param towns_per_country: number of towns to generate under each country
+    :return: list of dictionaries
+    """
+    locations = [{"name": "Worldwide", "placeType": {"code": 19, "name": "Supername"}, "url": "", "parentid": 0,
+                  "country": "", "woeid": 1, "countryCode": None}]
+    for i, country in enumerate(countries):
+        country_woeid = 23424700 + i
+        locations.append({"name": country, "placeType": {"code": 12, "name": "Country"}, "url": "", "parentid": 1,
+                          "country": country, "woeid": country_woeid, "countryCode": country})
+        for j in range(towns_per_country):
+            locations.append({"name": "%s town %d" % (country, j), "placeType": {"code": 7, "name": "Town"},
+                              "url": "", "parentid": country_woeid, "country": country,
+                              "woeid": 1000000 + i * 1000 + j, "countryCode": country})
+    return locations
+
+
+def synthetic_trends(woeid, name, num_trends=50):
+    """
+    Generate the response of trends/place for one location.
+
+    :param woeid: woeid of the location
+    :param name: name of the location
+    :param num_trends: number of trends to generate
+    :return: list containing one dictionary
+    """
+    rng = random.Random(woeid)
+    now = datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
+    trends = []
+    for i in range(num_trends):
+        trend = "#" + rng.choice(HASHTAGS) + str(i) if rng.random() < 0.5 else " ".join(rng.sample(WORDS, 2))
+        trends.append({"name": trend, "url": "", "promoted_content": None, "query": trend,
+                       "tweet_volume": rng.randint(10000, 500000)})
+    return [{"trends": trends, "as_of": now, "created_at": now, "locations": [{"name": name, "woeid": woeid}]}]
+
+
+def load_recorded_tweets(path):
+    """
+    Load a recording of raw tweets, one JSON object per line, and sort it newest first.
+    :param path: string, path of the recording
+    :return: list of dictionaries
+    """
+    with open(path, "r") as f:
+        tweets = [json.loads(line) for line in f if line.strip()]
+    return sorted(tweets, key=lambda t: t["id"], reverse=True)
+
+
+##########
+# Server #
+##########
+class ReplayServer(ThreadingHTTPServer):
+    """
+    HTTP server replaying tweets and trends.
+
+    :param tweets: list of raw tweet dictionaries, newest first
+    :param locations: list of location dictionaries, as returned by trends/available
+    :param latency: float, seconds to wait before answering each request
+    :param rate_limits: dictionary of path to number of requests allowed per window, 0 for no limit
+    :param window: int, length of a rate limit window in seconds
+    """
+    daemon_threads = True
+
+    def __init__(self, tweets, locations=None, host="127.0.0.1", port=0, latency=0.0, rate_limits=None,
+                 window=RATE_LIMIT_WINDOW):
+        super().__init__((host, port), ReplayRequestHandler)
+        # (tweets, their ids), swapped as one tuple by publish, so search never pairs one list with the other's ids
+        self.corpus = (tweets, [t["id"] for t in tweets])
+        self.locations = locations if locations is not None else synthetic_locations()
+        self.latency = latency
+        self.rate_limits = dict(RATE_LIMITS, **(rate_limits or {}))
+        self.window = window
+        self.requests_served = 0
+        self._windows = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        """
+        :return: string, base url of the server, eg. http://127.0.0.1:8080
+        """
+        return "http://%s:%d" % self.server_address[:2]
+
+    def start(self):
+        """
+        Serve requests on a background thread.
+        :return: self
+        """
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop serving requests and close the socket.
+        """
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def take_request(self, path):
+        """
+        Charge one request against the rate limit window of path.
+
+        :param path: string, request path
+        :return: tuple (allowed, limit, remaining, reset), where reset is the epoch second the window ends.
+                 limit is 0 if path isn't rate limited.
+        """
+        limit = self.rate_limits.get(path, 0)
+        now = time.time()
+        with self._lock:
+            self.requests_served += 1
+            window_start, used = self._windows.get(path, (now, 0))
+            if now - window_start >= self.window:
+                window_start, used = now, 0
+            allowed = limit <= 0 or used < limit
+            if allowed:
+                used += 1
+            self._windows[path] = (window_start, used)
+        remaining = max(limit - used, 0)
+        return allowed, limit, remaining, int(window_start + self.window)
+
+    def publish(self, tweets):
+        """
+        Add new tweets to the corpus, as if they were just posted. Used to test polling forward with since_id.
+        :param tweets: list of raw tweet dictionaries, with ids greater than any already served
+        """
+        with self._lock:
+            merged = sorted(tweets + self.corpus[0], key=lambda t: t["id"], reverse=True)
+            self.corpus = (merged, [t["id"] for t in merged])
+
+    def search(self, params):
+        """
+        Answer a search/tweets request. Tweets are returned newest first; max_id is inclusive, since_id exclusive.
+
+        :param params: dictionary of query string parameters
+        :return: dictionary, the response body
+        """
+        count = min(int(params.get("count", DEFAULT_COUNT)), MAX_COUNT)
+        max_id = int(params["max_id"]) if "max_id" in params else None
+        since_id = int(params["since_id"]) if "since_id" in params else None
+        tweets, tweet_ids = self.corpus
+
+        # ids are sorted in decreasing order, so binary search for the first id <= max_id
+        start = 0
+        if max_id is not None:
+            lo, hi = 0, len(tweet_ids)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if tweet_ids[mid] > max_id:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            start = lo
+
+        statuses = []
+        for tweet in tweets[start:]:
+            if len(statuses) >= count or (since_id is not None and tweet["id"] <= since_id):
+                break
+            if "lang" in params and tweet.get("lang") != params["lang"]:
+                continue
+            statuses.append(tweet)
+
+        return {
+            "statuses": statuses,
+            "search_metadata": {
+                "count": count,
+                "query": params.get("q", ""),
+                "max_id": statuses[0]["id"] if statuses else 0,
+                "since_id": since_id or 0
+            }
+        }
+
+    def trends_place(self, params):
+        """
+        Answer a trends/place request.
+
+        :param params: dictionary of query string parameters
+        :return: list, the response body, or None if the woeid is unknown
+        """
+        woeid = int(params.get("id", 0))
+        for location in self.locations:
+            if location["woeid"] == woeid:
+                return synthetic_trends(woeid, location["name"])
+        return None
+
+
+class ReplayRequestHandler(BaseHTTPRequestHandler):
+    """
+    Request handler for ReplayServer.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+
+        allowed, limit, remaining, reset = self.server.take_request(url.path)
+        headers = {}
+        if limit > 0:
+            headers = {
+                "x-rate-limit-limit": str(limit),
+                "x-rate-limit-remaining": str(remaining),
+                "x-rate-limit-reset": str(reset)
+            }
+
+        if not allowed:
+            self.send_json(429, {"errors": [{"code": 88, "message": "Rate limit exceeded"}]}, headers)
+        elif url.path == SEARCH_PATH:
+            self.send_json(200, self.server.search(params), headers)
+        elif url.path == TRENDS_AVAILABLE_PATH:
+            self.send_json(200, self.server.locations, headers)
+        elif url.path == TRENDS_PLACE_PATH:
+            body = self.server.trends_place(params)
+            if body is None:
+                self.send_json(404, {"errors": [{"code": 34, "message": "Sorry, that page does not exist."}]},
+                               headers)
+            else:
+                self.send_json(200, body, headers)
+        else:
+            self.send_json(404, {"errors": [{"code": 34, "message": "Sorry, that page does not exist."}]}, headers)
+
+    def send_json(self, status, body, headers):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json;charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        # keep benchmark output readable
+        pass
+
+
+##########
+# Client #
+##########
+class ReplayAPI:
+    """
+    Minimal stand-in for tweepy.API that talks to a ReplayServer (or anything else serving the same paths).
+    Results are parsed into tweepy models, so callers can't tell the difference.
+
+    :param base_url: string, eg. http://127.0.0.1:8080
+    :param wait_on_rate_limit: if True, sleep until the window resets instead of failing on rate limits
+    """
+    def __init__(self, base_url, wait_on_rate_limit=True, timeout=60):
+        self.base_url = base_url.rstrip("/")
+        self.wait_on_rate_limit = wait_on_rate_limit
+        self.timeout = timeout
+        self.parser = tweepy.parsers.ModelParser()
+        self.session = requests.Session()
+        self.last_response = None
+        self._remaining = {}
+        self._reset = {}
+
+    def _get(self, path, params):
+        """
+        Issue a GET request, waiting on rate limits like tweepy does.
+
+        :param path: string, request path
+        :param params: dictionary of query string parameters
+        :return: decoded JSON body
+        """
+        params = dict((k, str(v)) for k, v in params.items() if v is not None)
+        while True:
+            if self.wait_on_rate_limit and self._remaining.get(path) == 0:
+                sleep_time = self._reset.get(path, 0) - time.time()
+                if sleep_time > 0:
+                    time.sleep(sleep_time)
+
+            try:
+                resp = self.session.get(self.base_url + path, params=params, timeout=self.timeout)
+            except requests.RequestException as e:
+                raise tweepy.TweepError("Failed to send request: %s" % e)
+            self.last_response = resp
+
+            if "x-rate-limit-remaining" in resp.headers:
+                self._remaining[path] = int(resp.headers["x-rate-limit-remaining"])
+                self._reset[path] = int(resp.headers["x-rate-limit-reset"])
+
+            if resp.status_code == 429 and self.wait_on_rate_limit:
+                continue
+            if resp.status_code != 200:
+                try:
+                    error_msg, api_code = self.parser.parse_error(resp.text)
+                except Exception:
+                    error_msg, api_code = "Twitter error response: status code = %s" % resp.status_code, None
+                if resp.status_code == 429:
+                    raise tweepy.RateLimitError(error_msg, resp)
+                raise tweepy.TweepError(error_msg, resp, api_code=api_code)
+            return resp.json()
+
+    def search(self, q, count=None, max_id=None, since_id=None, lang=None, tweet_mode=None, **kwargs):
+        """
+        Same as tweepy.API.search.
+        :return: tweepy SearchResults
+        """
+        params = dict(kwargs, q=q, count=count, max_id=max_id, since_id=since_id, lang=lang, tweet_mode=tweet_mode)
+        return tweepy.models.SearchResults.parse(self, self._get(SEARCH_PATH, params))
+
+    def trends_available(self):
+        """
+        Same as tweepy.API.trends_available.
+        :return: list of dictionaries
+        """
+        return self._get(TRENDS_AVAILABLE_PATH, {})
+
+    def trends_place(self, id, exclude=None):
+        """
+        Same as tweepy.API.trends_place.
+        :return: list containing one dictionary
+        """
+        return self._get(TRENDS_PLACE_PATH, {"id": id, "exclude": exclude})
+
+
+if __name__ == "__main__":
+    # command line parsing
+    parser = argparse.ArgumentParser(description="Serve recorded or synthetic tweets on a local Twitter API stand-in")
+    parser.add_argument("--host", help="Interface to listen on", default="127.0.0.1")
+    parser.add_argument("--port", help="Port to listen on", type=int, default=8080)
+    parser.add_argument("--recording", help="File of raw tweets, one JSON object per line")
+    parser.add_argument("--tweets", help="Number of synthetic tweets, if no recording", type=int, default=20000)
+    parser.add_argument("--seed", help="Random seed for synthetic tweets", type=int, default=0)
+    parser.add_argument("--latency", help="Seconds to delay every response", type=float, default=0.0)
+    parser.add_argument("--rate-limit", help="Search requests allowed per window, 0 for no limit", type=int,
+                        default=RATE_LIMITS[SEARCH_PATH])
+    parser.add_argument("--window", help="Rate limit window, in seconds", type=int, default=RATE_LIMIT_WINDOW)
+    args = parser.parse_args()
+
+    if args.recording:
+        replay_tweets = load_recorded_tweets(args.recording)
+    else:
+        replay_tweets = synthetic_tweets(args.tweets, seed=args.seed)
+
+    server = ReplayServer(replay_tweets, host=args.host, port=args.port, latency=args.latency,
+                          rate_limits={SEARCH_PATH: args.rate_limit}, window=args.window)
+    print("Serving %d tweets on %s" % (len(replay_tweets), server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,255 @@
+"""
+serializers.py
+
+The on-disk formats of crawl output (data entries) and trends output, behind one interface, so that writers can pick
+a faster one and readers don't have to know which one was picked.
+
+Formats:
+    - "json": one JSON object per line, written with the standard library. The default, and what every output file
+      written before this module was.
+    - "ujson": the same JSON lines, written with ujson, which is several times faster. The values read back are the
+      same, but the bytes aren't: ujson doesn't put spaces after separators, and writes small floats as 2.5e-5 where
+      json writes 2.5e-05. Every float reads back to the same number, and "/" isn't escaped (see SerializerTests).
+    - "msgpack": a header (MSGPACK_HEADER), then one msgpack object per entry, each prefixed with its length as a
+      4 byte little-endian integer. Smaller, and faster to read back.
+
+Readers detect the format from the start of the file: msgpack files start with MSGPACK_HEADER, which can't start a
+JSON line. JSON lines are read back with the standard library, whichever library wrote them.
+
+An entry cut off at the end of a file, by a crawl that died, is skipped with a warning, in every format.
+
+Usage:
+    serializer = get_serializer("msgpack")
+    with open(path, "wb") as f:
+        f.write(serializer.header)
+        for entry in data_entries:
+            f.write(serializer.dumps(entry))
+    for entry in read_entries(path):
+        ...
+"""
+import json
+import struct
+import sys
+
+FORMATS = ("json", "ujson", "msgpack")
+MSGPACK_HEADER = b"\x00tweets-msgpack\x01\n"
+LENGTH = struct.Struct("<I")
+
+
+class JsonSerializer:
+    """
+    JSON lines.
+
+    :param name: string, "json" or "ujson"
+    :param module: module with a dumps and a loads function, json or ujson
+    :param dumps_options: dictionary, keyword arguments of module.dumps
+    """
+    header = b""
+
+    def __init__(self, name="json", module=json, dumps_options=None):
+        self.name = name
+        self.module = module
+        self.dumps_options = dumps_options or {}
+
+    def dumps(self, entry):
+        """
+        :param entry: dictionary
+        :return: bytes, the line of the entry
+        """
+        return (self.module.dumps(entry, **self.dumps_options) + "\n").encode("utf-8")
+
+    def load_stream(self, f, path=""):
+        """
+        :param f: binary file object, after the header
+        :param path: string, name of the file, for warnings
+        :return: generator of dictionaries
+        """
+        loads = self.module.loads
+        for line in f:
+            try:
+                entry = loads(line)
+            except ValueError:
+                # only the last line can be incomplete, anything else is a corrupt file
+                if line.endswith(b"\n"):
+                    raise
+                print("Skipping the truncated last line of %s" % path, file=sys.stderr)
+                return
+            yield entry
+
+    def load_stream_offsets(self, f, path=""):
+        """
+        :param f: binary file object, after the header, or at the start of any line
+        :param path: string, name of the file, for warnings
+        :return: generator of (offset, size, dictionary) tuples, offset and size of each line in the file
+        """
+        loads = self.module.loads
+        offset = f.tell()
+        for line in f:
+            try:
+                entry = loads(line)
+            except ValueError:
+                if line.endswith(b"\n"):
+                    raise
+                print("Skipping the truncated last line of %s" % path, file=sys.stderr)
+                return
+            yield offset, len(line), entry
+            offset += len(line)
+
+    def load_entry(self, f, offset):
+        """
+        :param f: binary file object
+        :param offset: int, offset of an entry, from load_stream_offsets
+        :return: dictionary
+        """
+        f.seek(offset)
+        return self.module.loads(f.readline())
+
+    def load_bytes(self, data):
+        """
+        :param data: bytes of one entry, as written by dumps
+        :return: dictionary
+        """
+        return self.module.loads(data)
+
+
+class MsgpackSerializer:
+    """
+    Length-prefixed msgpack objects, after MSGPACK_HEADER.
+    """
+    name = "msgpack"
+    header = MSGPACK_HEADER
+
+    def __init__(self):
+        import msgpack
+        self.packb = msgpack.packb
+        self.unpackb = msgpack.unpackb
+
+    def dumps(self, entry):
+        """
+        :param entry: dictionary
+        :return: bytes, the length and msgpack of the entry
+        """
+        packed = self.packb(entry, use_bin_type=True)
+        return LENGTH.pack(len(packed)) + packed
+
+    def load_stream(self, f, path=""):
+        """
+        :param f: binary file object, after the header
+        :param path: string, name of the file, for warnings
+        :return: generator of dictionaries
+        """
+        while True:
+            prefix = f.read(LENGTH.size)
+            if not prefix:
+                return
+            if len(prefix) == LENGTH.size:
+                size = LENGTH.unpack(prefix)[0]
+                packed = f.read(size)
+                if len(packed) == size:
+                    yield self.unpackb(packed, raw=False)
+                    continue
+            print("Skipping the truncated last entry of %s" % path, file=sys.stderr)
+            return
+
+    def load_stream_offsets(self, f, path=""):
+        """
+        :param f: binary file object, after the header, or at the start of any entry
+        :param path: string, name of the file, for warnings
+        :return: generator of (offset, size, dictionary) tuples, offset and size of each entry (with its length) in
+                 the file
+        """
+        offset = f.tell()
+        while True:
+            prefix = f.read(LENGTH.size)
+            if not prefix:
+                return
+            if len(prefix) == LENGTH.size:
+                size = LENGTH.unpack(prefix)[0]
+                packed = f.read(size)
+                if len(packed) == size:
+                    yield offset, LENGTH.size + size, self.unpackb(packed, raw=False)
+                    offset += LENGTH.size + size
+                    continue
+            print("Skipping the truncated last entry of %s" % path, file=sys.stderr)
+            return
+
+    def load_entry(self, f, offset):
+        """
+        :param f: binary file object
+        :param offset: int, offset of an entry, from load_stream_offsets
+        :return: dictionary
+        """
+        f.seek(offset)
+        size = LENGTH.unpack(f.read(LENGTH.size))[0]
+        return self.unpackb(f.read(size), raw=False)
+
+    def load_bytes(self, data):
+        """
+        :param data: bytes of one entry, as written by dumps, with its length
+        :return: dictionary
+        """
+        return self.unpackb(data[LENGTH.size:], raw=False)
+
+
+def get_serializer(name="json"):
+    """
+    :param name: string, one of FORMATS
+    :return: serializer, with a header, dumps(entry), load_stream(f), load_stream_offsets(f), load_entry(f, offset)
+             and load_bytes(data)
+    """
+    if name == "json":
+        return JsonSerializer()
+    try:
+        if name == "ujson":
+            import ujson
+            # ujson escapes "/" as "\/" by default, json doesn't
+            return JsonSerializer("ujson", ujson, {"escape_forward_slashes": False})
+        if name == "msgpack":
+            return MsgpackSerializer()
+    except ImportError as e:
+        raise ValueError("The %s format needs a package that isn't installed: %s" % (name, e))
+    raise ValueError("Unknown format %r, expected one of %s" % (name, ", ".join(FORMATS)))
+
+
+def detect_format(f):
+    """
+    Read the header of a file, if it has one.
+    :param f: binary file object, at the start of the file
+    :return: serializer to read the rest of the file with
+    """
+    start = f.read(len(MSGPACK_HEADER))
+    if start == MSGPACK_HEADER:
+        return get_serializer("msgpack")
+    f.seek(0)
+    return get_serializer("json")
+
+
+def detect_path_format(path, default="json"):
+    """
+    :param path: string, path of an output file
+    :param default: string, format to use if the file is empty or doesn't exist. A JSON lines file is written with
+                    the JSON library of default, if it is a JSON format.
+    :return: serializer to continue writing the file with
+    """
+    try:
+        with open(path, "rb") as f:
+            if f.read(1):
+                f.seek(0)
+                serializer = detect_format(f)
+                if serializer.name == "json" and default == "ujson":
+                    return get_serializer(default)
+                return serializer
+    except FileNotFoundError:
+        pass
+    return get_serializer(default)
+
+
+def read_entries(path):
+    """
+    Stream the entries of an output file in any format, one at a time.
+    :param path: string, path of the file
+    :return: generator of dictionaries
+    """
+    with open(path, "rb") as f:
+        for entry in detect_format(f).load_stream(f, path):
+            yield entry
@@ -0,0 +1,74 @@
+"""
+stats.py
+
+Light-weight timing and throughput bookkeeping for the crawl scripts.
+
+A StageStats object keeps, for every named stage (eg. "fetch", "enrich", "write"), the total wall time spent
+in that stage and the number of items that went through it.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StageStats:
+    """
+    Accumulate time spent and items processed per named stage. Safe to share between threads.
+    """
+    def __init__(self):
+        self.seconds = {}
+        self.items = {}
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def time(self, stage, num_items=0):
+        """
+        Context manager, time the body of the with block and charge it to stage.
+        :param stage: string, name of the stage
+        :param num_items: number of items processed by the body
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, num_items)
+
+    def add(self, stage, seconds, num_items=0):
+        """
+        Charge seconds and num_items to stage.
+        :param stage: string, name of the stage
+        :param seconds: float, seconds spent
+        :param num_items: number of items processed
+        """
+        with self._lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+            self.items[stage] = self.items.get(stage, 0) + num_items
+
+    def count(self, stage, num_items=1):
+        """
+        Record num_items for stage without charging any time.
+        :param stage: string, name of the stage
+        :param num_items: number of items processed
+        """
+        self.add(stage, 0.0, num_items)
+
+    def elapsed(self):
+        """
+        :return: float, seconds since this object was created
+        """
+        return time.perf_counter() - self.started
+
+    def report(self):
+        """
+        Return a human readable summary, one line per stage.
+        :return: list of strings
+        """
+        lines = []
+        with self._lock:
+            for stage in self.seconds:
+                seconds = self.seconds[stage]
+                num_items = self.items[stage]
+                rate = num_items / seconds if seconds > 0 else 0.0
+                lines.append("%-10s %10.3fs %10d items %12.1f items/s" % (stage, seconds, num_items, rate))
+        return lines
@@ -0,0 +1,1330 @@
+"""
+tests.py
+
+Tests of the scripts in this directory. They import each other by name, so run the tests from here:
+    python -m unittest tests
+
+Crawls run against a local replay server (see replay_server.py), and only extract the fields that don't need TextBlob.
+"""
+import collections
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock
+
+import numpy as np
+import tweepy
+from textblob import TextBlob
+
+import aggregators
+import archive
+import benchmark_sentiment
+import blocks
+import catalog
+import columnar
+import corpus_reader
+import inverted_index
+import near_duplicates
+import records
+import replay_server
+import twitter_follow
+import twitter_search
+import twitter_trends
+import twitter_util
+from checkpoint import Checkpoint, archive_path, checkpoint_path, find_checkpoint, load_checkpoint
+from enrich_cache import EnrichmentCache
+from lexicon_sentiment import get_scorer
+from serializers import FORMATS, detect_path_format, get_serializer, read_entries
+from tweet_filter import TweetFilter
+
+
+def quiet():
+    """
+    :return: context manager that swallows the progress the crawlers print
+    """
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def available_formats():
+    """
+    :return: list of the serializer formats whose packages are installed
+    """
+    formats = []
+    for name in FORMATS:
+        try:
+            get_serializer(name)
+            formats.append(name)
+        except ValueError:
+            pass
+    return formats
+
+
+def frozen(entries):
+    """
+    :return: the entries with their lists as tuples, the way columnar.py gives them back
+    """
+    def freeze(value):
+        return tuple(map(freeze, value)) if isinstance(value, list) else value
+    return [dict((name, freeze(value)) for name, value in entry.items()) for entry in entries]
+
+
+class ReplayTestCase(unittest.TestCase):
+    """
+    Serves synthetic tweets from a replay server, and gives every test a temporary directory to write to.
+    """
+    NUM_TWEETS = 650
+    FIELDS = tuple(twitter_util.METADATA_EXTRACTORS)
+
+    def setUp(self):
+        self.server = replay_server.ReplayServer(replay_server.synthetic_tweets(self.NUM_TWEETS),
+                                                 rate_limits={replay_server.SEARCH_PATH: 0}).start()
+        self.addCleanup(self.server.stop)
+        self.api = replay_server.ReplayAPI(self.server.url)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def crawl(self, checkpoint, max_tweets=twitter_search.MAX_TWEETS, serializer=None):
+        """
+        Crawl from checkpoint into its output file.
+        :return: number of tweets downloaded
+        """
+        serializer = serializer or twitter_search.get_serializer()
+        with twitter_search.PageWriter.open(checkpoint, serializer) as writer, quiet():
+            return twitter_search.crawl(self.api, "x", writer, max_tweets, fields=self.FIELDS)
+
+    def write_entries(self, name, entries, serializer=None):
+        """
+        Write data entries to a new file in the temporary directory.
+        :return: string, path of the file
+        """
+        serializer = serializer or get_serializer()
+        with open(self.path(name), "wb") as f:
+            f.write(serializer.header)
+            for entry in entries:
+                f.write(serializer.dumps(entry))
+        return self.path(name)
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+
+class CheckpointTests(ReplayTestCase):
+    def test_resume_after_kill(self):
+        """
+        A crawl killed part way through a page resumes from its checkpoint, and its output is the same as a crawl
+        that was never interrupted: the cut off line is dropped, and no tweet is written twice.
+        """
+        self.crawl(Checkpoint("x", "x", self.path("full")))
+
+        checkpoint = Checkpoint("x", "x", self.path("killed"))
+        self.crawl(checkpoint, max_tweets=300)
+        # reaching max_tweets finishes the crawl, make it look like it died instead
+        checkpoint.finished = False
+        checkpoint.save()
+        with open(self.path("killed"), "ab") as f:
+            f.write(b'{"cleaned": "cut off')
+
+        resumed = find_checkpoint(self.directory, "x")
+        self.assertEqual((resumed.output_filepath, resumed.tweet_count), (self.path("killed"), 300))
+        self.crawl(resumed)
+        self.assertEqual(self.read(self.path("killed")), self.read(self.path("full")))
+        self.assertEqual(resumed.tweet_count, self.NUM_TWEETS)
+        self.assertTrue(resumed.finished)
+
+    def test_header_only_on_empty_file(self):
+        serializer = twitter_search.get_serializer("msgpack")
+        checkpoint = Checkpoint("x", "x", self.path("packed"))
+        self.crawl(checkpoint, max_tweets=300, serializer=serializer)
+        self.crawl(checkpoint, serializer=serializer)
+
+        data = self.read(self.path("packed"))
+        self.assertTrue(data.startswith(serializer.header))
+        self.assertEqual(data.count(serializer.header), 1)
+        self.assertEqual(len(list(read_entries(self.path("packed")))), self.NUM_TWEETS)
+
+    def test_shorter_than_checkpoint(self):
+        checkpoint = Checkpoint("x", "x", self.path("short"))
+        self.crawl(checkpoint, max_tweets=100)
+        os.truncate(self.path("short"), checkpoint.offset - 1)
+        with self.assertRaises(ValueError):
+            checkpoint.open_output()
+
+    def test_find_newest_unfinished(self):
+        for age, name, finished in [(30, "old", False), (20, "new", False), (10, "done", True), (0, "other", False)]:
+            Checkpoint("other" if name == "other" else "x", "x", self.path(name), finished=finished).save()
+            mtime = time.time() - age
+            os.utime(checkpoint_path(self.path(name)), (mtime, mtime))
+
+        self.assertEqual(find_checkpoint(self.directory, "x").output_filepath, self.path("new"))
+        self.assertEqual(find_checkpoint(self.directory, "x", include_finished=True).output_filepath,
+                         self.path("done"))
+        self.assertIsNone(find_checkpoint(self.directory, "y"))
+
+    def test_archive_truncated_to_checkpoint(self):
+        checkpoint = Checkpoint("x", "x", self.path("archived"))
+        serializer = twitter_search.get_serializer()
+        with twitter_search.PageWriter.open(checkpoint, serializer, keep_archive=True) as writer, quiet():
+            twitter_search.crawl(self.api, "x", writer, 200, fields=self.FIELDS)
+        archive_offset = checkpoint.archive_offset
+        with open(archive_path(self.path("archived")), "ab") as f:
+            f.write(b"partial page")
+
+        with checkpoint.open_archive() as f:
+            self.assertEqual(f.tell(), archive_offset)
+
+
+class FlakyAPI:
+    """
+    Fails the search requests whose numbers (counting from 1) are in failures, and passes the others on to api.
+    """
+    def __init__(self, api, failures):
+        self.api = api
+        self.failures = set(failures)
+        self.requests = 0
+
+    def search(self, **params):
+        self.requests += 1
+        if self.requests in self.failures:
+            raise tweepy.TweepError("injected failure")
+        return self.api.search(**params)
+
+
+class FollowTests(ReplayTestCase):
+    NUM_TWEETS = 250
+    FEATURES = (0.7, 0.6, [("good", "JJ"), ("coffee", "NN")])
+
+    def setUp(self):
+        super().setUp()
+        mock.patch.object(twitter_util, "compute_text_features", return_value=self.FEATURES).start()
+        self.addCleanup(mock.patch.stopall)
+        self.checkpoint = Checkpoint("x", "x", self.path("followed"))
+        with twitter_search.PageWriter.open(self.checkpoint, twitter_search.get_serializer()) as writer, quiet():
+            twitter_search.crawl(self.api, "x", writer)
+
+    def follow(self, api, max_polls, checkpoint=None, keep_archive=False, keep_columnar=False):
+        checkpoint = checkpoint or self.checkpoint
+        serializer = twitter_search.get_serializer()
+        with twitter_search.PageWriter.open(checkpoint, serializer, keep_archive, keep_columnar) as writer, quiet():
+            aggregates = twitter_follow.read_aggregates(checkpoint.output_filepath)
+            follower = twitter_follow.Follower(api, writer, aggregates, flush_interval=0)
+            follower.follow(interval=0, max_polls=max_polls)
+        return follower
+
+    def test_failure_part_way_through_a_gap(self):
+        """
+        A poll that fails on the second page of a three page gap keeps the first page, and the next poll continues
+        with the second one: no tweet is in the output file or the aggregates twice.
+        """
+        new_tweets = replay_server.synthetic_tweets(250, seed=5, start_id=2 * 10 ** 18)
+        self.server.publish(new_tweets)
+        self.follow(FlakyAPI(self.api, failures=[2]), max_polls=1)
+        self.assertEqual(self.checkpoint.tweet_count, 350)
+        self.assertEqual(self.checkpoint.since_id, self.server.corpus[0][250]["id"])
+        self.assertEqual(self.checkpoint.gap_max_id, new_tweets[99]["id"])
+        self.assertEqual(load_checkpoint(self.checkpoint.path).to_dict(), self.checkpoint.to_dict())
+
+        follower = self.follow(FlakyAPI(self.api, failures=[]), max_polls=1)
+        entries = list(read_entries(self.checkpoint.output_filepath))
+        self.assertEqual(len(entries), 500)
+        self.assertEqual(self.checkpoint.tweet_count, 500)
+        self.assertEqual(self.checkpoint.since_id, new_tweets[0]["id"])
+        self.assertIsNone(self.checkpoint.gap_max_id)
+        self.assertEqual(follower.aggregates.to_dict(),
+                         twitter_follow.read_aggregates(self.checkpoint.output_filepath).to_dict())
+        self.assertEqual(sum(follower.aggregates.sentiment_counts.result().values()), 500)
+
+    def test_nothing_new(self):
+        follower = self.follow(self.api, max_polls=2)
+        self.assertEqual(follower.aggregates.num_entries, self.NUM_TWEETS)
+        self.assertEqual(len(list(read_entries(self.checkpoint.output_filepath))), self.NUM_TWEETS)
+
+    def test_same_filter_and_files_as_crawl(self):
+        """
+        New tweets go through the filter of the crawl they continue, and are written to its archive and columnar
+        file too.
+        """
+        tweet_filter = twitter_search.TweetFilter(min_retweets=250)
+        checkpoint = twitter_search.new_checkpoint("y", self.path("filtered"), tweet_filter=tweet_filter)
+        with twitter_search.PageWriter.open(checkpoint, twitter_search.get_serializer(), keep_archive=True,
+                                            keep_columnar=True) as writer, quiet():
+            twitter_search.crawl(self.api, checkpoint.query, writer, tweet_filter=tweet_filter)
+        crawled = len(list(read_entries(checkpoint.output_filepath)))
+
+        new_tweets = replay_server.synthetic_tweets(250, seed=5, start_id=2 * 10 ** 18)
+        self.server.publish(new_tweets)
+        follower = self.follow(self.api, max_polls=1, checkpoint=load_checkpoint(checkpoint.path), keep_archive=True,
+                               keep_columnar=True)
+
+        entries = list(read_entries(checkpoint.output_filepath))
+        kept = [tweet for tweet in new_tweets if tweet["retweet_count"] >= 250]
+        self.assertEqual(len(entries), crawled + len(kept))
+        self.assertEqual(follower.tweet_filter.options(), tweet_filter.options())
+        self.assertTrue(all(entry["retweets"] >= 250 for entry in entries))
+        columnar_entries = columnar.iter_entries(columnar.columnar_path(checkpoint.output_filepath))
+        self.assertEqual(frozen(entries), list(columnar_entries))
+        raw_ids = [raw["id"] for raw in archive.iter_archive(archive_path(checkpoint.output_filepath))]
+        self.assertEqual(raw_ids[crawled:], [tweet["id"] for tweet in kept])
+
+
+class CleanTweetTests(unittest.TestCase):
+    # pieces that exercise every cleaning step, and the ways the steps interact
+    FRAGMENTS = ["RT", "RT @user: ", ":", " ", "  ", "\t", "\n", "\r\n", "\xa0", "\u2003", "#", "##", "@", "@@",
+                 "http", "https://t.co/abc", "ht", "tp", "://", "&amp;", "&#35;", "&#64;", "&#10;", "&lt;", "&",
+                 "&amp", "&#x0a;", "user_1", "Tim", "HORTONS", "caf\u00e9", "\u0130", "\u00df", "\u65e5\u672c",
+                 "\U0001f600", "_", "-", ".", "!"]
+    EDGE_CASES = ["", "RT", "RT no colon", "RT @a:", "  padded  ", "http", "http#", "ht#tp://x.com y", "#http://x",
+                  "@\nname", "@name\nmore text", "@\n\n", "@ \nx", "a\nhttp://x\nb", "@ahttp://b c",
+                  "@ab\nhttp://x", "&#35;tag &#64;user&#10;http://x", "&amp;amp;", "RT @x: RT @y: hello"]
+
+    def assert_same_as_stepwise(self, strings):
+        for s in strings:
+            self.assertEqual(twitter_util.clean_tweet(s), twitter_util.clean_tweet_stepwise(s), repr(s))
+
+    def test_edge_cases(self):
+        self.assert_same_as_stepwise(self.EDGE_CASES)
+
+    def test_randomized_corpus(self):
+        """
+        clean_tweet gives byte-identical output to the step by step cleaner, on random mixes of the fragments.
+        """
+        rng = random.Random(1234)
+        corpus = ["".join(rng.choice(self.FRAGMENTS) for _ in range(rng.randint(0, 30))) for _ in range(20000)]
+        self.assert_same_as_stepwise(corpus)
+
+    def test_clean_tweets(self):
+        self.assertEqual(twitter_util.clean_tweets(iter(self.EDGE_CASES)),
+                         [twitter_util.clean_tweet(s) for s in self.EDGE_CASES])
+
+
+class RecordsTests(unittest.TestCase):
+    def test_fields_match_extractors(self):
+        self.assertEqual(tuple(twitter_util.METADATA_EXTRACTORS), records.METADATA_FIELDS)
+        self.assertEqual(twitter_util.DATA_FIELDS, records.DATA_FIELDS)
+
+    def test_created_at_round_trip(self):
+        for created_at in ("2018-06-06 20:07:10", "1970-01-01 00:00:00", "2038-01-19 03:14:08"):
+            self.assertEqual(records.format_created_at(records.parse_created_at(created_at)), created_at)
+        self.assertEqual(records.parse_created_at("2018-06-06"), records.parse_created_at("2018-06-06 00:00:00"))
+
+
+class LexiconSentimentTests(unittest.TestCase):
+    TEXTS = ["...good", ".good day", ".very !!", "not very good", "really not good!", "good :)", "good : )",
+             "x D great", "e.g. nice", "isn't good", "(!) sure", "GOOD :D", "\u201cgood\u201d", ""]
+
+    def assert_same_as_textblob(self, texts):
+        polarity, subjectivity = get_scorer().score(texts)
+        for i, text in enumerate(texts):
+            expected = TextBlob(text).sentiment
+            np.testing.assert_allclose((polarity[i], subjectivity[i]), expected, atol=benchmark_sentiment.TOLERANCE,
+                                       err_msg=repr(text))
+
+    def test_punctuation(self):
+        self.assert_same_as_textblob(self.TEXTS)
+
+    def test_punctuated_corpus(self):
+        """
+        The lexicon scores agree with TextBlob's on tweets with punctuation and emoticons scattered through them.
+        """
+        tweets = map(archive.raw_to_status, replay_server.synthetic_tweets(2000, seed=3))
+        texts = [twitter_util.clean_tweet(tweet.full_text) for tweet in tweets]
+        self.assert_same_as_textblob(benchmark_sentiment.punctuate(texts, seed=3))
+
+
+def fake_text_features(cleaned_text, sentiment=True, tags=True, backend="textblob"):
+    """
+    Stand-in for twitter_util.compute_text_features, different for every text, without TextBlob's corpora.
+    """
+    if not sentiment:
+        return None, None, [(word, "NN") for word in cleaned_text.split()] if tags else None
+    polarity, subjectivity = len(cleaned_text) % 7 / 10.0, len(cleaned_text.split()) % 5 / 10.0
+    return polarity, subjectivity, [(word, "NN") for word in cleaned_text.split()] if tags else None
+
+
+class BatchEnrichmentTests(unittest.TestCase):
+    """
+    The worker processes are forked from the test, so they see the patched compute_text_features too.
+    """
+    def setUp(self):
+        mock.patch.object(twitter_util, "compute_text_features", fake_text_features).start()
+        self.addCleanup(mock.patch.stopall)
+        self.tweets = [tweepy.models.Status.parse(None, tweet) for tweet in replay_server.synthetic_tweets(120)]
+        self.expected = twitter_util.search_results_to_data_entries(self.tweets)
+        self.addCleanup(twitter_util.set_enrichment_cache, None)
+
+    def test_same_as_one_at_a_time(self):
+        entries = list(twitter_util.tweets_to_data_entries(self.tweets, num_workers=2, chunk_size=25))
+        self.assertEqual(entries, self.expected)
+
+    def test_same_with_cache(self):
+        """
+        The first run fills the cache, the second one is served from it, and both give the same entries as
+        search_results_to_data_entries.
+        """
+        cache = EnrichmentCache()
+        twitter_util.set_enrichment_cache(cache)
+        for _ in range(2):
+            entries = list(twitter_util.tweets_to_data_entries(self.tweets, num_workers=2, chunk_size=25))
+            self.assertEqual(entries, self.expected)
+        self.assertGreater(cache.stats()["hits"], 0)
+
+
+class NearDuplicateTests(unittest.TestCase):
+    TEXT = "free coffee today at tim hortons, come grab one before they run out at noon"
+    NEAR_DUPLICATES = [TEXT, TEXT + "!!", TEXT + " \U0001F600", TEXT.replace(",", "  "), TEXT.replace("noon", "n00n")]
+    DIFFERENT = ["the leafs lost again last night", "free coffee at starbucks", "rain all weekend in toronto",
+                 "tim hortons raised the price of a double double"]
+
+    def test_near_duplicates_together(self):
+        index = near_duplicates.NearDuplicateIndex()
+        assigned = [index.assign(text, i) for i, text in enumerate(self.NEAR_DUPLICATES)]
+        self.assertEqual([cluster.id for cluster, _ in assigned], [0] * len(self.NEAR_DUPLICATES))
+        self.assertEqual([size for _, size in assigned], list(range(1, len(self.NEAR_DUPLICATES) + 1)))
+        self.assertEqual(assigned[-1][0].text, self.TEXT)
+
+    def test_different_texts_apart(self):
+        index = near_duplicates.NearDuplicateIndex()
+        texts = [self.TEXT] + self.DIFFERENT
+        assigned = [index.assign(text, i) for i, text in enumerate(texts)]
+        self.assertEqual([cluster.id for cluster, _ in assigned], list(range(len(texts))))
+        self.assertEqual([size for _, size in assigned], [1] * len(texts))
+
+    def test_eviction(self):
+        """
+        Only the most recently seen clusters are kept: a near-duplicate of an evicted cluster starts a new one.
+        """
+        index = near_duplicates.NearDuplicateIndex(max_clusters=2)
+        index.assign(self.TEXT, 1)
+        index.assign(self.DIFFERENT[0], 2)
+        index.assign(self.TEXT + "!", 3)
+        index.assign(self.DIFFERENT[1], 4)
+        self.assertEqual(index.evictions, 1)
+        # the first cluster was seen again after the second one, so the second was evicted
+        self.assertEqual(index.assign(self.TEXT, 5)[0].id, 1)
+        cluster, size = index.assign(self.DIFFERENT[0], 6)
+        self.assertEqual((cluster.id, size), (6, 1))
+        self.assertEqual(index.evictions, 2)
+
+    def test_final_cluster_sizes(self):
+        entries = [{"cluster_id": 1, "cluster_size": 1}, {"cluster_id": 2, "cluster_size": 1},
+                   {"cluster_id": 1, "cluster_size": 2}, {"cleaned": "no cluster"},
+                   {"cluster_id": 1, "cluster_size": 3}]
+        self.assertEqual(near_duplicates.final_cluster_sizes(entries), {1: 3, 2: 1})
+
+    def test_only_first_of_cluster_enriched(self):
+        raw_tweets = replay_server.synthetic_tweets(len(self.NEAR_DUPLICATES) + len(self.DIFFERENT))
+        tweets = [tweepy.models.Status.parse(None, dict(tweet, full_text=text))
+                  for tweet, text in zip(raw_tweets, self.NEAR_DUPLICATES + self.DIFFERENT)]
+        compute = mock.patch.object(twitter_util, "compute_text_features", side_effect=fake_text_features).start()
+        self.addCleanup(mock.patch.stopall)
+        twitter_util.set_near_duplicate_index(near_duplicates.NearDuplicateIndex())
+        self.addCleanup(twitter_util.set_near_duplicate_index, None)
+
+        entries = twitter_util.search_results_to_data_entries(tweets)
+        self.assertEqual([call[0][0] for call in compute.call_args_list], [self.TEXT] + self.DIFFERENT)
+        first = entries[0]
+        for entry in entries[:len(self.NEAR_DUPLICATES)]:
+            self.assertEqual(entry["cluster_id"], tweets[0].id)
+            self.assertEqual([entry[name] for name in records.SENTIMENT_FIELDS + records.TAG_FIELDS],
+                             [first[name] for name in records.SENTIMENT_FIELDS + records.TAG_FIELDS])
+        self.assertEqual([entry["cluster_size"] for entry in entries], list(range(1, 6)) + [1] * 4)
+        self.assertEqual(near_duplicates.final_cluster_sizes(entries)[tweets[0].id], len(self.NEAR_DUPLICATES))
+
+
+class TweetFilterTests(unittest.TestCase):
+    def make_tweet(self, tweet_id, text="good coffee", lang="en", retweets=0, source="Twitter for iPhone",
+                   hashtags=(), followers=100):
+        raw = dict(replay_server.synthetic_tweets(1)[0], id=tweet_id, full_text=text, lang=lang,
+                   retweet_count=retweets, source='<a href="http://twitter.com">%s</a>' % source)
+        raw["entities"] = dict(raw["entities"], hashtags=[{"text": tag, "indices": [0, 0]} for tag in hashtags])
+        raw["user"] = dict(raw["user"], followers_count=followers)
+        return tweepy.models.Status.parse(None, raw)
+
+    def test_apply(self):
+        tweet_filter = TweetFilter(min_retweets=5, sources=["Twitter for iPhone", "TweetDeck"], pattern=r"cof+ee",
+                                   hashtags=["#Coffee"], min_followers=10, max_followers=1000)
+        tweets = [self.make_tweet(1, retweets=5, hashtags=["COFFEE"]),
+                  self.make_tweet(2, retweets=5, hashtags=["tea"]),
+                  self.make_tweet(3, retweets=9, source="TweetDeck", hashtags=["coffee", "tea"], followers=1000),
+                  self.make_tweet(4, text="good tea", retweets=9, hashtags=["coffee"]),
+                  self.make_tweet(5, retweets=5, hashtags=["coffee"], followers=5000)]
+        self.assertEqual([tweet.id for tweet in tweet_filter.apply(tweets)], [1, 3])
+
+    def test_dropped_counted_by_first_filter(self):
+        tweet_filter = TweetFilter(min_retweets=5, min_followers=10)
+        tweets = [self.make_tweet(1, lang="fr", retweets=0, followers=0),
+                  self.make_tweet(2, retweets=0, followers=0),
+                  self.make_tweet(3, retweets=5, followers=0),
+                  self.make_tweet(4, retweets=5, followers=10)]
+        self.assertEqual([tweet.id for tweet in tweet_filter.apply(tweets)], [4])
+        self.assertEqual(tweet_filter.apply(tweets[:2]), [])
+        self.assertEqual(tweet_filter.dropped, {"lang": 2, "min_retweets": 2, "min_followers": 1})
+        self.assertEqual(tweet_filter.seen, 6)
+        self.assertEqual(tweet_filter.report()[0], "filters: 1 of 6 tweets kept")
+
+    def test_query_operators(self):
+        self.assertEqual(TweetFilter().query_operators(), "")
+        self.assertEqual(TweetFilter(sources=["TweetDeck"]).query_operators(), 'source:"TweetDeck"')
+        self.assertEqual(TweetFilter(min_retweets=3, sources=["TweetDeck", "Twitter for iPhone"]).query_operators(),
+                         'min_retweets:3 (source:"TweetDeck" OR source:"Twitter for iPhone")')
+        self.assertEqual(twitter_search.build_query("coffee", TweetFilter(min_retweets=3)),
+                         "coffee -filter:retweets min_retweets:3")
+
+    def test_pattern_without_extended_text(self):
+        """
+        Tweets fetched without tweet_mode="extended" have "text" instead of "full_text".
+        """
+        tweets = []
+        for tweet_id, text in [(1, "good coffee"), (2, "good tea")]:
+            raw = self.make_tweet(tweet_id)._json
+            del raw["full_text"]
+            tweets.append(tweepy.models.Status.parse(None, dict(raw, text=text)))
+        self.assertEqual(TweetFilter(pattern="coffee").apply(tweets), tweets[:1])
+
+
+class PipelinedCrawlTests(ReplayTestCase):
+    def crawl_pipelined(self, checkpoint, max_tweets=twitter_search.MAX_TWEETS, use_processes=False):
+        """
+        Same as crawl, with crawl_pipelined.
+        :return: number of tweets downloaded
+        """
+        with twitter_search.PageWriter.open(checkpoint, twitter_search.get_serializer()) as writer, quiet():
+            return twitter_search.crawl_pipelined(self.api, "x", writer, max_tweets, num_workers=2,
+                                                  use_processes=use_processes, max_pending=2, fields=self.FIELDS)
+
+    def assert_same_as_crawl(self, max_tweets, expected_count):
+        expected = Checkpoint("x", "x", self.path("crawl"))
+        self.assertEqual(self.crawl(expected, max_tweets), expected_count)
+        requests = self.server.requests_served
+
+        for use_processes in (False, True):
+            with self.subTest(use_processes=use_processes):
+                name = "processes" if use_processes else "threads"
+                checkpoint = Checkpoint("x", "x", self.path(name))
+                served = self.server.requests_served
+                self.assertEqual(self.crawl_pipelined(checkpoint, max_tweets, use_processes), expected_count)
+                self.assertEqual(self.read(self.path(name)), self.read(self.path("crawl")))
+                self.assertTrue(checkpoint.finished)
+                self.assertEqual((checkpoint.tweet_count, checkpoint.max_id), (expected.tweet_count, expected.max_id))
+                # no page is fetched past the end
+                self.assertEqual(self.server.requests_served - served, requests)
+
+    def test_until_empty_page(self):
+        self.assert_same_as_crawl(twitter_search.MAX_TWEETS, self.NUM_TWEETS)
+
+    def test_until_max_tweets(self):
+        self.assert_same_as_crawl(300, 300)
+
+
+class SentimentOnlyBlob:
+    """
+    Stand-in for TextBlob that can only score sentiment, for crawls that must never PoS tag.
+    """
+    Sentiment = collections.namedtuple("Sentiment", ["polarity", "subjectivity"])
+
+    def __init__(self, text):
+        self.sentiment = self.Sentiment(len(text) % 7 / 10.0, 0.5)
+
+    @property
+    def tags(self):
+        raise AssertionError("PoS tags computed for a crawl that didn't ask for them")
+
+
+class ProjectedCrawlTests(ReplayTestCase):
+    """
+    Crawls with --fields write only the fields asked for, and only run the TextBlob stages those fields need.
+    """
+    def crawl_fields(self, name, fields, pipelined=False, use_processes=False):
+        """
+        Crawl into a new checkpoint with only some fields.
+        :return: list of the data entries written
+        """
+        checkpoint = twitter_search.new_checkpoint("x", self.path(name), fields=fields)
+        with twitter_search.PageWriter.open(checkpoint, twitter_search.get_serializer()) as writer, quiet():
+            if pipelined:
+                twitter_search.crawl_pipelined(self.api, "x", writer, num_workers=2, use_processes=use_processes,
+                                               fields=fields)
+            else:
+                twitter_search.crawl(self.api, "x", writer, fields=fields)
+        self.assertEqual(checkpoint.fields, list(twitter_util.project_fields(fields)))
+        return list(read_entries(self.path(name)))
+
+    def assert_only_fields(self, entries, fields):
+        self.assertEqual(len(entries), self.NUM_TWEETS)
+        for entry in entries:
+            self.assertEqual(list(entry), list(fields))
+
+    def test_metadata_never_runs_textblob(self):
+        blob = mock.patch.object(twitter_util, "TextBlob", side_effect=AssertionError("TextBlob ran")).start()
+        self.addCleanup(mock.patch.stopall)
+        for pipelined in (False, True):
+            with self.subTest(pipelined=pipelined):
+                entries = self.crawl_fields("metadata-%s" % pipelined, ["created_at", "cleaned"], pipelined)
+                self.assert_only_fields(entries, ["cleaned", "created_at"])
+        self.assertFalse(blob.called)
+
+    def test_sentiment_never_tags(self):
+        """
+        Asking for polarity runs TextBlob's sentiment, and not its PoS tagging, in every way of crawling.
+        """
+        mock.patch.object(twitter_util, "TextBlob", SentimentOnlyBlob).start()
+        self.addCleanup(mock.patch.stopall)
+        for pipelined, use_processes in ((False, False), (True, False), (True, True)):
+            with self.subTest(pipelined=pipelined, use_processes=use_processes):
+                name = "sentiment-%s-%s" % (pipelined, use_processes)
+                entries = self.crawl_fields(name, ["polarity", "cleaned"], pipelined, use_processes)
+                self.assert_only_fields(entries, ["cleaned", "polarity"])
+                self.assertEqual([entry["polarity"] for entry in entries],
+                                 [len(entry["cleaned"]) % 7 / 10.0 for entry in entries])
+
+
+class ColumnarTests(ReplayTestCase):
+    def setUp(self):
+        super().setUp()
+        self.crawl(Checkpoint("x", "x", self.path("crawled")))
+        self.entries = list(read_entries(self.path("crawled")))
+
+    def test_round_trip(self):
+        """
+        Every field comes back as it was written, across row groups, including the fields computed by TextBlob.
+        """
+        rng = random.Random(7)
+        for entry in self.entries:
+            entry["polarity"] = rng.uniform(-1, 1)
+            entry["subjectivity"] = rng.random()
+            entry["tags"] = [[word, rng.choice(["NN", "JJ", "VB"])] for word in entry["cleaned"].split()[:5]]
+            entry["cluster_id"] = rng.randint(0, 10)
+            entry["cluster_size"] = rng.randint(1, 3)
+        path = columnar.convert_jsonl(self.write_entries("enriched", self.entries), row_group_size=100)
+
+        self.assertEqual(len(columnar.row_group_paths(path)), 7)
+        self.assertEqual(list(columnar.iter_entries(path)), frozen(self.entries))
+        columns = list(columnar.read_columns(path, ["hashtags", "retweets", "missing"]))
+        self.assertEqual(sum((group["retweets"] for group in columns), []), [e["retweets"] for e in self.entries])
+        self.assertNotIn("missing", columns[0])
+
+    def test_only_some_columns(self):
+        path = columnar.convert_jsonl(self.path("crawled"), row_group_size=100)
+        self.assertEqual(list(columnar.iter_entries(path, ["created_at", "source"])),
+                         [{"created_at": e["created_at"], "source": e["source"]} for e in self.entries])
+
+    def test_catch_up_after_kill(self):
+        """
+        A crawl that died after flushing row groups past its checkpoint drops them when it is resumed, and reads the
+        entries it hadn't flushed back from the output file.
+        """
+        path = columnar.columnar_path(self.path("resumed"))
+        writer = columnar.ColumnarWriter(path, row_group_size=100)
+        writer.write(self.entries)
+        # killed before close: 6 row groups on disk, but the output file only made it to 420 entries
+        self.write_entries("resumed", self.entries[:420])
+
+        writer = columnar.ColumnarWriter(path, row_group_size=100)
+        writer.catch_up(self.path("resumed"))
+        self.assertEqual((writer.num_rows, len(writer.pending)), (400, 20))
+        writer.write(self.entries[420:])
+        writer.close()
+        self.assertEqual(list(columnar.iter_entries(path)), frozen(self.entries))
+
+    def test_resumed_crawl(self):
+        checkpoint = Checkpoint("x", "x", self.path("resumed"))
+        serializer = twitter_search.get_serializer()
+        for max_tweets in (300, twitter_search.MAX_TWEETS):
+            with twitter_search.PageWriter.open(checkpoint, serializer, keep_columnar=True) as writer, quiet():
+                twitter_search.crawl(self.api, "x", writer, max_tweets, fields=self.FIELDS)
+            checkpoint.finished = False
+
+        path = columnar.columnar_path(self.path("resumed"))
+        self.assertEqual(list(columnar.iter_entries(path)), frozen(self.entries))
+
+
+class SerializerTests(ReplayTestCase):
+    def setUp(self):
+        super().setUp()
+        self.crawl(Checkpoint("x", "x", self.path("crawled")))
+        self.entries = list(read_entries(self.path("crawled")))
+
+    def test_round_trip(self):
+        entries = self.entries + [dict(self.entries[0], polarity=0.1 + 0.2, tags=[["x", "NN"]])]
+        for name in available_formats():
+            with self.subTest(name):
+                serializer = get_serializer(name)
+                path = self.write_entries(name, entries, serializer)
+                self.assertEqual(list(read_entries(path)), entries)
+                self.assertEqual(detect_path_format(path, name).name, name)
+
+    def test_ujson_same_as_json(self):
+        """
+        A data entry written with ujson reads back the same as with json: urls keep their "/", and floats, tiny ones
+        included, keep every digit.
+        """
+        try:
+            ujson_serializer = get_serializer("ujson")
+        except ValueError:
+            self.skipTest("ujson isn't installed")
+        entry = dict(self.entries[0], raw="see https://t.co/abc/def", polarity=2.182901286862382e-05,
+                     subjectivity=0.1 + 0.2)
+        line = ujson_serializer.dumps(entry)
+        self.assertIn(b"https://t.co/abc/def", line)
+        self.assertEqual(json.loads(line), entry)
+        self.assertEqual(json.loads(line), json.loads(get_serializer("json").dumps(entry)))
+        for entry in self.entries:
+            self.assertEqual(json.loads(ujson_serializer.dumps(entry)), entry)
+
+    def test_offsets(self):
+        """
+        The offsets of load_stream_offsets read the same entries back, with load_entry and with load_bytes.
+        """
+        for name in available_formats():
+            with self.subTest(name):
+                serializer = get_serializer(name)
+                data = self.read(self.write_entries(name, self.entries, serializer))
+                with open(self.path(name), "rb") as f:
+                    f.seek(len(serializer.header))
+                    offsets = list(serializer.load_stream_offsets(f))
+                    self.assertEqual([entry for _, _, entry in offsets], self.entries)
+                    for offset, size, entry in offsets[::50]:
+                        self.assertEqual(serializer.load_entry(f, offset), entry)
+                        self.assertEqual(serializer.load_bytes(data[offset:offset + size]), entry)
+
+    def test_truncated_last_entry(self):
+        for name in available_formats():
+            with self.subTest(name):
+                path = self.write_entries(name, self.entries, get_serializer(name))
+                os.truncate(path, os.path.getsize(path) - 3)
+                with contextlib.redirect_stderr(io.StringIO()) as stderr:
+                    self.assertEqual(list(read_entries(path)), self.entries[:-1])
+                self.assertIn("truncated", stderr.getvalue())
+
+    def test_resume_keeps_format(self):
+        """
+        A crawl resumed with a different --output-format carries on in the format its output file was started in.
+        """
+        for name in available_formats():
+            with self.subTest(name):
+                checkpoint = Checkpoint("x", "x", self.path("resumed-" + name))
+                self.crawl(checkpoint, max_tweets=300, serializer=get_serializer(name))
+                checkpoint.finished = False
+                self.crawl(checkpoint, serializer=detect_path_format(checkpoint.output_filepath, "json"))
+                self.assertEqual(list(read_entries(checkpoint.output_filepath)), self.entries)
+                self.assertEqual(detect_path_format(checkpoint.output_filepath).name,
+                                 "json" if name == "ujson" else name)
+
+
+class BlockTests(ReplayTestCase):
+    def setUp(self):
+        super().setUp()
+        self.crawl(Checkpoint("x", "x", self.path("crawled")))
+        self.entries = list(read_entries(self.path("crawled")))
+
+    def test_round_trip(self):
+        for name in available_formats():
+            with self.subTest(name):
+                path = blocks.convert(self.path("crawled"), self.path(name + ".blk"), block_size=100,
+                                      output_format=name)
+                with blocks.BlockReader(path) as reader, contextlib.redirect_stderr(io.StringIO()) as stderr:
+                    self.assertEqual((len(reader), len(reader.blocks)), (self.NUM_TWEETS, 7))
+                    self.assertEqual(list(reader.iter_entries()), self.entries)
+                    self.assertEqual(list(reader.iter_entries(num_workers=3)), self.entries)
+                    self.assertEqual(list(reader.map_blocks(len, num_workers=2)), [100] * 6 + [50])
+                self.assertEqual(stderr.getvalue(), "")
+
+    def test_random_access(self):
+        path = blocks.convert(self.path("crawled"), block_size=100)
+        with blocks.BlockReader(path) as reader:
+            self.assertEqual(reader.entry(0), self.entries[0])
+            self.assertEqual(reader.entry(449), self.entries[449])
+            self.assertEqual(reader.blocks_read, 2)
+            self.assertEqual(list(reader.entries(180, 420)), self.entries[180:420])
+            self.assertEqual(list(reader.entries(600, 1000)), self.entries[600:])
+            with self.assertRaises(IndexError):
+                reader.entry(self.NUM_TWEETS)
+
+    def test_date_range(self):
+        """
+        A date range gives the same entries as filtering the whole file, and skips the blocks outside of it.
+        """
+        path = blocks.convert(self.path("crawled"), block_size=100)
+        created_at = sorted(entry["created_at"] for entry in self.entries)
+        since, until = created_at[200], created_at[350]
+        with blocks.BlockReader(path) as reader:
+            self.assertEqual(list(reader.date_range(since, until)),
+                             [entry for entry in self.entries if since <= entry["created_at"] < until])
+            self.assertLess(reader.blocks_read, len(reader.blocks))
+
+    def test_date_range_without_created_at(self):
+        """
+        Entries written without a created_at are never in a date range, and the catalog still reads them all.
+        """
+        projected = [{"cleaned": entry["cleaned"], "hashtags": entry["hashtags"]} for entry in self.entries]
+        path = blocks.convert(self.write_entries("projected", projected), block_size=100)
+        with blocks.BlockReader(path) as reader:
+            self.assertEqual(list(reader.date_range("2018-06-05", "2018-06-06")), [])
+            self.assertEqual(list(reader.date_range()), [])
+
+        partitions = [catalog.describe(path, query="x")]
+        self.assertIsNone(partitions[0].first)
+        self.assertEqual(list(catalog.iter_entries(self.directory, partitions, "2018-06-05", "2018-06-06")),
+                         projected)
+
+    def test_resume_after_kill(self):
+        """
+        A writer that died before writing its index, part way through a block, leaves a readable file, which a new
+        writer continues after the last complete block.
+        """
+        path = self.path("killed.blk")
+        writer = blocks.BlockWriter(path, block_size=100)
+        writer.write(self.entries[:300])
+        writer.file.write(b"cut off block")
+        writer.file.close()
+
+        with contextlib.redirect_stderr(io.StringIO()) as stderr:
+            self.assertEqual(list(blocks.iter_entries(path)), self.entries[:300])
+        self.assertIn("rebuilt", stderr.getvalue())
+        with blocks.BlockWriter(path, block_size=100) as writer:
+            self.assertEqual(len(writer), 300)
+            writer.write(self.entries[300:])
+        self.assertEqual(list(blocks.iter_entries(path)), self.entries)
+
+        # a closed file is continued too, its index is rewritten
+        with blocks.BlockWriter(path, block_size=100) as writer:
+            writer.write(self.entries[:10])
+        with blocks.BlockReader(path) as reader:
+            self.assertEqual(list(reader.iter_entries()), self.entries + self.entries[:10])
+            self.assertEqual(reader.blocks[-1].num_entries, 10)
+
+
+class InvertedIndexTests(ReplayTestCase):
+    def setUp(self):
+        super().setUp()
+        self.checkpoint = Checkpoint("x", "x", self.path("crawled"))
+        self.crawl(self.checkpoint, max_tweets=300)
+        self.entries = list(read_entries(self.path("crawled")))
+
+    def queries(self):
+        """
+        :return: list of queries, on terms of the crawled entries and terms that match nothing
+        """
+        entry = next(entry for entry in self.entries if entry["hashtags"] and entry["mentions"])
+        word = entry["cleaned"].split()[-1]
+        return ["#" + entry["hashtags"][0], "@" + entry["mentions"][0], word, "#%s %s" % (entry["hashtags"][0], word),
+                "#%s OR @%s" % (entry["hashtags"][0], entry["mentions"][0]), "#%s nothing" % entry["hashtags"][0],
+                "nothing", "nothing OR " + word.upper()]
+
+    def scan(self, entries, query):
+        """
+        :return: list of the numbers of the entries that match the query, by looking at every one
+        """
+        alternatives = [[term for word in alternative.split() for term in inverted_index.query_terms(word)]
+                        for alternative in query.split(" OR ")]
+        return [number for number, entry in enumerate(entries)
+                if any(terms and set(terms) <= inverted_index.entry_terms(entry) for terms in alternatives)]
+
+    def assert_same_as_scan(self, index, entries):
+        for query in self.queries():
+            numbers = index.search(query)
+            self.assertEqual(numbers.tolist(), self.scan(entries, query), query)
+            self.assertEqual(list(index.entries(numbers)), [entries[number] for number in numbers])
+
+    def test_search(self):
+        with inverted_index.InvertedIndex(self.path("crawled"), segment_size=70, max_segments=100) as index:
+            self.assertEqual(index.update(), 300)
+            self.assertEqual(len(index.segments), 5)
+            self.assertTrue(any(len(index.search(query)) for query in self.queries()))
+            self.assert_same_as_scan(index, self.entries)
+
+    def test_update_after_resumed_crawl(self):
+        """
+        Updating the index of a crawl that was resumed only reads the new entries, and merges the segments once there
+        are too many, and the index gives the same results as one built from scratch.
+        """
+        with inverted_index.InvertedIndex(self.path("crawled"), segment_size=70, max_segments=6) as index:
+            index.update()
+            self.checkpoint.finished = False
+            self.crawl(self.checkpoint)
+            self.assertEqual(index.update(), self.NUM_TWEETS - 300)
+            self.assertEqual(len(index.segments), 1)
+            self.assertEqual(index.update(), 0)
+
+        entries = list(read_entries(self.path("crawled")))
+        with inverted_index.InvertedIndex(self.path("crawled")) as index:
+            self.assertEqual(len(index), self.NUM_TWEETS)
+            self.assert_same_as_scan(index, entries)
+
+    def test_rebuilt_when_rewritten(self):
+        with inverted_index.InvertedIndex(self.path("crawled")) as index:
+            index.update()
+        # a resumed crawl truncated the file back to its checkpoint, and wrote other entries
+        self.write_entries("crawled", self.entries[:100] + self.entries[200:] + self.entries[100:200])
+
+        with inverted_index.InvertedIndex(self.path("crawled")) as index, \
+                contextlib.redirect_stderr(io.StringIO()) as stderr:
+            self.assertEqual(index.update(), 300)
+            self.assertIn("rebuilding", stderr.getvalue())
+            self.assert_same_as_scan(index, list(read_entries(self.path("crawled"))))
+
+    def test_block_file(self):
+        for name in available_formats():
+            with self.subTest(name):
+                path = blocks.convert(self.path("crawled"), self.path(name + ".blk"), block_size=70,
+                                      output_format=name)
+                with inverted_index.InvertedIndex(path) as index:
+                    index.update()
+                    self.assert_same_as_scan(index, self.entries)
+
+    def test_block_file_appended(self):
+        path = self.path("appended.blk")
+        with blocks.BlockWriter(path, block_size=70) as writer:
+            writer.write(self.entries[:300])
+        with inverted_index.InvertedIndex(path) as index:
+            index.update()
+        with blocks.BlockWriter(path, block_size=70) as writer:
+            writer.write(self.entries[300:])
+
+        with inverted_index.InvertedIndex(path) as index, contextlib.redirect_stderr(io.StringIO()) as stderr:
+            self.assertFalse(index.is_stale())
+            self.assertEqual(index.update(), len(self.entries) - 300)
+            self.assertEqual(stderr.getvalue(), "")
+            self.assert_same_as_scan(index, self.entries)
+
+    def test_block_file_rewritten(self):
+        """
+        A block file converted again from other entries is indexed again, even with as many entries as before.
+        """
+        path = blocks.convert(self.path("crawled"), block_size=70)
+        with inverted_index.InvertedIndex(path) as index:
+            index.update()
+        reordered = self.entries[100:] + self.entries[:100]
+        blocks.convert(self.write_entries("crawled", reordered), block_size=70)
+
+        with inverted_index.InvertedIndex(path) as index, contextlib.redirect_stderr(io.StringIO()) as stderr:
+            self.assertTrue(index.is_stale())
+            self.assertEqual(index.update(), len(self.entries))
+            self.assertIn("rebuilding", stderr.getvalue())
+            self.assert_same_as_scan(index, reordered)
+
+    def test_msgpack(self):
+        self.write_entries("packed", self.entries, get_serializer("msgpack"))
+        with inverted_index.InvertedIndex(self.path("packed")) as index:
+            index.update()
+            self.assert_same_as_scan(index, self.entries)
+
+
+class CorpusReaderTests(ReplayTestCase):
+    def setUp(self):
+        super().setUp()
+        self.crawl(Checkpoint("x", "x", self.path("crawled")))
+        self.entries = list(read_entries(self.path("crawled")))
+
+    def test_round_trip(self):
+        for name in ("json", "msgpack"):
+            with self.subTest(name):
+                path = self.write_entries(name, self.entries, get_serializer(name))
+                with corpus_reader.CorpusReader(path) as reader:
+                    self.assertEqual((len(reader), reader.output_format), (self.NUM_TWEETS, name))
+                    self.assertEqual(list(reader.entries(0, len(reader))), self.entries)
+                    self.assertEqual(reader.entry(449), self.entries[449])
+                    self.assertEqual(get_serializer(name).load_bytes(bytes(reader.raw(3))), self.entries[3])
+                    self.assertEqual(list(reader.entries(600, 1000)), self.entries[600:])
+                    with self.assertRaises(IndexError):
+                        reader.entry(self.NUM_TWEETS)
+
+    def test_close_unmaps(self):
+        with corpus_reader.CorpusReader(self.path("crawled")) as reader:
+            buffer = reader.buffer
+            view = reader.raw(0)
+            reader.refresh()
+        self.assertFalse(buffer.closed)
+        view.release()
+        with corpus_reader.CorpusReader(self.path("crawled")) as reader:
+            buffer = reader.buffer
+        self.assertTrue(buffer.closed)
+        self.assertIsNone(reader.buffer)
+
+    def test_splits(self):
+        """
+        The splits cover every entry once, in order, and each worker reads its own back from the file.
+        """
+        for name in ("json", "msgpack"):
+            with self.subTest(name):
+                path = self.write_entries(name, self.entries, get_serializer(name))
+                with corpus_reader.CorpusReader(path) as reader:
+                    splits = reader.splits(7)
+                    self.assertEqual(len(splits), 7)
+                    self.assertEqual([split.first_entry for split in splits],
+                                     [0] + [split.first_entry + split.num_entries for split in splits[:-1]])
+                    self.assertEqual(sum(split.num_entries for split in splits), self.NUM_TWEETS)
+                    self.assertEqual(sum(reader.map_splits(list, num_splits=7, num_workers=2), []), self.entries)
+
+    def test_refresh_after_resumed_crawl(self):
+        """
+        A reader only scans what was appended since it last looked, a last entry that is still being written is left
+        out until it is whole, and the offsets are read back from their cache by the next reader.
+        """
+        checkpoint = Checkpoint("x", "x", self.path("resumed"))
+        self.crawl(checkpoint, max_tweets=300)
+        with corpus_reader.CorpusReader(self.path("resumed")) as reader:
+            self.assertEqual(len(reader), 300)
+            checkpoint.finished = False
+            self.crawl(checkpoint)
+            self.assertEqual(reader.refresh(), self.NUM_TWEETS - 300)
+            self.assertEqual(list(reader.entries(0, len(reader))), self.entries)
+
+            serializer = get_serializer()
+            with open(self.path("resumed"), "ab") as f:
+                f.write(serializer.dumps(self.entries[0])[:-10])
+            self.assertEqual(reader.refresh(), 0)
+            with open(self.path("resumed"), "ab") as f:
+                f.write(serializer.dumps(self.entries[0])[-10:])
+            self.assertEqual(reader.refresh(), 1)
+
+        with mock.patch.object(corpus_reader, "scan_offsets", side_effect=AssertionError("scanned again")):
+            with corpus_reader.CorpusReader(self.path("resumed")) as reader:
+                self.assertEqual(len(reader), self.NUM_TWEETS + 1)
+                self.assertEqual(reader.entry(self.NUM_TWEETS), self.entries[0])
+
+    def test_rewritten_file(self):
+        corpus_reader.CorpusReader(self.path("crawled")).close()
+        # a resumed crawl truncated the file back to its checkpoint, and wrote other entries
+        self.write_entries("crawled", self.entries[:100] + self.entries[200:] + self.entries[100:200])
+        with contextlib.redirect_stderr(io.StringIO()) as stderr, \
+                corpus_reader.CorpusReader(self.path("crawled")) as reader:
+            self.assertEqual(list(reader.entries(0, len(reader))), list(read_entries(self.path("crawled"))))
+        self.assertIn("changed", stderr.getvalue())
+
+
+class CatalogTests(ReplayTestCase):
+    def setUp(self):
+        super().setUp()
+        self.crawl(Checkpoint("tim hortons", "tim hortons", self.path("crawled")))
+        self.entries = list(read_entries(self.path("crawled")))
+
+    def read_partitions(self, partitions, since=None, until=None, distinct=True):
+        return list(catalog.iter_entries(self.directory, partitions, since, until, distinct))
+
+    def test_select(self):
+        """
+        Partitions are pruned by query and time, a file with a block file is only selected as the block file, and
+        iter_entries only gives the entries of the range.
+        """
+        self.write_entries("coffee|2018-06-06", self.entries[:10])
+        blocks.convert(self.path("crawled"), block_size=100)
+        with open(self.path("notes.txt"), "w") as f:
+            f.write("not an output file\n")
+        index = catalog.Catalog(self.directory)
+        self.assertEqual(index.update(), (3, 0, 0))
+        self.assertEqual(catalog.Catalog(self.directory).update(), (0, 0, 0))
+
+        self.assertEqual([p.name for p in index.select(query="coffee")], ["coffee|2018-06-06"])
+        self.assertEqual([p.name for p in index.select(query="Tim")], ["crawled.blk"])
+        created_at = sorted(entry["created_at"] for entry in self.entries)
+        since, until = created_at[100], created_at[500]
+        self.assertEqual(index.select(query="tim", until=created_at[0]), [])
+        self.assertEqual(self.read_partitions(index.select(query="tim", since=since, until=until), since, until),
+                         [entry for entry in self.entries if since <= entry["created_at"] < until])
+
+    def test_register_crawl_from_checkpoint(self):
+        """
+        A crawl registered with the counts and date range of its checkpoint, resumed part way through, gets the same
+        partition as reading its file through, without reading it.
+        """
+        checkpoint = twitter_search.new_checkpoint("tim hortons", self.path("counted"), fields=self.FIELDS)
+        self.crawl(checkpoint, max_tweets=300)
+        resumed = load_checkpoint(checkpoint.path)
+        self.crawl(resumed)
+        self.assertEqual(resumed.num_entries, self.NUM_TWEETS)
+
+        with mock.patch.object(catalog, "read_entries") as read:
+            partition = catalog.register_crawl(resumed)
+        read.assert_not_called()
+        self.assertEqual(partition.to_dict(), catalog.describe(self.path("counted")).to_dict())
+        self.assertEqual(catalog.Catalog(self.directory).partitions["counted"].to_dict(), partition.to_dict())
+
+    def test_concurrent_registers(self):
+        """
+        Processes registering files at the same time don't lose each other's partitions.
+        """
+        names = ["crawl %d" % i for i in range(16)]
+        for name in names:
+            self.write_entries(name, self.entries[:5])
+        with ProcessPoolExecutor(4) as executor:
+            list(executor.map(catalog.register, [self.path(name) for name in names], ["search"] * len(names)))
+        self.assertEqual(sorted(catalog.Catalog(self.directory).partitions), sorted(names))
+
+    def test_changed_file_described_again(self):
+        checkpoint = Checkpoint("x", "x", self.path("resumed"))
+        self.crawl(checkpoint, max_tweets=300)
+        index = catalog.Catalog(self.directory)
+        index.update()
+        self.assertEqual(index.partitions["resumed"].num_entries, 300)
+        checkpoint.finished = False
+        self.crawl(checkpoint)
+        self.assertEqual(index.update(), (0, 1, 0))
+        self.assertEqual(index.partitions["resumed"].num_entries, self.NUM_TWEETS)
+        os.remove(self.path("resumed"))
+        self.assertEqual(index.update(), (0, 0, 1))
+
+    def test_distinct_across_partitions(self):
+        """
+        Overlapping crawls give every tweet once.
+        """
+        self.write_entries("a", self.entries[:400])
+        self.write_entries("b", self.entries[300:])
+        index = catalog.Catalog(self.directory)
+        index.update()
+        partitions = [index.partitions["a"], index.partitions["b"]]
+        self.assertEqual(self.read_partitions(partitions), self.entries)
+        self.assertEqual(len(self.read_partitions(partitions, distinct=False)), self.NUM_TWEETS + 100)
+
+    def test_same_text_same_second(self):
+        """
+        Two tweets with the same text posted in the same second are both kept, and only skipped in a later partition
+        that has both of them too.
+        """
+        twins = [dict(self.entries[0], retweets=1), dict(self.entries[0], retweets=2)]
+        self.write_entries("a", twins)
+        self.write_entries("b", twins + [dict(self.entries[0], retweets=3)] + self.entries[1:3])
+        index = catalog.Catalog(self.directory)
+        index.update()
+        self.assertEqual(self.read_partitions([index.partitions["a"], index.partitions["b"]]),
+                         twins + [dict(self.entries[0], retweets=3)] + self.entries[1:3])
+
+    def test_entries_without_identity_never_skipped(self):
+        """
+        Entries written with --fields that don't tell tweets apart are all kept.
+        """
+        cleaned = [{"cleaned": "good coffee"}] * 5
+        self.write_entries("a", cleaned)
+        self.write_entries("b", cleaned)
+        partitions = [catalog.describe(self.path("a"), query="x"), catalog.describe(self.path("b"), query="x")]
+        self.assertEqual(len(self.read_partitions(partitions)), 10)
+
+        with_ids = [{"id": 1, "cleaned": "good coffee"}, {"id": 2, "cleaned": "good coffee"}]
+        self.write_entries("a", with_ids)
+        self.write_entries("b", with_ids[1:] + [{"id": 3, "cleaned": "good coffee"}])
+        self.assertEqual([entry["id"] for entry in self.read_partitions(partitions)], [1, 2, 3])
+
+
+class AggregatorTests(ReplayTestCase):
+    def setUp(self):
+        super().setUp()
+        self.crawl(Checkpoint("x", "x", self.path("crawled")))
+        rng = random.Random(11)
+        self.entries = list(read_entries(self.path("crawled")))
+        for entry in self.entries:
+            entry["polarity"] = rng.uniform(-1, 1)
+            entry["subjectivity"] = rng.random()
+            entry["tags"] = [[word, rng.choice(["NN", "JJ", "VB"])] for word in entry["cleaned"].split()[:5]]
+        self.write_entries("enriched", self.entries)
+
+    def run_engine(self, entries, batch_size=aggregators.BATCH_SIZE, max_points=None):
+        """
+        :return: list of the results of every aggregator, computed in one pass over entries
+        """
+        engine = aggregators.Engine(batch_size)
+        registered = [engine.register(aggregator) for aggregator in (
+            aggregators.HashtagCounts(), aggregators.SourceCounts(), aggregators.PosTagCounts(),
+            aggregators.SentimentCounts(), aggregators.SentSubjSample(max_points))]
+        self.assertEqual(engine.run(entries), self.NUM_TWEETS)
+        return [aggregator.result() for aggregator in registered]
+
+    def test_same_as_separate_counts(self):
+        expected = [
+            collections.Counter(hashtag for entry in self.entries for hashtag in entry["hashtags"]),
+            collections.Counter(entry["source"] for entry in self.entries),
+            collections.Counter(tag for entry in self.entries for _, tag in entry["tags"]),
+            collections.Counter(aggregators.sentiment_label(entry["polarity"]) for entry in self.entries),
+            [(entry["polarity"], entry["subjectivity"]) for entry in self.entries],
+        ]
+        for batch_size in (1, 64, aggregators.BATCH_SIZE):
+            self.assertEqual(self.run_engine(iter(self.entries), batch_size), expected)
+
+    def test_every_input_format(self):
+        """
+        The columnar format (with only the fields the aggregators read), block files and msgpack all give the same
+        aggregates as the JSON lines.
+        """
+        expected = self.run_engine(self.entries)
+        engine_fields = ("hashtags", "source", "tags", "polarity", "subjectivity")
+        columns = columnar.iter_entries(columnar.convert_jsonl(self.path("enriched"), row_group_size=100),
+                                        engine_fields)
+        self.assertEqual(self.run_engine(columns), expected)
+        self.assertEqual(self.run_engine(blocks.iter_entries(blocks.convert(self.path("enriched"), block_size=100))),
+                         expected)
+        self.assertEqual(self.run_engine(read_entries(self.write_entries("packed", self.entries,
+                                                                         get_serializer("msgpack")))), expected)
+
+    def test_run_in_parts(self):
+        """
+        An engine fed a crawl in two runs, as it is resumed, ends up with the same aggregates as one run.
+        """
+        engine = aggregators.Engine()
+        hashtags = engine.register(aggregators.HashtagCounts())
+        sample = engine.register(aggregators.SentSubjSample(max_points=100, seed=3))
+        self.assertEqual(engine.run(self.entries[:300]), 300)
+        self.assertEqual(engine.run(self.entries[300:]), self.NUM_TWEETS - 300)
+        self.assertEqual(engine.num_entries, self.NUM_TWEETS)
+        self.assertEqual(hashtags.result(), aggregators.aggregate(self.entries, aggregators.HashtagCounts()))
+        self.assertEqual(sample.result(), aggregators.aggregate(self.entries, aggregators.SentSubjSample(100, seed=3)))
+
+    def test_sample_bounded(self):
+        points = self.run_engine(self.entries, max_points=50)[-1]
+        self.assertEqual(len(points), 50)
+        self.assertLessEqual(set(points), set((entry["polarity"], entry["subjectivity"]) for entry in self.entries))
+
+    def test_light_imports(self):
+        """
+        Running an analysis, and reading output files in any of their formats, doesn't import tweepy or TextBlob.
+        """
+        code = ("import sys, analysis_search, corpus_reader, inverted_index; "
+                "print(sorted(set(sys.modules) & {'tweepy', 'textblob', 'twitter_util'}))")
+        output = subprocess.check_output([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(output.strip(), b"[]")
+
+
+class QueryLog:
+    """
+    Records the query of every search request, and fails the requests for queries starting with failing_query after
+    the first one, with an error the crawlers don't expect.
+    """
+    def __init__(self, api, failing_query=None):
+        self.api = api
+        self.failing_query = failing_query
+        self.queries = []
+        self._lock = threading.Lock()
+
+    def search(self, **params):
+        with self._lock:
+            self.queries.append(params["q"].split()[0])
+            seen = self.queries.count(params["q"].split()[0])
+        if self.failing_query is not None and params["q"].startswith(self.failing_query) and seen > 1:
+            raise ValueError("injected failure")
+        return self.api.search(**params)
+
+
+class CrawlBatchTests(ReplayTestCase):
+    def batch(self, raw_queries, max_tweets=300):
+        return [twitter_search.QueryCrawl(raw_query, self.path(raw_query), max_tweets=max_tweets, fields=self.FIELDS)
+                for raw_query in raw_queries]
+
+    def run_batch(self, api, crawls, bucket=None, concurrency=1):
+        bucket = bucket or twitter_search.TokenBucket()
+        with quiet():
+            return twitter_search.crawl_batch(api, crawls, bucket=bucket, concurrency=concurrency)
+
+    def test_round_robin(self):
+        """
+        Queries take turns one page at a time, and each output file is the same as a crawl of that query alone.
+        """
+        log = QueryLog(self.api)
+        crawls = self.run_batch(log, self.batch(["a", "b", "c"]))
+
+        self.assertEqual(log.queries, ["a", "b", "c"] * 3)
+        self.crawl(Checkpoint("x", "x", self.path("alone")), max_tweets=300)
+        for crawl_state in crawls:
+            self.assertTrue(crawl_state.succeeded())
+            self.assertTrue(crawl_state.checkpoint.finished)
+            self.assertEqual(self.read(crawl_state.output_filepath), self.read(self.path("alone")))
+
+    def test_bucket_throttles(self):
+        """
+        Every request takes a token, so a bucket refilling at 5 tokens per second spreads 6 requests over a second.
+        """
+        bucket = twitter_search.TokenBucket(capacity=1, window=0.2)
+        start = time.monotonic()
+        crawls = self.run_batch(self.api, self.batch(["a", "b"]), bucket=bucket, concurrency=2)
+
+        self.assertGreaterEqual(time.monotonic() - start, 0.9)
+        self.assertGreaterEqual(bucket.waited, 0.9)
+        self.assertEqual(self.server.requests_served, 6)
+        self.assertTrue(all(crawl_state.succeeded() for crawl_state in crawls))
+
+    def test_one_query_fails(self):
+        """
+        An unexpected error in one query ends that query, and only that one: the others still finish, and the failed
+        one keeps its checkpoint unfinished, to be resumed.
+        """
+        log = QueryLog(self.api, failing_query="b")
+        crawls = self.run_batch(log, self.batch(["a", "b", "c"]), concurrency=2)
+
+        failed = crawls[1]
+        self.assertTrue(failed.done)
+        self.assertIsInstance(failed.error, ValueError)
+        self.assertFalse(failed.succeeded())
+        self.assertFalse(failed.checkpoint.finished)
+        self.assertEqual(failed.tweet_count, 100)
+        self.assertEqual(len(list(read_entries(failed.output_filepath))), 100)
+        self.assertEqual(log.queries.count("b"), 2)
+        for crawl_state in (crawls[0], crawls[2]):
+            self.assertTrue(crawl_state.succeeded())
+            self.assertEqual(crawl_state.tweet_count, 300)
+
+
+class TrendsTests(ReplayTestCase):
+    def setUp(self):
+        super().setUp()
+        self.locations = replay_server.synthetic_locations(["CA", "US"], towns_per_country=3)
+        self.server.locations = self.locations
+
+    def test_locations_cached(self):
+        cache_path = self.path("locations")
+        with mock.patch.object(self.api, "trends_available", wraps=self.api.trends_available) as trends_available:
+            self.assertEqual(twitter_trends.get_available_locations(self.api, cache_path, 60), self.locations)
+            self.assertEqual(twitter_trends.get_available_locations(self.api, cache_path, 60), self.locations)
+            self.assertEqual(trends_available.call_count, 1)
+
+            # once the cache is older than the ttl, it is fetched again
+            mtime = time.time() - 120
+            os.utime(cache_path, (mtime, mtime))
+            self.assertEqual(twitter_trends.get_available_locations(self.api, cache_path, 60), self.locations)
+            self.assertEqual(trends_available.call_count, 2)
+        self.assertGreater(os.path.getmtime(cache_path), mtime)
+
+    def test_select_woeids(self):
+        """
+        Only the towns of the countries asked for are kept, not the countries themselves or the whole world.
+        """
+        woeids = twitter_trends.select_woeids(self.locations, ["CA"])
+        towns = [location["woeid"] for location in self.locations
+                 if location["countryCode"] == "CA" and location["placeType"]["name"] == "Town"]
+        self.assertEqual(woeids, towns)
+        self.assertEqual(len(woeids), 3)
+        self.assertEqual(twitter_trends.select_woeids(self.locations, ["FR"]), [])
+
+    def test_fetch_all_trends(self):
+        woeids = twitter_trends.select_woeids(self.locations, ["CA", "US"])
+        trends = list(twitter_trends.fetch_all_trends(self.api, woeids, concurrency=4))
+        self.assertEqual([trend_data["woeid"] for trend_data in trends], woeids)
+        names = dict((location["woeid"], location["name"]) for location in self.locations)
+        for trend_data in trends:
+            self.assertEqual(trend_data["location_name"], names[trend_data["woeid"]])
+            self.assertTrue(trend_data["trend_list"])
+
+    def test_one_woeid_fails(self):
+        """
+        A woeid whose request fails is reported in errors, and the trends of the others are still all fetched.
+        """
+        woeids = twitter_trends.select_woeids(self.locations, ["CA", "US"])
+        errors = {}
+        trends = list(twitter_trends.fetch_all_trends(self.api, woeids[:2] + [42] + woeids[2:], concurrency=4,
+                                                      errors=errors))
+        self.assertEqual([trend_data["woeid"] for trend_data in trends], woeids)
+        self.assertEqual(list(errors), [42])
+        self.assertIsInstance(errors[42], tweepy.TweepError)
+
+
+if __name__ == "__main__":
+    unittest.main()
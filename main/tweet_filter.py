@@ -0,0 +1,139 @@
+"""
+tweet_filter.py
+
+Filters on the tweets of a crawl, applied as early as possible, so that tweets nobody wants are never cleaned, run
+through TextBlob or written.
+
+Some predicates can be pushed down into the search request itself, and the API never returns the tweets they reject:
+    - lang: passed as the "lang" parameter of search/tweets
+    - min_retweets: the "min_retweets:N" query operator
+    - sources: the "source:" query operator, OR'ed together
+The API doesn't apply these exactly (retweet counts change after indexing, and the operators are best effort), so they
+are checked again on every tweet. The other predicates only run locally, on raw fields of the tweet, before cleaning:
+    - pattern: regular expression searched in the raw text
+    - hashtags: the tweet must have at least one of these hashtags
+    - min_followers, max_followers: thresholds on the number of followers of the author
+
+Every filter counts the tweets it dropped. A tweet is only counted by the first filter that drops it, in the order
+above.
+
+Usage:
+    tweet_filter = TweetFilter(min_retweets=5, hashtags=["coffee"])
+    query = build_query(raw_query, tweet_filter)
+    tweets = tweet_filter.apply(search_page(api, query, max_id, tweet_filter.lang))
+"""
+import re
+import threading
+
+LANG = "en"
+
+
+def raw_text(tweet):
+    """
+    :param tweet: tweepy Status object
+    :return: string, the full text of an extended tweet, or the text of a tweet fetched without tweet_mode="extended"
+    """
+    return tweet._json.get("full_text", tweet._json.get("text", ""))
+
+
+class TweetFilter:
+    """
+    A set of predicates on tweets, see the module docstring. Safe to share between threads.
+
+    :param lang: language code of the tweets to keep, or None for every language
+    :param min_retweets: minimum number of retweets, or None
+    :param sources: iterable of the sources to keep (eg. "Twitter for iPhone"), or None for every source
+    :param pattern: regular expression the raw text must contain, or None
+    :param hashtags: iterable of hashtags, without "#", the tweet must have one of, or None
+    :param min_followers: minimum number of followers of the author, or None
+    :param max_followers: maximum number of followers of the author, or None
+    """
+    def __init__(self, lang=LANG, min_retweets=None, sources=None, pattern=None, hashtags=None, min_followers=None,
+                 max_followers=None):
+        self.lang = lang
+        self.min_retweets = min_retweets
+        self.sources = frozenset(sources) if sources else None
+        self.pattern = re.compile(pattern) if pattern else None
+        self.hashtags = frozenset(tag.lower().lstrip("#") for tag in hashtags) if hashtags else None
+        self.min_followers = min_followers
+        self.max_followers = max_followers
+
+        # (name, predicate) of every filter in use, cheapest first among the local ones
+        self.predicates = []
+        if lang is not None:
+            self.predicates.append(("lang", lambda tweet: tweet._json.get("lang") == self.lang))
+        if min_retweets is not None:
+            self.predicates.append(("min_retweets", lambda tweet: tweet.retweet_count >= self.min_retweets))
+        if self.sources is not None:
+            self.predicates.append(("sources", lambda tweet: tweet.source in self.sources))
+        if self.pattern is not None:
+            self.predicates.append(("pattern", lambda tweet: self.pattern.search(raw_text(tweet)) is not None))
+        if self.hashtags is not None:
+            self.predicates.append(("hashtags", lambda tweet: any(tag["text"].lower() in self.hashtags
+                                                                  for tag in tweet.entities["hashtags"])))
+        if min_followers is not None:
+            self.predicates.append(("min_followers", lambda tweet: tweet.author.followers_count >= self.min_followers))
+        if max_followers is not None:
+            self.predicates.append(("max_followers", lambda tweet: tweet.author.followers_count <= self.max_followers))
+
+        self.seen = 0
+        self.dropped = dict((name, 0) for name, _ in self.predicates)
+        self._lock = threading.Lock()
+
+    def options(self):
+        """
+        :return: dictionary of the arguments of this filter, JSON serializable, TweetFilter(**options) makes the same
+                 filter
+        """
+        return {
+            "lang": self.lang,
+            "min_retweets": self.min_retweets,
+            "sources": sorted(self.sources) if self.sources is not None else None,
+            "pattern": self.pattern.pattern if self.pattern is not None else None,
+            "hashtags": sorted(self.hashtags) if self.hashtags is not None else None,
+            "min_followers": self.min_followers,
+            "max_followers": self.max_followers
+        }
+
+    def query_operators(self):
+        """
+        :return: string, the search operators of the predicates pushed down into the query, may be empty
+        """
+        operators = []
+        if self.min_retweets is not None:
+            operators.append("min_retweets:%d" % self.min_retweets)
+        if self.sources is not None:
+            sources = ['source:"%s"' % source for source in sorted(self.sources)]
+            operators.append(sources[0] if len(sources) == 1 else "(%s)" % " OR ".join(sources))
+        return " ".join(operators)
+
+    def apply(self, tweets):
+        """
+        :param tweets: list of tweepy Status objects, eg. a page of search results
+        :return: list of the tweets every predicate keeps, in the same order
+        """
+        kept = []
+        dropped = dict.fromkeys(self.dropped, 0)
+        for tweet in tweets:
+            for name, predicate in self.predicates:
+                if not predicate(tweet):
+                    dropped[name] += 1
+                    break
+            else:
+                kept.append(tweet)
+
+        with self._lock:
+            self.seen += len(tweets)
+            for name, count in dropped.items():
+                self.dropped[name] += count
+        return kept
+
+    def report(self):
+        """
+        :return: list of strings, the number of tweets dropped by each filter
+        """
+        with self._lock:
+            lines = ["filters: %d of %d tweets kept" % (self.seen - sum(self.dropped.values()), self.seen)]
+            for name, count in self.dropped.items():
+                lines.append("  %-14s %10d dropped" % (name, count))
+            return lines
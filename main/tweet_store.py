@@ -0,0 +1,62 @@
+"""
+tweet_store.py
+
+Write the data entries of a crawl into the tweet store of the tweety app (see project/tweety/store.py), in the
+database of its Django settings, so that the app and every crawl share the tweets they found. A tweet that is already
+stored, eg. found by an overlapping query, is only linked to the new query.
+
+The database needs the tables of the tweety app:
+    cd ../project && python manage.py migrate tweety
+
+Usage:
+    writer = StoreWriter("tim hortons")
+    writer.write([tweet.id for tweet in tweets], data_entries)
+"""
+import os
+import sys
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "project")
+SETTINGS_MODULE = "project.settings"
+
+
+def setup_django(settings_module=SETTINGS_MODULE):
+    """
+    Make the tweety app importable from here, and load its settings.
+    :param settings_module: string, Django settings module, eg. to use another database
+    """
+    import django
+    project_dir = os.path.abspath(PROJECT_DIR)
+    if project_dir not in sys.path:
+        sys.path.insert(0, project_dir)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+    django.setup()
+
+
+class StoreWriter:
+    """
+    Writes the data entries of one query to the tweet store.
+
+    :param query: string, the space separated query the user entered
+    :param settings_module: string, Django settings module of the database to write to
+    """
+    def __init__(self, query, settings_module=SETTINGS_MODULE):
+        setup_django(settings_module)
+        from tweety import store
+        self.store = store
+        self.query = query
+        self.written = 0
+        self.new = 0
+
+    def write(self, tweet_ids, data_entries):
+        """
+        :param tweet_ids: list of the ids of the tweets of data_entries
+        :param data_entries: list of data entries, with every field
+        """
+        self.new += self.store.ingest_entries(zip(tweet_ids, data_entries), self.query)
+        self.written += len(data_entries)
+
+    def report(self):
+        """
+        :return: string, one line summary of what was stored
+        """
+        return "store: %d tweets written, %d of them new" % (self.written, self.new)
@@ -0,0 +1,247 @@
+"""
+twitter_follow.py
+
+Follow a search query: instead of re-running the whole 7 day crawl to see what's new, poll forward in time with
+since_id, append only the new tweets to the existing output file (and to the archive and the columnar file of the
+crawl, if it keeps them), and keep the analysis_search.py counts (hashtags, sources, part-of-speech tags, sentiment) up
+to date in memory. New tweets go through the same filter, and get the same data entry fields, as the crawl they
+continue.
+
+The counts are flushed every few seconds to "<output file>.aggregates", a JSON file that dashboards can reload.
+
+The output file keeps the layout of twitter_search.py: the initial crawl is written newest first, and every poll
+after that appends the tweets that are newer than anything already in the file.
+
+If the query was crawled before into the output directory, following continues from that crawl's checkpoint.
+Otherwise, a normal backwards crawl is done first (unless --no-backfill is given).
+
+Usage:
+    python twitter_follow.py -q "Tim Hortons" -o ../output/search --interval 30
+"""
+import argparse
+import os
+import sys
+import time
+
+import tweepy
+
+import catalog
+import twitter_search
+import twitter_util
+from analysis_search import RunningAggregates, iter_data_entries
+from checkpoint import find_checkpoint
+from columnar import columnar_path
+from serializers import FORMATS, detect_path_format, get_serializer
+from tweet_filter import TweetFilter
+from tweet_store import StoreWriter, SETTINGS_MODULE
+
+AGGREGATES_SUFFIX = ".aggregates"
+POLL_INTERVAL = 30
+FLUSH_INTERVAL = 5
+READ_BATCH_SIZE = 1000
+
+
+class Follower:
+    """
+    Poll a query forward in time, appending to the output file of its checkpoint.
+
+    New tweets are written through the PageWriter of the crawl, so its archive, columnar file and tweet store are kept
+    up to date along with the output file. They go through the TweetFilter the crawl was started with, and their data
+    entries have the same fields, both recorded in the checkpoint.
+
+    :param api: tweepy API object
+    :param writer: PageWriter of the crawl to follow. The since_id of its checkpoint is where polling starts.
+    :param aggregates: RunningAggregates, already holding the counts of the entries in the output file
+    :param flush_interval: float, minimum seconds between two writes of the aggregates file
+    """
+    def __init__(self, api, writer, aggregates, flush_interval=FLUSH_INTERVAL):
+        self.api = api
+        self.writer = writer
+        self.checkpoint = writer.checkpoint
+        self.stats = writer.stats
+        self.tweet_filter = checkpoint_filter(self.checkpoint)
+        self.fields = twitter_util.project_fields(self.checkpoint.fields)
+        self.aggregates = aggregates
+        self.aggregates_path = self.checkpoint.output_filepath + AGGREGATES_SUFFIX
+        self.flush_interval = flush_interval
+        self.last_flush = 0.0
+        self.dirty = True
+
+    def poll(self):
+        """
+        Fetch every tweet newer than since_id, newest first, paging backwards through the gap with max_id.
+
+        Every page is written, added to the aggregates and committed as soon as it is fetched, so memory holds one page
+        whatever the size of the gap. The checkpoint records how far into the gap the poll got, and since_id only moves
+        forward once the whole gap is written: a poll that fails part way through leaves the rest of the gap to the
+        next poll, which continues where it stopped, and no tweet is written twice.
+
+        :return: number of new tweets
+        """
+        checkpoint = self.checkpoint
+        since_id = checkpoint.since_id
+        lang = self.tweet_filter.lang if self.tweet_filter is not None else None
+        new_count = 0
+
+        while True:
+            max_id = checkpoint.gap_max_id if checkpoint.gap_max_id is not None else -1
+            with self.stats.time("fetch"):
+                new_tweets = twitter_search.search_page(self.api, checkpoint.query, max_id, lang, since_id)
+            self.stats.count("fetch", len(new_tweets))
+            if not new_tweets:
+                break
+
+            kept_tweets = twitter_search.filter_page(new_tweets, self.tweet_filter, self.stats)
+            with self.stats.time("enrich", len(kept_tweets)):
+                data_entries = twitter_util.search_results_to_data_entries(kept_tweets, self.fields)
+            new_count += len(new_tweets)
+            tweet_count = checkpoint.tweet_count + len(new_tweets)
+
+            # with nothing to poll from yet, only the most recent page is taken
+            if since_id is None:
+                self.writer.write_page(kept_tweets, data_entries, checkpoint.max_id, tweet_count, new_tweets[0].id)
+                self.aggregates.add(data_entries)
+                break
+
+            if checkpoint.gap_newest_id is None:
+                checkpoint.gap_newest_id = new_tweets[0].id
+            checkpoint.gap_max_id = new_tweets[-1].id
+            # since_id stays where it is until the gap is closed
+            self.writer.write_page(kept_tweets, data_entries, checkpoint.max_id, tweet_count)
+            self.aggregates.add(data_entries)
+
+        if checkpoint.gap_newest_id is not None:
+            # the whole gap is written, the next poll starts from its newest tweet
+            checkpoint.since_id = checkpoint.gap_newest_id
+            checkpoint.gap_max_id = None
+            checkpoint.gap_newest_id = None
+            checkpoint.save()
+        if new_count > 0:
+            self.dirty = True
+            self.flush()
+        return new_count
+
+    def flush(self, force=False):
+        """
+        Write the aggregates file, if anything changed and the last write is at least flush_interval seconds old.
+        :param force: write even if the last write is recent
+        """
+        now = time.monotonic()
+        if self.dirty and (force or now - self.last_flush >= self.flush_interval):
+            self.aggregates.save(self.aggregates_path)
+            self.last_flush = now
+            self.dirty = False
+
+    def follow(self, interval=POLL_INTERVAL, max_polls=None):
+        """
+        Poll every interval seconds, forever or until max_polls polls are done.
+
+        :param interval: float, seconds between the start of two polls
+        :param max_polls: optional number of polls
+        """
+        polls = 0
+        while max_polls is None or polls < max_polls:
+            started = time.monotonic()
+            try:
+                new_count = self.poll()
+                print("[%s] %d new tweets, %d in total." % (time.strftime("%H:%M:%S"), new_count,
+                                                            self.checkpoint.tweet_count))
+            except tweepy.TweepError as e:
+                print("Something went wrong: " + str(e))
+            self.flush(force=True)
+            polls += 1
+
+            if max_polls is None or polls < max_polls:
+                time.sleep(max(interval - (time.monotonic() - started), 0))
+
+
+def checkpoint_filter(checkpoint):
+    """
+    :param checkpoint: Checkpoint of a crawl
+    :return: TweetFilter the crawl was started with. A checkpoint written before filters were recorded gets the
+             language filter every crawl had then.
+    """
+    if checkpoint.filter_options is None:
+        return TweetFilter()
+    return TweetFilter(**checkpoint.filter_options)
+
+
+def read_aggregates(output_filepath):
+    """
+    Compute the aggregates of an existing output file, reading it a batch of lines at a time.
+    :param output_filepath: string, path of a twitter_search.py output file
+    :return: RunningAggregates
+    """
+    aggregates = RunningAggregates()
+    batch = []
+    for entry in iter_data_entries(output_filepath):
+        batch.append(entry)
+        if len(batch) >= READ_BATCH_SIZE:
+            aggregates.add(batch)
+            batch = []
+    aggregates.add(batch)
+    return aggregates
+
+
+if __name__ == "__main__":
+    # command line parsing
+    parser = argparse.ArgumentParser(description="Follow a search query, appending new tweets as they come in")
+    parser.add_argument("-q", "--query", help="Specify the query string to use", required=True)
+    parser.add_argument("-o", "--output", help="Specify output file path", required=True)
+    parser.add_argument("-i", "--interval", help="Seconds between polls", type=float, default=POLL_INTERVAL)
+    parser.add_argument("-f", "--flush", help="Seconds between writes of the aggregates file", type=float,
+                        default=FLUSH_INTERVAL)
+    parser.add_argument("--no-backfill", help="If the query wasn't crawled before, only follow from now on",
+                        action="store_true")
+    parser.add_argument("--format", help="Format of a new output file, see serializers.py. An existing output file "
+                                         "keeps its format.", choices=FORMATS, default="json", dest="output_format")
+    parser.add_argument("--store", help="Also write the new tweets to the tweet store of the tweety app (see "
+                                        "tweet_store.py)", action="store_true")
+    parser.add_argument("--store-settings", help="Django settings module of the tweet store database",
+                        default=SETTINGS_MODULE)
+    args = parser.parse_args()
+    try:
+        get_serializer(args.output_format)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # get access to twitter API object
+    api = twitter_util.create_api(twitter_search.KEYPATH)
+    if not api:
+        print("Can't Authenticate")
+        sys.exit(-1)
+
+    checkpoint = find_checkpoint(args.output, args.query, include_finished=True)
+    if checkpoint is None:
+        output_filepath = twitter_search.build_output_filepath(args.output, args.query)
+        checkpoint = twitter_search.new_checkpoint(args.query, output_filepath, tweet_filter=TweetFilter())
+    fields = twitter_util.project_fields(checkpoint.fields)
+    missing = [name for name in RunningAggregates.FIELDS if name not in fields]
+    if missing:
+        parser.error("the crawl of '%s' doesn't write %s, the aggregates need them" % (args.query, ", ".join(missing)))
+    if args.store and fields != twitter_util.DATA_FIELDS:
+        parser.error("--store needs every data entry field, the crawl of '%s' only writes some" % args.query)
+
+    serializer = detect_path_format(checkpoint.output_filepath, args.output_format)
+    # keep up the archive and the columnar file, if the crawl has them
+    keep_archive = checkpoint.archive_offset is not None
+    keep_columnar = os.path.exists(columnar_path(checkpoint.output_filepath))
+    store_writer = StoreWriter(args.query, args.store_settings) if args.store else None
+    with twitter_search.PageWriter.open(checkpoint, serializer, keep_archive, keep_columnar, store_writer) as writer:
+        # finish (or do) the backwards crawl first, so since_id is the newest tweet in the file
+        if not checkpoint.finished and not args.no_backfill:
+            twitter_search.crawl(api, checkpoint.query, writer, fields=checkpoint.fields,
+                                 tweet_filter=checkpoint_filter(checkpoint))
+        if checkpoint.offset > 0:
+            running_aggregates = read_aggregates(checkpoint.output_filepath)
+        else:
+            running_aggregates = RunningAggregates()
+
+        print("Following '%s' from [%d] tweets in %s" % (args.query, checkpoint.tweet_count,
+                                                        checkpoint.output_filepath))
+        follower = Follower(api, writer, running_aggregates, flush_interval=args.flush)
+        try:
+            follower.follow(args.interval)
+        except KeyboardInterrupt:
+            follower.flush(force=True)
+    catalog.register_crawl(checkpoint)
@@ -12,97 +12,741 @@ This string may be space separated and contain multiple search terms, such as:
 
 The script produces an output file with the query term, as well as a timestamp.
 The output file contains all the tweets that match the query from the past 7 days (as the twitter API only lets you
-go back in time that far), OR a max of 200,000 of the most recent tweets.
+go back in time that far), OR a max of 200,000 of the most recent tweets. The output file is registered in the catalog
+of the output directory (see catalog.py).
 """
 import tweepy
 import argparse
 import sys
 import os
-import json
 import datetime
+import queue
+import re
+import threading
+import time
+import collections
+import copy
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import twitter_util
+import archive
+import catalog
+from checkpoint import Checkpoint, find_checkpoint
+from columnar import ColumnarWriter, columnar_path
+from enrich_cache import EnrichmentCache, MAX_DISK_ENTRIES
+from near_duplicates import NearDuplicateIndex, MAX_CLUSTERS
+from rate_limit import TokenBucket
+from serializers import FORMATS, detect_path_format, get_serializer
+from stats import StageStats
+from tweet_store import StoreWriter, SETTINGS_MODULE
+from tweet_filter import TweetFilter, LANG
 
 KEYPATH = "keys/auth"
-LANG = "en"
 COUNT = 100
 MAX_TWEETS = 200000
 TWEET_MODE = "extended"
 FILE_DELIMITER_CHAR = "|"
+MAX_PENDING_PAGES = 8
+BATCH_CONCURRENCY = 4
 
-if __name__ == "__main__":
-    # command line parsing
-    parser = argparse.ArgumentParser(description="Preprocess CSV files")
-    parser.add_argument("-q", "--query", help="Specify the query string to use", required=True)
-    parser.add_argument("-o", "--output", help="Specify output file path", required=True)
-    args = parser.parse_args()
 
-    # the input query is some space separated string
-    raw_query = args.query
-    raw_query_list = raw_query.split(" ")
+def build_output_filepath(output_dir, raw_query):
+    """
+    Construct the output filename for a query, of the form "term1|term2|YYYY-MM-DD".
 
+    :param output_dir: string, directory to write into
+    :param raw_query: string, the space separated query the user entered
+    :return: string, output file path
+    """
     # generate a non-space string representation of the raw query
-    raw_query_with_no_spaces = FILE_DELIMITER_CHAR.join(raw_query_list)
+    raw_query_with_no_spaces = FILE_DELIMITER_CHAR.join(raw_query.split(" "))
 
-    # construct the output filename
     timestamp = datetime.datetime.now().strftime("%Y-%m-%d")
-    output_filepath = os.path.join(args.output, raw_query_with_no_spaces + FILE_DELIMITER_CHAR + timestamp)
+    return os.path.join(output_dir, raw_query_with_no_spaces + FILE_DELIMITER_CHAR + timestamp)
+
 
-    # construct the actual query that we will be using - want to ignore retweets
+def build_query(raw_query, tweet_filter=None):
+    """
+    Construct the actual query that we will be using - want to ignore retweets.
+    :param raw_query: string, the space separated query the user entered
+    :param tweet_filter: optional TweetFilter, whose pushed down predicates are added to the query
+    :return: string, query to send to the API
+    """
     query = raw_query + " -filter:retweets"
+    if tweet_filter is not None and tweet_filter.query_operators():
+        query += " " + tweet_filter.query_operators()
+    return query
 
-    # read auth details from private key file
-    with open(KEYPATH, "r") as auth_file:
-        auth_lines = auth_file.readlines()
-        ACCESS_TOKEN = auth_lines[0].strip().split("=")[1]
-        ACCESS_SECRET = auth_lines[1].strip().split("=")[1]
-        CONSUMER_KEY = auth_lines[2].strip().split("=")[1]
-        CONSUMER_SECRET = auth_lines[3].strip().split("=")[1]
 
-    # setup auth
-    auth = tweepy.AppAuthHandler(CONSUMER_KEY, CONSUMER_SECRET)
+def new_checkpoint(raw_query, output_filepath, fields=None, tweet_filter=None):
+    """
+    Start the checkpoint of a new crawl, recording its fields and filter, and counting its entries.
 
-    # get access to twitter API object
-    api = tweepy.API(auth, wait_on_rate_limit=True, wait_on_rate_limit_notify=True)
-    if not api:
-        print("Can't Authenticate")
-        sys.exit(-1)
+    :param raw_query: string, the space separated query the user entered
+    :param output_filepath: string, file to write the data entries to
+    :param fields: optional iterable of the data entry fields to write, all of them by default
+    :param tweet_filter: optional TweetFilter
+    :return: Checkpoint
+    """
+    return Checkpoint(raw_query, build_query(raw_query, tweet_filter), output_filepath,
+                      fields=twitter_util.project_fields(fields),
+                      filter_options=tweet_filter.options() if tweet_filter is not None else {"lang": None},
+                      num_entries=0)
+
+
+def search_page(api, query, max_id, lang=None, since_id=None):
+    """
+    Fetch one page of search results.
+
+    :param api: tweepy API object
+    :param query: string, query to send to the API
+    :param max_id: id of the oldest tweet seen so far, or -1 on the first request
+    :param lang: optional language code, only tweets in that language are returned
+    :param since_id: optional id, only tweets newer than it are returned
+    :return: SearchResults, list of tweepy Status objects, newest first
+    """
+    params = {"q": query, "count": COUNT, "tweet_mode": TWEET_MODE}
+    if lang is not None:
+        params["lang"] = lang
+    if since_id is not None:
+        params["since_id"] = str(since_id)
+    # subsequent iterations - start searching where the previous iteration left off
+    if max_id > 0:
+        params["max_id"] = str(max_id - 1)
+    return api.search(**params)
+
+
+def filter_page(tweets, tweet_filter, stats):
+    """
+    Drop the tweets of a page that tweet_filter rejects, before they are enriched.
+
+    :param tweets: list of tweepy Status objects
+    :param tweet_filter: TweetFilter, or None to keep every tweet
+    :param stats: StageStats, time spent is charged to the "filter" stage
+    :return: list of tweepy Status objects
+    """
+    if tweet_filter is None:
+        return tweets
+    with stats.time("filter", len(tweets)):
+        return tweet_filter.apply(tweets)
+
+
+class PageWriter:
+    """
+    Where the pages of a crawl go. crawl, crawl_pipelined and QueryCrawl all hand their pages to one, so every crawl
+    writes a page the same way: the data entries go to the output file and the raw tweets to the archive, the
+    checkpoint is committed, then the data entries go to the columnar file and the tweet store. The columnar file is
+    written after the checkpoint, so a row group never holds entries that resuming would drop from the output file.
+
+    :param output_file: binary file object opened for writing
+    :param serializer: format of output_file (see serializers.py), JSON lines by default
+    :param checkpoint: optional Checkpoint. The crawl starts from its cursor, and it is committed after every page.
+    :param archive_file: optional binary file object, the raw JSON of every tweet is appended to it
+    :param columnar_writer: optional ColumnarWriter, every data entry is also written to it
+    :param store_writer: optional StoreWriter (see tweet_store.py), every data entry is also written to it
+    :param stats: optional StageStats, time spent is charged to the "write" and "store" stages
+    """
+    def __init__(self, output_file, serializer=None, checkpoint=None, archive_file=None, columnar_writer=None,
+                 store_writer=None, stats=None):
+        self.output_file = output_file
+        self.serializer = serializer if serializer is not None else get_serializer()
+        self.checkpoint = checkpoint
+        self.archive_file = archive_file
+        self.columnar_writer = columnar_writer
+        self.store_writer = store_writer
+        self.stats = stats if stats is not None else StageStats()
+
+    @classmethod
+    def open(cls, checkpoint, serializer, keep_archive=False, keep_columnar=False, store_writer=None, stats=None):
+        """
+        Open the files of a crawl, to continue writing from its checkpoint.
+
+        :param checkpoint: Checkpoint of the crawl
+        :param serializer: format of the output file, see serializers.py
+        :param keep_archive: if True, also append the raw tweets to a compressed archive
+        :param keep_columnar: if True, also write the data entries in the columnar format (see columnar.py)
+        :param store_writer: optional StoreWriter
+        :param stats: optional StageStats
+        :return: PageWriter
+        """
+        output_file = checkpoint.open_output(serializer.header)
+        archive_file = checkpoint.open_archive() if keep_archive else None
+        columnar_writer = None
+        if keep_columnar:
+            columnar_writer = ColumnarWriter(columnar_path(checkpoint.output_filepath))
+            columnar_writer.catch_up(checkpoint.output_filepath)
+        return cls(output_file, serializer, checkpoint, archive_file, columnar_writer, store_writer, stats)
+
+    def write_page(self, kept_tweets, data_entries, max_id, tweet_count, newest_id=None):
+        """
+        Write one page of a crawl.
+
+        :param kept_tweets: list of tweepy Status objects, the tweets of the page that data_entries were made from
+        :param data_entries: list of data entries
+        :param max_id: id of the oldest tweet of the page, kept or not
+        :param tweet_count: number of tweets downloaded so far, this page included
+        :param newest_id: optional id of the newest tweet of the page, the since_id of the checkpoint moves forward to
+                          it
+        """
+        with self.stats.time("write", len(data_entries)):
+            for entry in data_entries:
+                self.output_file.write(self.serializer.dumps(entry))
+            self.output_file.flush()
+            if self.archive_file is not None:
+                archive.write_page(self.archive_file, [tweet._json for tweet in kept_tweets])
+        if self.checkpoint is not None:
+            self.checkpoint.commit(self.output_file, max_id, tweet_count, newest_id, self.archive_file, data_entries)
+        if self.columnar_writer is not None:
+            with self.stats.time("write"):
+                self.columnar_writer.write(data_entries)
+        if self.store_writer is not None:
+            with self.stats.time("store", len(data_entries)):
+                self.store_writer.write([tweet.id for tweet in kept_tweets], data_entries)
+
+    def close(self):
+        self.output_file.close()
+        if self.archive_file is not None:
+            self.archive_file.close()
+        if self.columnar_writer is not None:
+            self.columnar_writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def crawl(api, query, writer, max_tweets=MAX_TWEETS, fields=None, tweet_filter=None):
+    """
+    Page backwards through the search results for query, and hand every page to writer.
+
+    :param api: tweepy API object
+    :param query: string, query to send to the API
+    :param writer: PageWriter. The crawl starts from the cursor of its checkpoint, if it has one, and time spent is
+                   charged to the "fetch", "enrich" and "write" stages of its stats.
+    :param max_tweets: stop after this many tweets
+    :param fields: optional iterable of the data entry fields to write, all of them by default
+    :param tweet_filter: optional TweetFilter, only the tweets it keeps are enriched, written and archived. The query
+                         should be built with it too, see build_query.
+    :return: number of tweets downloaded
+    """
+    stats = writer.stats
+    checkpoint = writer.checkpoint
+    fields = twitter_util.project_fields(fields)
+    lang = tweet_filter.lang if tweet_filter is not None else None
 
     # helper variables
     # all tweets have an id > 0, where higher ids are further back in time
     # initialize max_id at -1 because we don't know where to start our search
     max_id = -1
-    tweetCount = 0
+    tweet_count = 0
+    if checkpoint is not None:
+        max_id = checkpoint.max_id
+        tweet_count = checkpoint.tweet_count
 
-    with open(output_filepath, 'w') as f:
-        while tweetCount < MAX_TWEETS:
-            try:
-                # first iteration - read the most recent tweets
-                if max_id <= 0:
-                    new_tweets = api.search(q=query, count=COUNT, tweet_mode='extended')
-                # subsequent iterations - start searching where the previous iteration left off
-                else:
-                    new_tweets = api.search(q=query, count=COUNT, max_id=str(max_id - 1), tweet_mode='extended')
+    while tweet_count < max_tweets:
+        try:
+            with stats.time("fetch"):
+                new_tweets = search_page(api, query, max_id, lang)
+            stats.count("fetch", len(new_tweets))
+
+            # no more tweets found, exit
+            if not new_tweets:
+                print("No more tweets found, exiting.")
+                break
+
+            # save all these tweets to file
+            kept_tweets = filter_page(new_tweets, tweet_filter, stats)
+            with stats.time("enrich", len(kept_tweets)):
+                data_entries = twitter_util.search_results_to_data_entries(kept_tweets, fields)
+
+            # update variables - the last tweet of the result set is the oldest tweet
+            max_id = new_tweets[-1].id
+            tweet_count += len(new_tweets)
+            writer.write_page(kept_tweets, data_entries, max_id, tweet_count, new_tweets[0].id)
+
+            # print number processed so far
+            print("Downloaded [%d] tweets so far." % tweet_count)
+
+        except tweepy.TweepError as e:
+            print("Something went wrong: " + str(e))
+            return tweet_count
+
+    if checkpoint is not None:
+        checkpoint.finish()
+    return tweet_count
+
+
+def enrich_page(tweets, fields=None):
+    """
+    Turn one page of tweets into data entries. Runs on an enrichment worker.
+
+    :param tweets: list of tweepy Status objects
+    :param fields: optional iterable of the data entry fields to extract, all of them by default
+    :return: tuple (list of data entries, seconds spent)
+    """
+    start = time.perf_counter()
+    data_entries = twitter_util.search_results_to_data_entries(tweets, fields)
+    return data_entries, time.perf_counter() - start
+
+
+def crawl_pipelined(api, query, writer, max_tweets=MAX_TWEETS, num_workers=2, use_processes=False,
+                    max_pending=MAX_PENDING_PAGES, fields=None, tweet_filter=None):
+    """
+    Same as crawl(), but fetching, enriching and writing overlap instead of running one after the other.
+
+    A fetcher thread pages backwards through the search results and hands each page to a pool of enrichment workers.
+    The pending pages go through a bounded queue, in the order they were fetched, so the calling thread hands them to
+    writer in the same order crawl() would. At most max_pending pages are in flight at any time; when the writer falls
+    behind, the fetcher blocks, so memory stays bounded no matter how long the crawl.
+
+    :param api: tweepy API object
+    :param query: string, query to send to the API
+    :param writer: PageWriter. The crawl starts from the cursor of its checkpoint, if it has one, and time spent is
+                   charged to the "fetch", "enrich" and "write" stages of its stats. The enrich time is the sum over
+                   all workers.
+    :param max_tweets: stop after this many tweets
+    :param num_workers: number of enrichment workers
+    :param use_processes: if True, enrich in worker processes instead of threads. TextBlob is pure python, so threads
+                          only overlap enrichment with network time, processes also use more than one core.
+    :param max_pending: maximum number of pages fetched but not yet written
+    :param fields: optional iterable of the data entry fields to write, all of them by default
+    :param tweet_filter: optional TweetFilter, applied by the fetcher, so that only the tweets it keeps are handed to
+                         the enrichment workers
+    :return: number of tweets downloaded
+    """
+    stats = writer.stats
+    checkpoint = writer.checkpoint
+    fields = twitter_util.project_fields(fields)
+    lang = tweet_filter.lang if tweet_filter is not None else None
+
+    start_max_id = -1
+    tweet_count = 0
+    if checkpoint is not None:
+        start_max_id = checkpoint.max_id
+        tweet_count = checkpoint.tweet_count
+
+    executor = ProcessPoolExecutor(num_workers) if use_processes else ThreadPoolExecutor(num_workers)
+    pending = queue.Queue(maxsize=max_pending)
+    stopped = threading.Event()
+
+    # whether the crawl reached its end, as opposed to failing part way through
+    complete = [False]
+
+    def fetch():
+        max_id = start_max_id
+        fetch_count = tweet_count
+        try:
+            while fetch_count < max_tweets and not stopped.is_set():
+                with stats.time("fetch"):
+                    new_tweets = search_page(api, query, max_id, lang)
+                stats.count("fetch", len(new_tweets))
 
                 # no more tweets found, exit
                 if not new_tweets:
                     print("No more tweets found, exiting.")
                     break
 
-                # save all these tweets to file
-                data_entries = twitter_util.search_results_to_data_entries(new_tweets)
-                for entry in data_entries:
-                    f.write(json.dumps(entry) + '\n')
-                f.flush()
-
                 # update variables - the last tweet of the result set is the oldest tweet
                 max_id = new_tweets[-1].id
-                tweetCount += len(new_tweets)
+                fetch_count += len(new_tweets)
 
-                # print number processed so far
-                print("Downloaded [%d] tweets so far." % tweetCount)
+                kept_tweets = list(filter_page(new_tweets, tweet_filter, stats))
+                future = executor.submit(enrich_page, kept_tweets, fields)
+                # blocks while max_pending pages are waiting to be written
+                pending.put((future, kept_tweets, max_id, new_tweets[0].id, len(new_tweets)))
+            complete[0] = not stopped.is_set()
+        except tweepy.TweepError as e:
+            print("Something went wrong: " + str(e))
+        finally:
+            pending.put(None)
 
-            except tweepy.TweepError as e:
-                print("Something went wrong: " + str(e))
+    fetcher = threading.Thread(target=fetch, daemon=True)
+    fetcher.start()
+
+    finished = False
+    try:
+        while True:
+            item = pending.get()
+            if item is None:
+                finished = True
                 break
 
-    print("Downloaded [%d] tweets. Saved to %s" % (tweetCount, output_filepath))
+            future, kept_tweets, page_max_id, page_newest_id, page_size = item
+            data_entries, seconds = future.result()
+            stats.add("enrich", seconds, len(data_entries))
+            tweet_count += page_size
+            writer.write_page(kept_tweets, data_entries, page_max_id, tweet_count, page_newest_id)
+
+            # print number processed so far
+            print("Downloaded [%d] tweets so far." % tweet_count)
+    finally:
+        # on error, unblock the fetcher and throw away whatever it already fetched
+        stopped.set()
+        while not finished:
+            item = pending.get()
+            if item is None:
+                finished = True
+            else:
+                item[0].cancel()
+        fetcher.join()
+        executor.shutdown()
+
+    if checkpoint is not None and complete[0]:
+        checkpoint.finish()
+    return tweet_count
+
+
+class QueryCrawl:
+    """
+    The state of the crawl of one query in a batch.
+
+    :param raw_query: string, the space separated query the user entered
+    :param output_filepath: string, file to write the data entries to
+    :param max_tweets: stop after this many tweets
+    :param checkpoint: optional Checkpoint to resume from. A new one is started otherwise.
+    :param keep_archive: if True, also keep a compressed archive of the raw tweets
+    :param keep_columnar: if True, also write the data entries in the columnar format (see columnar.py)
+    :param fields: optional iterable of the data entry fields to write, all of them by default
+    :param tweet_filter: optional TweetFilter, only the tweets it keeps are enriched and written
+    :param output_format: string, format of the output file (see serializers.py). A resumed crawl keeps the format of
+                          its output file.
+    :param store_settings: optional string, Django settings module of a database to also write the data entries to,
+                           see tweet_store.py
+    """
+    def __init__(self, raw_query, output_filepath, max_tweets=MAX_TWEETS, checkpoint=None, keep_archive=False,
+                 fields=None, tweet_filter=None, keep_columnar=False, output_format="json", store_settings=None):
+        self.raw_query = raw_query
+        self.query = build_query(raw_query, tweet_filter)
+        self.tweet_filter = tweet_filter
+        self.output_filepath = output_filepath
+        self.max_tweets = max_tweets
+        self.writer = None
+        self.keep_archive = keep_archive
+        self.keep_columnar = keep_columnar
+        self.serializer = detect_path_format(output_filepath, output_format)
+        self.store_writer = StoreWriter(raw_query, store_settings) if store_settings is not None else None
+        self.fields = twitter_util.project_fields(fields)
+        if checkpoint is None:
+            checkpoint = new_checkpoint(raw_query, output_filepath, self.fields, tweet_filter)
+        self.checkpoint = checkpoint
+
+        # all tweets have an id > 0, where higher ids are further back in time
+        self.max_id = checkpoint.max_id
+        self.tweet_count = checkpoint.tweet_count
+        self.done = False
+        self.error = None
+        self.finished_after = None
+
+    def crawl_page(self, api, stats):
+        """
+        Fetch, enrich and write one page of results. Sets done when there is nothing left to fetch.
+
+        :param api: tweepy API object
+        :param stats: StageStats
+        """
+        if self.writer is None:
+            self.writer = PageWriter.open(self.checkpoint, self.serializer, self.keep_archive, self.keep_columnar,
+                                          self.store_writer, stats)
+
+        try:
+            with stats.time("fetch"):
+                new_tweets = search_page(api, self.query, self.max_id,
+                                         self.tweet_filter.lang if self.tweet_filter is not None else None)
+            stats.count("fetch", len(new_tweets))
+        except tweepy.TweepError as e:
+            self.error = e
+            new_tweets = []
+
+        if new_tweets:
+            kept_tweets = filter_page(new_tweets, self.tweet_filter, stats)
+            with stats.time("enrich", len(kept_tweets)):
+                data_entries = twitter_util.search_results_to_data_entries(kept_tweets, self.fields)
+
+            # the last tweet of the result set is the oldest tweet
+            self.max_id = new_tweets[-1].id
+            self.tweet_count += len(new_tweets)
+            self.writer.write_page(kept_tweets, data_entries, self.max_id, self.tweet_count, new_tweets[0].id)
+
+        if not new_tweets or self.tweet_count >= self.max_tweets:
+            self.done = True
+            self.finished_after = stats.elapsed()
+            self.writer.close()
+            if self.error is None:
+                self.checkpoint.finish()
+
+    def fail(self, error, stats):
+        """
+        Give up on the crawl after an unexpected error. The checkpoint is left unfinished, so it can be resumed.
+
+        :param error: the exception
+        :param stats: StageStats
+        """
+        self.error = error
+        self.done = True
+        self.finished_after = stats.elapsed()
+        if self.writer is not None:
+            try:
+                self.writer.close()
+            except Exception:
+                # already failing, the first error is the one worth reporting
+                pass
+
+    def succeeded(self):
+        """
+        :return: True if the crawl ran to the end without an error
+        """
+        return self.done and self.error is None
+
+    def elapsed_text(self):
+        """
+        :return: string, time the crawl took, for reports
+        """
+        if self.finished_after is None:
+            return "unfinished"
+        return "%.1fs" % self.finished_after
+
+
+def crawl_batch(api, crawls, bucket=None, concurrency=BATCH_CONCURRENCY, stats=None):
+    """
+    Crawl many queries at once, on one shared rate limit budget.
+
+    Queries take turns: the crawl at the front of the line fetches one page, then goes to the back of the line. Every
+    page request first takes a token from bucket, so all the queries together stay under the app's quota, instead of
+    each one sleeping on the rate limit on its own. Up to `concurrency` pages are being fetched or enriched at once,
+    never two pages of the same query, so each output file is still written newest first.
+
+    :param api: tweepy API object
+    :param crawls: list of QueryCrawl
+    :param bucket: TokenBucket, defaults to one sized to the search endpoint's window
+    :param concurrency: number of worker threads
+    :param stats: optional StageStats
+    :return: list of QueryCrawl, the same as crawls
+    """
+    if bucket is None:
+        bucket = TokenBucket()
+    if stats is None:
+        stats = StageStats()
+
+    ready = collections.deque(crawls)
+    condition = threading.Condition()
+    in_flight = [0]
+
+    def work():
+        # tweepy keeps the response of the last request on the API object, so every worker needs its own, for
+        # bucket.observe_response to see the rate limit headers of its own requests rather than another worker's
+        worker_api = copy.copy(api)
+        while True:
+            with condition:
+                # wait for a crawl to take a turn, unless nothing is left at all
+                while not ready and in_flight[0] > 0:
+                    condition.wait()
+                if not ready:
+                    return
+                crawl_state = ready.popleft()
+                in_flight[0] += 1
+
+            try:
+                with stats.time("wait"):
+                    bucket.acquire()
+                crawl_state.crawl_page(worker_api, stats)
+                bucket.observe_response(getattr(worker_api, "last_response", None))
+            except Exception as e:
+                # an error in one query (a full disk, a bad page) must not take the worker, or the other queries, down
+                crawl_state.fail(e, stats)
+            finally:
+                with condition:
+                    in_flight[0] -= 1
+                    if not crawl_state.done:
+                        ready.append(crawl_state)
+                    condition.notify_all()
+
+            if crawl_state.done:
+                print("Finished '%s': [%d] tweets after %s." % (crawl_state.raw_query, crawl_state.tweet_count,
+                                                                crawl_state.elapsed_text()))
+
+    workers = [threading.Thread(target=work, daemon=True) for _ in range(concurrency)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    return crawls
+
+
+def read_batch_file(path):
+    """
+    Read a batch file, one query per line. Blank lines and lines starting with # are ignored.
+    :param path: string, path to the batch file
+    :return: list of strings
+    """
+    with open(path, "r") as f:
+        lines = [line.strip() for line in f.readlines()]
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+if __name__ == "__main__":
+    # command line parsing
+    parser = argparse.ArgumentParser(description="Preprocess CSV files")
+    query_group = parser.add_mutually_exclusive_group(required=True)
+    query_group.add_argument("-q", "--query", help="Specify the query string to use")
+    query_group.add_argument("-b", "--batch", help="Specify a file of queries to crawl together, one per line")
+    parser.add_argument("-o", "--output", help="Specify output file path", required=True)
+    parser.add_argument("-w", "--workers", help="Number of enrichment workers running alongside the fetcher, "
+                                                "0 to fetch and enrich one page at a time", type=int, default=0)
+    parser.add_argument("--processes", help="Use worker processes instead of threads for enrichment",
+                        action="store_true")
+    parser.add_argument("-r", "--resume", help="Continue the last unfinished crawl of the query (or of each query "
+                                               "in the batch) in the output directory", action="store_true")
+    parser.add_argument("-a", "--archive", help="Also keep a compressed archive of the raw tweets, next to the "
+                                                "output file", action="store_true")
+    parser.add_argument("-c", "--concurrency", help="Number of pages fetched at once in batch mode", type=int,
+                        default=BATCH_CONCURRENCY)
+    parser.add_argument("-f", "--fields", help="Comma separated data entry fields to write, eg. "
+                                               "\"cleaned,created_at,polarity\". All of them by default. TextBlob "
+                                               "only runs for the fields that need it.",
+                        type=lambda s: s.split(","), default=None)
+    parser.add_argument("--cache", help="Path of an enrichment cache file, shared across runs, so that repeated "
+                                        "texts only go through TextBlob once")
+    parser.add_argument("--cache-size", help="Maximum number of enrichment results kept in the cache file",
+                        type=int, default=MAX_DISK_ENTRIES)
+    parser.add_argument("--sentiment", help="Sentiment backend: TextBlob, or the batch lexicon scorer, which is "
+                                            "faster and gives the same scores (see lexicon_sentiment.py)",
+                        choices=twitter_util.SENTIMENT_BACKENDS, default="textblob")
+    parser.add_argument("--near-duplicates", help="Group near-duplicate tweets into clusters, only enrich the first "
+                                                  "tweet of each, and record the cluster on every data entry",
+                        action="store_true")
+    parser.add_argument("--max-clusters", help="Maximum number of near-duplicate clusters kept in memory", type=int,
+                        default=MAX_CLUSTERS)
+    parser.add_argument("--lang", help="Language of the tweets to keep, \"all\" for every language", default=LANG)
+    parser.add_argument("--min-retweets", help="Only keep tweets with at least this many retweets", type=int)
+    parser.add_argument("--source", help="Only keep tweets from this source, eg. \"Twitter for iPhone\". May be "
+                                         "given more than once.", action="append", dest="sources")
+    parser.add_argument("--match", help="Only keep tweets whose raw text contains this regular expression")
+    parser.add_argument("--hashtag", help="Only keep tweets with this hashtag. May be given more than once, to keep "
+                                          "tweets with any of them.", action="append", dest="hashtags")
+    parser.add_argument("--min-followers", help="Only keep tweets from authors with at least this many followers",
+                        type=int)
+    parser.add_argument("--max-followers", help="Only keep tweets from authors with at most this many followers",
+                        type=int)
+    parser.add_argument("--format", help="Format of the output file, see serializers.py. A resumed crawl keeps the "
+                                         "format of its output file.", choices=FORMATS, default="json",
+                        dest="output_format")
+    parser.add_argument("--columnar", help="Also write the data entries in the columnar format, next to the output "
+                                           "file, for faster analysis", action="store_true")
+    parser.add_argument("--store", help="Also write the tweets to the tweet store of the tweety app, in the database "
+                                        "of its settings (see tweet_store.py)", action="store_true")
+    parser.add_argument("--store-settings", help="Django settings module of the tweet store database",
+                        default=SETTINGS_MODULE)
+    args = parser.parse_args()
+    try:
+        fields = twitter_util.project_fields(args.fields)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.near_duplicates and args.processes:
+        parser.error("--near-duplicates needs the index in one process, it can't be used with --processes")
+    if args.store and fields != twitter_util.DATA_FIELDS:
+        parser.error("--store needs every data entry field, it can't be used with --fields")
+    store_settings = args.store_settings if args.store else None
+    try:
+        get_serializer(args.output_format)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        tweet_filter = TweetFilter(lang=None if args.lang == "all" else args.lang, min_retweets=args.min_retweets,
+                                   sources=args.sources, pattern=args.match, hashtags=args.hashtags,
+                                   min_followers=args.min_followers, max_followers=args.max_followers)
+    except re.error as e:
+        parser.error("invalid --match pattern: " + str(e))
+
+    # get access to twitter API object
+    api = twitter_util.create_api(KEYPATH)
+    if not api:
+        print("Can't Authenticate")
+        sys.exit(-1)
+
+    stats = StageStats()
+    twitter_util.set_sentiment_backend(args.sentiment)
+    cache = None
+    if args.cache:
+        cache = EnrichmentCache(path=args.cache, max_disk_entries=args.cache_size)
+        twitter_util.set_enrichment_cache(cache)
+    index = None
+    if args.near_duplicates:
+        index = NearDuplicateIndex(max_clusters=args.max_clusters)
+        twitter_util.set_near_duplicate_index(index)
+
+    if args.batch:
+        batch = []
+        for raw_query in read_batch_file(args.batch):
+            resume_from = find_checkpoint(args.output, raw_query) if args.resume else None
+            if resume_from is not None:
+                print("Resuming '%s' from [%d] tweets." % (raw_query, resume_from.tweet_count))
+                batch.append(QueryCrawl(raw_query, resume_from.output_filepath, checkpoint=resume_from,
+                                        keep_archive=args.archive, fields=fields, tweet_filter=tweet_filter,
+                                        keep_columnar=args.columnar, output_format=args.output_format,
+                                        store_settings=store_settings))
+            else:
+                batch.append(QueryCrawl(raw_query, build_output_filepath(args.output, raw_query),
+                                        keep_archive=args.archive, fields=fields, tweet_filter=tweet_filter,
+                                        keep_columnar=args.columnar, output_format=args.output_format,
+                                        store_settings=store_settings))
+        crawl_batch(api, batch, concurrency=args.concurrency, stats=stats)
+
+        for crawl_state in batch:
+            if crawl_state.error:
+                status = "failed: " + str(crawl_state.error)
+            else:
+                status = "saved to " + crawl_state.output_filepath
+            # a failed crawl left a partial file behind, it gets cataloged once a resumed crawl finishes it
+            if crawl_state.succeeded():
+                catalog.register_crawl(crawl_state.checkpoint)
+            print("'%s': [%d] tweets in %s, %s" % (crawl_state.raw_query, crawl_state.tweet_count,
+                                                  crawl_state.elapsed_text(), status))
+        print("Downloaded [%d] tweets for %d queries in %.1fs." % (sum(c.tweet_count for c in batch), len(batch),
+                                                                   stats.elapsed()))
+        for line in stats.report():
+            print(line)
+        for line in tweet_filter.report():
+            print(line)
+        if cache is not None:
+            print(cache.report())
+        if index is not None:
+            print(index.report())
+        if args.store:
+            print("store: %d tweets written, %d of them new" % (sum(c.store_writer.written for c in batch),
+                                                               sum(c.store_writer.new for c in batch)))
+        sys.exit(0)
+
+    checkpoint = find_checkpoint(args.output, args.query) if args.resume else None
+    if checkpoint is not None:
+        print("Resuming from [%d] tweets in %s" % (checkpoint.tweet_count, checkpoint.output_filepath))
+    else:
+        if args.resume:
+            print("No unfinished crawl of '%s' to resume, starting a new one." % args.query)
+        output_filepath = build_output_filepath(args.output, args.query)
+        checkpoint = new_checkpoint(args.query, output_filepath, fields, tweet_filter)
+    output_filepath = checkpoint.output_filepath
+    query = checkpoint.query
+
+    store_writer = StoreWriter(args.query, store_settings) if args.store else None
+    serializer = detect_path_format(output_filepath, args.output_format)
+    with PageWriter.open(checkpoint, serializer, args.archive, args.columnar, store_writer, stats) as page_writer:
+        if args.workers > 0:
+            tweetCount = crawl_pipelined(api, query, page_writer, num_workers=args.workers,
+                                         use_processes=args.processes, fields=fields, tweet_filter=tweet_filter)
+        else:
+            tweetCount = crawl(api, query, page_writer, fields=fields, tweet_filter=tweet_filter)
+    catalog.register_crawl(checkpoint)
+
+    print("Downloaded [%d] tweets in %.1fs. Saved to %s" % (tweetCount, stats.elapsed(), output_filepath))
+    for line in stats.report():
+        print(line)
+    for line in tweet_filter.report():
+        print(line)
+    if cache is not None:
+        print(cache.report())
+    if index is not None:
+        print(index.report())
+    if store_writer is not None:
+        print(store_writer.report())
@@ -3,67 +3,165 @@ twitter_trends.py
 
 Fetch data from the Twitter API about current trending topics on Twitter.
 
-Right now I only search for trends in locations in Canada.
+By default I only search for trends in locations in Canada, other countries can be given with --countries.
+
+The list of locations that have trends (trends/available) hardly ever changes, so it is cached on disk and only fetched
+again once the cache is older than --cache-ttl hours. The trends of the locations are fetched concurrently, while
+staying under the trends/place rate limit.
 """
 import sys
 import argparse
 import datetime
 import os
 import json
-import tweepy
+import time
+from concurrent.futures import ThreadPoolExecutor
+import catalog
+import twitter_util
+from rate_limit import TokenBucket, TRENDS_REQUESTS_PER_WINDOW
+from serializers import FORMATS, get_serializer
 
 KEYPATH = "keys/auth"
 FILENAME = "trends"
+LOCATIONS_CACHE = ".trends-available.json"
+LOCATIONS_CACHE_TTL_HOURS = 24
+CONCURRENCY = 8
+
+
+def get_available_locations(api, cache_path, ttl_seconds):
+    """
+    Return the locations that Twitter keeps trending topics on, from the cache file if it is recent enough.
+
+    :param api: tweepy API object
+    :param cache_path: string, path of the cache file
+    :param ttl_seconds: float, maximum age of the cache file
+    :return: list of dictionaries, as returned by trends_available()
+    """
+    if os.path.exists(cache_path) and time.time() - os.path.getmtime(cache_path) < ttl_seconds:
+        with open(cache_path, "r") as f:
+            return json.loads(f.read())
+
+    locations = api.trends_available()
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(json.dumps(locations))
+    os.replace(tmp_path, cache_path)
+    return locations
+
+
+def select_woeids(locations, country_codes):
+    """
+    Get the woeids of the locations in the given countries. Countries themselves (whose parent is the whole world)
+    are left out, only the towns in them are kept.
+
+    :param locations: list of dictionaries, as returned by trends_available()
+    :param country_codes: list of country codes, eg. ["CA", "US"]
+    :return: list of woeids
+    """
+    woeids = []
+    for available_trend in locations:
+        if available_trend["countryCode"] in country_codes and available_trend["parentid"] != 1:
+            woeids.append(available_trend["woeid"])
+    return woeids
+
+
+def fetch_trend_data(api, woeid, bucket):
+    """
+    Retrieve the trending topics for one woeid.
+
+    :param api: tweepy API object
+    :param woeid: woeid of the location
+    :param bucket: TokenBucket, a token is taken before the request
+    :return: dictionary, trend data
+    """
+    bucket.acquire()
+    trends = api.trends_place(woeid)[0]
+
+    return {
+        "woeid": trends["locations"][0]["woeid"],
+        "location_name": trends["locations"][0]["name"],
+        "starting": trends["as_of"],
+        "trend_list": list(map(lambda t: t["name"].lower(), trends["trends"]))
+    }
+
+
+def fetch_all_trends(api, woeids, concurrency=CONCURRENCY, bucket=None, errors=None):
+    """
+    Retrieve the trending topics for every woeid, with up to `concurrency` requests in flight at once. A woeid whose
+    trends can't be fetched is skipped, the others are still fetched.
+
+    :param api: tweepy API object
+    :param woeids: list of woeids
+    :param concurrency: maximum number of concurrent requests
+    :param bucket: TokenBucket shared by all requests, defaults to one sized to the trends/place window
+    :param errors: optional dictionary, the exception of every skipped woeid is put in it, by woeid
+    :return: generator of trend data dictionaries, in the same order as woeids
+    """
+    if bucket is None:
+        bucket = TokenBucket(TRENDS_REQUESTS_PER_WINDOW)
+
+    def fetch(woeid):
+        try:
+            return fetch_trend_data(api, woeid, bucket), None
+        except Exception as e:
+            return None, e
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        for woeid, (trend_data, error) in zip(woeids, executor.map(fetch, woeids)):
+            if error is not None:
+                if errors is not None:
+                    errors[woeid] = error
+                continue
+            yield trend_data
+
 
 if __name__ == "__main__":
     # command line parsing
     parser = argparse.ArgumentParser(description="Preprocess CSV files")
     parser.add_argument("-o", "--output", help="Specify output file path", required=True)
+    parser.add_argument("--countries", help="Country codes of the locations to fetch trends for", nargs="+",
+                        default=["CA"])
+    parser.add_argument("-c", "--concurrency", help="Number of trends requests in flight at once", type=int,
+                        default=CONCURRENCY)
+    parser.add_argument("--cache-ttl", help="Hours before the cached list of locations is fetched again", type=float,
+                        default=LOCATIONS_CACHE_TTL_HOURS)
+    parser.add_argument("--format", help="Format of the output file, see serializers.py", choices=FORMATS,
+                        default="json", dest="output_format")
     args = parser.parse_args()
+    try:
+        serializer = get_serializer(args.output_format)
+    except ValueError as e:
+        parser.error(str(e))
 
     output_dir = args.output
     timestamp = datetime.datetime.now().strftime("%Y-%m-%d")
     output_filepath = os.path.join(output_dir, FILENAME + "-" + timestamp)
 
-    # read auth details from private key file
-    with open(KEYPATH, "r") as auth_file:
-        auth_lines = auth_file.readlines()
-        ACCESS_TOKEN = auth_lines[0].strip().split("=")[1]
-        ACCESS_SECRET = auth_lines[1].strip().split("=")[1]
-        CONSUMER_KEY = auth_lines[2].strip().split("=")[1]
-        CONSUMER_SECRET = auth_lines[3].strip().split("=")[1]
-
-    # setup auth
-    auth = tweepy.AppAuthHandler(CONSUMER_KEY, CONSUMER_SECRET)
-
     # get access to twitter API object
-    api = tweepy.API(auth, wait_on_rate_limit=True, wait_on_rate_limit_notify=True)
+    api = twitter_util.create_api(KEYPATH)
     if not api:
         print("Can't Authenticate")
         sys.exit(-1)
 
     # get available woeids that twitter keeps trending topics on
-    ca_woeids = []
-    available_trends = api.trends_available()
-    for available_trend in available_trends:
-        if available_trend["countryCode"] == "CA" and available_trend["parentid"] != 1:
-            ca_woeids.append(available_trend["woeid"])
+    available_trends = get_available_locations(api, os.path.join(output_dir, LOCATIONS_CACHE),
+                                               args.cache_ttl * 3600)
+    woeids = select_woeids(available_trends, args.countries)
 
     # retrieve the trending topics for each of these woeids
-    with open(output_filepath, "w") as f:
-        ca_trends = []
-        for woeid in ca_woeids:
-            trends = api.trends_place(woeid)[0]
-
-            trend_data = {
-                "woeid": trends["locations"][0]["woeid"],
-                "location_name": trends["locations"][0]["name"],
-                "starting": trends["as_of"],
-                "trend_list": list(map(lambda t: t["name"].lower(), trends["trends"]))
-            }
-
+    start = time.perf_counter()
+    errors = {}
+    with open(output_filepath, "wb") as f:
+        f.write(serializer.header)
+        for trend_data in fetch_all_trends(api, woeids, args.concurrency, errors=errors):
             # write out to file
-            f.write(json.dumps(trend_data) + "\n")
+            f.write(serializer.dumps(trend_data))
             f.flush()
+    catalog.register(output_filepath, "trends")
 
-    print("Completed Fetching Twitter Trends")
+    print("Completed Fetching Twitter Trends for %d locations in %.1fs" % (len(woeids) - len(errors),
+                                                                          time.perf_counter() - start))
+    for woeid, error in errors.items():
+        print("Couldn't fetch the trends of woeid %d: %s" % (woeid, error), file=sys.stderr)
+    if errors:
+        sys.exit(1)
@@ -3,28 +3,110 @@ twitter_util.py
 
 Utilities for twitter api functions.
 """
+import collections
+import functools
 import html
 import re
+import tweepy
 from textblob import TextBlob
 
+import lexicon_sentiment
+from batching import chunks, map_chunks
+from records import CLUSTER_FIELDS, DATA_FIELDS, SENTIMENT_FIELDS, TAG_FIELDS
+
+ENRICH_CHUNK_SIZE = 200
+SENTIMENT_BACKENDS = ("textblob", "lexicon")
+
+# process-wide EnrichmentCache used by text_features, see set_enrichment_cache
+_enrichment_cache = None
+# process-wide sentiment backend used by text_features, see set_sentiment_backend
+_sentiment_backend = "textblob"
+# process-wide NearDuplicateIndex used when building data entries, see set_near_duplicate_index
+_near_duplicate_index = None
+
+
+##############
+# API Access #
+##############
+def read_auth_keys(keypath):
+    """
+    Read the private key file. The file has 4 lines, of the form NAME=value, in the order:
+    ACCESS_TOKEN, ACCESS_SECRET, CONSUMER_KEY, CONSUMER_SECRET.
+
+    :param keypath: string, path to the key file
+    :return: dictionary of key name to value
+    """
+    keys = {}
+    with open(keypath, "r") as auth_file:
+        for line in auth_file.readlines():
+            line = line.strip()
+            if "=" in line:
+                name, value = line.split("=", 1)
+                keys[name] = value
+    return keys
+
+
+def create_api(keypath):
+    """
+    Authenticate with application-only auth and return a tweepy API object that waits on rate limits.
+
+    :param keypath: string, path to the key file
+    :return: tweepy.API
+    """
+    keys = read_auth_keys(keypath)
+    auth = tweepy.AppAuthHandler(keys["CONSUMER_KEY"], keys["CONSUMER_SECRET"])
+    return tweepy.API(auth, wait_on_rate_limit=True, wait_on_rate_limit_notify=True)
+
 
 #################
 # Data Handling #
 #################
-def search_results_to_data_entries(results):
+# how each metadata field of a data entry is extracted from a tweet, in the order of records.METADATA_FIELDS
+METADATA_EXTRACTORS = collections.OrderedDict([
+    ("raw", lambda tweet: tweet._json["full_text"]),
+    ("cleaned", lambda tweet: clean_tweet(tweet._json["full_text"])),
+    ("created_at", lambda tweet: str(tweet.created_at)),
+    ("author_num_followers", lambda tweet: tweet.author.followers_count),
+    ("author_num_favourites", lambda tweet: tweet.author.favourites_count),
+    ("hashtags", lambda tweet: list(map(lambda tag: tag["text"].lower(), tweet.entities["hashtags"]))),
+    ("mentions", lambda tweet: list(map(lambda tag: tag["screen_name"].lower(), tweet.entities["user_mentions"]))),
+    ("retweets", lambda tweet: tweet.retweet_count),
+    ("source", lambda tweet: tweet.source),
+])
+
+
+def project_fields(fields):
+    """
+    Check a selection of data entry fields, and put it in data entry order.
+
+    :param fields: iterable of field names (see DATA_FIELDS), or None for all of them
+    :return: tuple of field names
+    """
+    if fields is None:
+        return DATA_FIELDS
+    fields = set(fields)
+    unknown = fields - set(DATA_FIELDS)
+    if unknown:
+        raise ValueError("Unknown data entry fields: %s" % ", ".join(sorted(unknown)))
+    return tuple(field for field in DATA_FIELDS if field in fields)
+
+
+def search_results_to_data_entries(results, fields=None):
     """
     Given the results of a tweepy search(), extract the most relevant features of this data.
     Specifically, we return a list of data entries.
 
     :param results: SearchResults object, the return value of tweepy's, API.search()
+    :param fields: optional iterable of the data entry fields to extract, all of them by default
     """
+    fields = project_fields(fields)
     data_entries = []
     for tweet in results:
-        data_entries.append(tweet_to_data_entry(tweet))
+        data_entries.append(tweet_to_data_entry(tweet, fields))
     return data_entries
 
 
-def tweet_to_data_entry(tweet):
+def tweet_to_data_entry(tweet, fields=None):
     """
     Takes a tweet, extracts the relevant fields, and return a data entry, a light-weight version of the tweet.
     Also adds extra features from the text, run through TextBlob.
@@ -48,48 +130,317 @@ def tweet_to_data_entry(tweet):
         "tags": TextBlob PoS tagging, list of tuples
     }
 
+    When only some fields are asked for, the data entry only has those, and only the stages they need are run: no
+    TextBlob at all without "polarity", "subjectivity" or "tags", and no PoS tagging without "tags".
+
+    With a near-duplicate index set, the data entry also has "cluster_id" and "cluster_size", and its text features
+    are the ones of the first tweet of its cluster.
+
     :param tweet: a single "Status" object, representing a tweet.
+    :param fields: optional iterable of the data entry fields to extract, all of them by default
     :return: dictionary, data entry
     """
-    # extract text from the tweet
-    tweet_text = tweet._json["full_text"]
-    cleaned_tweet_text = clean_tweet(tweet_text)
-
-    # extract other metadata from the tweet
-    creation_data = str(tweet.created_at)
-    author_num_followers = tweet.author.followers_count
-    author_num_favourites = tweet.author.favourites_count
-    hashtags = list(map(lambda tag: tag["text"].lower(), tweet.entities["hashtags"]))
-    mentions = list(map(lambda tag: tag["screen_name"].lower(), tweet.entities["user_mentions"]))
-    retweets = tweet.retweet_count
-    source = tweet.source
-
-    # get other features from the tweet text using TextBlob
-    tb = TextBlob(cleaned_tweet_text)
-    polarity = tb.sentiment.polarity
-    subjectivity = tb.sentiment.subjectivity
-    tags = tb.tags
-
-    # create the data entry
-    data_field_names = ["raw", "cleaned", "created_at", "author_num_followers", "author_num_favourites", "hashtags",
-                        "mentions", "retweets", "source", "polarity", "subjectivity", "tags"]
-    data_fields = [tweet_text, cleaned_tweet_text, creation_data, author_num_followers, author_num_favourites, hashtags,
-                   mentions, retweets, source, polarity, subjectivity, tags]
+    fields = project_fields(fields)
+    data_entry = tweet_to_metadata(tweet, fields)
+    sentiment, tags = text_stages(fields)
+    index = _near_duplicate_index
+    if index is not None:
+        cluster, size = index.assign(cleaned_text_of(tweet, data_entry), tweet.id)
+        if sentiment or tags:
+            if not has_text_features(cluster.features, sentiment, tags):
+                cluster.features = text_features(cluster.text, sentiment, tags)
+            add_text_features(data_entry, cluster.features, fields)
+        add_cluster_fields(data_entry, cluster, size)
+    elif sentiment or tags:
+        features = text_features(cleaned_text_of(tweet, data_entry), sentiment, tags)
+        add_text_features(data_entry, features, fields)
+    return data_entry
 
-    data_entry = {}
-    for i in range(len(data_field_names)):
-        data_entry[data_field_names[i]] = data_fields[i]
 
+def tweet_to_metadata(tweet, fields=None):
+    """
+    The cheap part of tweet_to_data_entry: extract the text and metadata of a tweet, without running TextBlob.
+
+    :param tweet: a single "Status" object, representing a tweet.
+    :param fields: optional iterable of the data entry fields to extract, all of them by default
+    :return: dictionary, a data entry without the "polarity", "subjectivity" and "tags" fields
+    """
+    fields = project_fields(fields)
+    data_entry = {}
+    for name, extract in METADATA_EXTRACTORS.items():
+        if name in fields:
+            data_entry[name] = extract(tweet)
     return data_entry
 
 
+def text_stages(fields):
+    """
+    :param fields: tuple of data entry fields, from project_fields
+    :return: tuple (bool, bool), whether the fields need TextBlob sentiment, and PoS tags
+    """
+    return any(field in fields for field in SENTIMENT_FIELDS), any(field in fields for field in TAG_FIELDS)
+
+
+def cleaned_text_of(tweet, data_entry):
+    """
+    :return: string, the cleaned text of a tweet, taken from its data entry if it has it
+    """
+    if "cleaned" in data_entry:
+        return data_entry["cleaned"]
+    return clean_tweet(tweet._json["full_text"])
+
+
+def add_text_features(data_entry, features, fields):
+    """
+    Set the TextBlob fields of a data entry.
+
+    :param data_entry: dictionary, data entry from tweet_to_metadata
+    :param features: tuple (polarity, subjectivity, tags), from text_features
+    :param fields: tuple of data entry fields, from project_fields
+    """
+    for name, value in zip(SENTIMENT_FIELDS + TAG_FIELDS, features):
+        if name in fields:
+            data_entry[name] = value
+
+
+def has_text_features(features, sentiment, tags):
+    """
+    :param features: (polarity, subjectivity, tags) tuple, or None
+    :param sentiment: whether polarity and subjectivity are needed
+    :param tags: whether PoS tags are needed
+    :return: whether features has every part that is needed
+    """
+    if features is None:
+        return False
+    return not (sentiment and features[0] is None) and not (tags and features[2] is None)
+
+
+def set_near_duplicate_index(index):
+    """
+    Group near-duplicate tweets into clusters, for every data entry built by this process from now on. TextBlob only
+    runs on the first tweet of each cluster, and every data entry records its cluster in the CLUSTER_FIELDS.
+    The index lives in this process: data entries built by worker processes don't see it.
+
+    :param index: NearDuplicateIndex (see near_duplicates.py), or None to stop detecting near-duplicates
+    """
+    global _near_duplicate_index
+    _near_duplicate_index = index
+
+
+def add_cluster_fields(data_entry, cluster, size):
+    """
+    Record the near-duplicate cluster of a tweet on its data entry, after all the other fields.
+    :param data_entry: dictionary, data entry to update in place
+    :param cluster: Cluster of the tweet
+    :param size: int, size of the cluster with the tweet
+    """
+    data_entry["cluster_id"] = cluster.id
+    data_entry["cluster_size"] = size
+
+
+def set_enrichment_cache(cache):
+    """
+    Serve text_features from a cache, for every data entry built by this process from now on.
+    :param cache: EnrichmentCache (see enrich_cache.py), or None to stop caching
+    """
+    global _enrichment_cache
+    _enrichment_cache = cache
+
+
+def set_sentiment_backend(name):
+    """
+    Choose how polarity and subjectivity are computed, for every data entry built by this process from now on:
+        - "textblob": TextBlob's sentiment analysis, one text at a time (the default)
+        - "lexicon": LexiconSentiment (see lexicon_sentiment.py), the same lexicon and rules scored in batches
+    PoS tags always come from TextBlob. The enrichment cache only holds TextBlob results, so it isn't used with the
+    lexicon backend.
+
+    :param name: string, one of SENTIMENT_BACKENDS
+    """
+    global _sentiment_backend
+    if name not in SENTIMENT_BACKENDS:
+        raise ValueError("unknown sentiment backend %r, expected one of %s" % (name, ", ".join(SENTIMENT_BACKENDS)))
+    _sentiment_backend = name
+
+
+def text_features(cleaned_text, sentiment=True, tags=True):
+    """
+    Get features from the cleaned text of a tweet using TextBlob, or from the enrichment cache if one is set.
+
+    :param cleaned_text: string, cleaned tweet text
+    :param sentiment: whether to compute polarity and subjectivity
+    :param tags: whether to compute PoS tags
+    :return: tuple (polarity, subjectivity, tags), the features that weren't asked for may be None
+    """
+    if _enrichment_cache is None or _sentiment_backend != "textblob":
+        return compute_text_features(cleaned_text, sentiment, tags, _sentiment_backend)
+    if sentiment and tags:
+        return _enrichment_cache.get_or_compute(cleaned_text, compute_text_features)
+
+    # only complete results are cached, but a complete result serves any part of it
+    features = _enrichment_cache.get(cleaned_text)
+    if features is None:
+        features = compute_text_features(cleaned_text, sentiment, tags)
+    return features
+
+
+def compute_text_features(cleaned_text, sentiment=True, tags=True, backend="textblob"):
+    """
+    Same as text_features, never using the cache.
+
+    :param cleaned_text: string, cleaned tweet text
+    :param sentiment: whether to compute polarity and subjectivity
+    :param tags: whether to compute PoS tags
+    :param backend: string, sentiment backend, one of SENTIMENT_BACKENDS
+    :return: tuple (polarity, subjectivity, tags), the features that weren't asked for are None
+    """
+    if backend == "lexicon":
+        return text_features_chunk([cleaned_text], sentiment, tags, backend)[0]
+    tb = TextBlob(cleaned_text)
+    polarity, subjectivity = (tb.sentiment.polarity, tb.sentiment.subjectivity) if sentiment else (None, None)
+    return polarity, subjectivity, tb.tags if tags else None
+
+
+####################
+# Batch Enrichment #
+####################
+def text_features_chunk(cleaned_texts, sentiment=True, tags=True, backend="textblob"):
+    """
+    Compute the features of every text of a chunk. Runs on a worker process.
+    With the lexicon backend, the sentiment of the whole chunk is scored at once.
+
+    :param cleaned_texts: list of strings
+    :param sentiment: whether to compute polarity and subjectivity
+    :param tags: whether to compute PoS tags
+    :param backend: string, sentiment backend, one of SENTIMENT_BACKENDS
+    :return: list of (polarity, subjectivity, tags) tuples
+    """
+    if backend != "lexicon" or not sentiment:
+        return [compute_text_features(text, sentiment, tags) for text in cleaned_texts]
+    polarity, subjectivity = lexicon_sentiment.get_scorer().score(cleaned_texts)
+    all_tags = [TextBlob(text).tags if tags else None for text in cleaned_texts]
+    return [(float(p), float(s), t) for p, s, t in zip(polarity, subjectivity, all_tags)]
+
+
+def tweets_to_data_entries(tweets, num_workers=None, chunk_size=ENRICH_CHUNK_SIZE, fields=None):
+    """
+    Batch version of search_results_to_data_entries, for large crawls and offline reprocessing. The metadata is
+    extracted in this process, and only the cleaned texts are sent to a process pool for TextBlob. The data entries
+    are exactly the ones tweet_to_data_entry returns.
+
+    With an enrichment cache set, texts are looked up here first, and only the distinct texts that aren't cached are
+    sent to the pool. With a near-duplicate index set, tweets are clustered here too, and only the text of the first
+    tweet of each cluster is enriched. Without any TextBlob fields, no pool is started at all. The sentiment backend
+    is the one set with set_sentiment_backend, and the cache is only used with the textblob backend.
+
+    :param tweets: list or iterable of "Status" objects
+    :param num_workers: number of worker processes, defaults to the number of cores
+    :param chunk_size: number of tweets handed to a worker at a time
+    :param fields: optional iterable of the data entry fields to extract, all of them by default
+    :return: generator of data entries, in input order
+    """
+    fields = project_fields(fields)
+    sentiment, tags = text_stages(fields)
+    if not (sentiment or tags):
+        for tweet in tweets:
+            yield tweet_to_data_entry(tweet, fields)
+        return
+
+    backend = _sentiment_backend
+    cache = _enrichment_cache if backend == "textblob" else None
+
+    index = _near_duplicate_index
+
+    def work():
+        for chunk in chunks(tweets, chunk_size):
+            data_entries = [tweet_to_metadata(tweet, fields) for tweet in chunk]
+            texts = [cleaned_text_of(tweet, entry) for tweet, entry in zip(chunk, data_entries)]
+            assigned = None
+            clusters = {}
+            if index is not None:
+                # every tweet takes the features of the first text of its cluster
+                assigned = [index.assign(text, tweet.id) for tweet, text in zip(chunk, texts)]
+                texts = [cluster.text for cluster, _ in assigned]
+                clusters = dict((cluster.text, cluster) for cluster, _ in assigned)
+
+            if cache is None and assigned is None:
+                yield (data_entries, texts, None, texts, None), texts
+            else:
+                known = {}
+                for text in set(texts):
+                    features = clusters[text].features if text in clusters else None
+                    if not has_text_features(features, sentiment, tags):
+                        features = cache.get(text) if cache is not None else None
+                    known[text] = features
+                misses = [text for text, features in known.items() if features is None]
+                yield (data_entries, texts, known, misses, assigned), misses
+
+    function = functools.partial(text_features_chunk, sentiment=sentiment, tags=tags, backend=backend)
+    for (data_entries, texts, known, misses, assigned), features in map_chunks(function, work(), num_workers):
+        if known is not None:
+            for text, computed in zip(misses, features):
+                known[text] = computed
+                # only complete results are cached
+                if cache is not None and sentiment and tags:
+                    cache.put(text, computed)
+            features = [known[text] for text in texts]
+        for i, (entry, entry_features) in enumerate(zip(data_entries, features)):
+            add_text_features(entry, entry_features, fields)
+            if assigned is not None:
+                cluster, size = assigned[i]
+                cluster.features = entry_features
+                add_cluster_fields(entry, cluster, size)
+            yield entry
+
+
 ###################
 # String Cleaning #
 ###################
+URL_PATTERN = re.compile(r"http\S+")
+MENTION_PATTERN = re.compile(r"\@\w+")
+# a mention, or a newline. Newlines are removed before mentions, so a mention may have newlines anywhere in it
+NEWLINE_OR_MENTION_PATTERN = re.compile(r"\@\n*\w[\w\n]*|\n")
+
+
 def clean_tweet(s):
     """
     Take in a string representing the text field of a tweet, and clean it up.
 
+    Gives exactly the same result as clean_tweet_stepwise, in fewer passes over the string: steps that have nothing to
+    do are skipped, and newlines and mentions are removed together by a single regular expression. Hashtags and urls
+    keep their own passes, since removing "#" can make a url ("ht#tp://..."), and a url can run into a mention.
+
+    :param s: string to clean
+    :return: string: cleaned string
+    """
+    if s[0:2] == "RT":
+        s = s[s.find(":") + 2:]
+    if "&" in s:
+        s = html.unescape(s)
+    if "#" in s:
+        s = s.replace("#", "")
+    if "http" in s:
+        s = URL_PATTERN.sub("", s)
+    if "\n" in s:
+        s = NEWLINE_OR_MENTION_PATTERN.sub("", s) if "@" in s else s.replace("\n", "")
+    elif "@" in s:
+        s = MENTION_PATTERN.sub("", s)
+    return s.strip().lower()
+
+
+def clean_tweets(strings):
+    """
+    Batch version of clean_tweet.
+    :param strings: iterable of strings to clean
+    :return: list of cleaned strings, in input order
+    """
+    return [clean_tweet(s) for s in strings]
+
+
+def clean_tweet_stepwise(s):
+    """
+    Reference version of clean_tweet, one cleaning step at a time.
+
     :param s: string to clean
     :return: string: cleaned string
     """
@@ -147,7 +498,7 @@ def remove_mentions(s):
     :param s: string to clean
     :return: string: cleaned string
     """
-    return re.sub(r"\@\w+", "", s)
+    return MENTION_PATTERN.sub("", s)
 
 
 def remove_urls(s):
@@ -156,8 +507,7 @@ def remove_urls(s):
     :param s: string to clean
     :return: string: cleaned string
     """
-    cleaned_str = re.sub(r'http\S+', '', s)
-    return cleaned_str
+    return URL_PATTERN.sub("", s)
 
 
 def remove_newlines(s):
@@ -122,3 +122,14 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/2.0/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Tweety
+
+# Path of an sqlite file caching TextBlob results by tweet text, shared by every worker process and kept across
+# restarts. None to only cache in the memory of each process.
+TWEETY_ENRICHMENT_CACHE = None
+
+# Whether searches also write their tweets to the tweet store (see tweety/store.py), in the database above. Tweets that
+# an earlier search already stored are then read back instead of enriched again.
+TWEETY_STORE_TWEETS = False
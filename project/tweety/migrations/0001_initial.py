@@ -0,0 +1,61 @@
+# Generated by Django 2.2.28 on 2026-10-17 20:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Query',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.CharField(max_length=500, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Tweet',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('raw', models.TextField()),
+                ('cleaned', models.TextField()),
+                ('created_at', models.DateTimeField(db_index=True)),
+                ('author_num_followers', models.IntegerField()),
+                ('author_num_favourites', models.IntegerField()),
+                ('retweets', models.IntegerField()),
+                ('source', models.CharField(max_length=200)),
+                ('polarity', models.FloatField()),
+                ('subjectivity', models.FloatField()),
+                ('tags', models.TextField()),
+                ('queries', models.ManyToManyField(related_name='tweets', to='tweety.Query')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Mention',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('screen_name', models.CharField(db_index=True, max_length=50)),
+                ('tweet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mentions', to='tweety.Tweet')),
+            ],
+            options={
+                'unique_together': {('tweet', 'screen_name')},
+            },
+        ),
+        migrations.CreateModel(
+            name='Hashtag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.CharField(db_index=True, max_length=280)),
+                ('tweet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hashtags', to='tweety.Tweet')),
+            ],
+            options={
+                'unique_together': {('tweet', 'text')},
+            },
+        ),
+    ]
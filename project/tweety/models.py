@@ -1,3 +1,58 @@
 from django.db import models
 
-# Create your models here.
+
+class Tweet(models.Model):
+    """
+    A stored, enriched tweet: the fields of a data entry (see twitter/util.py), keyed by the tweet id, so that a tweet
+    found by several queries is stored and enriched once.
+    """
+    def __str__(self):
+        return self.cleaned
+
+    id = models.BigIntegerField(primary_key=True)
+    raw = models.TextField()
+    cleaned = models.TextField()
+    created_at = models.DateTimeField(db_index=True)
+    author_num_followers = models.IntegerField()
+    author_num_favourites = models.IntegerField()
+    retweets = models.IntegerField()
+    source = models.CharField(max_length=200)
+    polarity = models.FloatField()
+    subjectivity = models.FloatField()
+    # PoS tags, a JSON list of [word, tag] pairs
+    tags = models.TextField()
+    queries = models.ManyToManyField("Query", related_name="tweets")
+
+
+class Hashtag(models.Model):
+    def __str__(self):
+        return self.text
+
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="hashtags")
+    # lower case, without "#". A hashtag can take up all of a tweet but its "#".
+    text = models.CharField(max_length=280, db_index=True)
+
+    class Meta:
+        unique_together = ("tweet", "text")
+
+
+class Mention(models.Model):
+    def __str__(self):
+        return self.screen_name
+
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="mentions")
+    # lower case, without "@"
+    screen_name = models.CharField(max_length=50, db_index=True)
+
+    class Meta:
+        unique_together = ("tweet", "screen_name")
+
+
+class Query(models.Model):
+    """
+    A search query, and through Tweet.queries, every stored tweet it found.
+    """
+    def __str__(self):
+        return self.text
+
+    text = models.CharField(max_length=500, unique=True)
@@ -0,0 +1,200 @@
+"""
+store.py
+
+The tweet store: enriched tweets in the database (see models.py), keyed by tweet id, with their hashtags, mentions,
+and the queries that found them.
+
+Tweets are written in batches, with one bulk_create per table, and conflicts on the tweet id (or on a hashtag, mention
+or query link that is already there) are ignored, so ingesting the same tweet twice, from two overlapping queries or
+two processes at once, never stores it twice. ingest_tweets also looks the ids of a page up first, and only runs
+TextBlob on the tweets that aren't stored yet: the others are read back from the database.
+
+Usage:
+    data_entries = ingest_tweets(search_results, "tim hortons")
+    ingest_entries(zip(tweet_ids, data_entries), "tim hortons")
+    data_entries = query_data_entries("tim hortons")
+"""
+import datetime
+import json
+
+from django.db import transaction
+
+from .models import Hashtag, Mention, Query, Tweet
+from .twitter import util
+
+BATCH_SIZE = 500
+
+
+def parse_created_at(created_at):
+    """
+    :param created_at: string, date of a data entry, eg. "2018-06-06 20:07:10" (UTC)
+    :return: aware datetime
+    """
+    return datetime.datetime.fromisoformat(created_at).replace(tzinfo=datetime.timezone.utc)
+
+
+def format_created_at(created_at):
+    """
+    :param created_at: aware datetime
+    :return: string, date as it appears in a data entry
+    """
+    return str(created_at.astimezone(datetime.timezone.utc).replace(tzinfo=None))
+
+
+def get_query(text):
+    """
+    :param text: string, a search query
+    :return: Query, created if needed
+    """
+    return Query.objects.get_or_create(text=text)[0]
+
+
+def stored_ids(tweet_ids):
+    """
+    :param tweet_ids: iterable of tweet ids
+    :return: set of the ids that are already stored
+    """
+    return set(Tweet.objects.filter(id__in=list(tweet_ids)).values_list("id", flat=True))
+
+
+def entry_to_rows(tweet_id, entry):
+    """
+    :param tweet_id: int, id of the tweet
+    :param entry: data entry with every field of util.DATA_FIELDS
+    :return: tuple (Tweet, list of Hashtags, list of Mentions), not saved
+    """
+    tweet = Tweet(id=tweet_id, raw=entry["raw"], cleaned=entry["cleaned"],
+                  created_at=parse_created_at(entry["created_at"]),
+                  author_num_followers=entry["author_num_followers"],
+                  author_num_favourites=entry["author_num_favourites"], retweets=entry["retweets"],
+                  source=entry["source"], polarity=entry["polarity"], subjectivity=entry["subjectivity"],
+                  tags=json.dumps(entry["tags"]))
+    hashtags = [Hashtag(tweet_id=tweet_id, text=text) for text in entry["hashtags"]]
+    mentions = [Mention(tweet_id=tweet_id, screen_name=name) for name in entry["mentions"]]
+    return tweet, hashtags, mentions
+
+
+def write_batch(pairs, query=None, known_ids=()):
+    """
+    Store a batch of tweets in one transaction, ignoring the ones that are already stored.
+
+    :param pairs: list of (tweet id, data entry) tuples
+    :param query: optional Query, linked to every tweet of the batch
+    :param known_ids: iterable of the ids of tweets already stored, that the query also found
+    """
+    tweets, hashtags, mentions = [], [], []
+    for tweet_id, entry in pairs:
+        tweet, tweet_hashtags, tweet_mentions = entry_to_rows(tweet_id, entry)
+        tweets.append(tweet)
+        hashtags.extend(tweet_hashtags)
+        mentions.extend(tweet_mentions)
+
+    with transaction.atomic():
+        Tweet.objects.bulk_create(tweets, ignore_conflicts=True)
+        Hashtag.objects.bulk_create(hashtags, ignore_conflicts=True)
+        Mention.objects.bulk_create(mentions, ignore_conflicts=True)
+        if query is not None:
+            tweet_ids = set(tweet_id for tweet_id, _ in pairs).union(known_ids)
+            Tweet.queries.through.objects.bulk_create(
+                [Tweet.queries.through(tweet_id=tweet_id, query_id=query.id) for tweet_id in tweet_ids],
+                ignore_conflicts=True)
+
+
+def ingest_entries(pairs, query=None, batch_size=BATCH_SIZE):
+    """
+    Store data entries that were already enriched, eg. by the main/ crawler.
+
+    :param pairs: iterable of (tweet id, data entry) tuples, the data entries with every field of util.DATA_FIELDS
+    :param query: optional string, the query that found the tweets
+    :param batch_size: number of tweets written at a time
+    :return: number of tweets that weren't stored before
+    """
+    query = get_query(query) if query is not None else None
+    new_count = 0
+    for batch in chunks(pairs, batch_size):
+        known = stored_ids(tweet_id for tweet_id, _ in batch)
+        new_pairs = [(tweet_id, entry) for tweet_id, entry in batch if tweet_id not in known]
+        write_batch(new_pairs, query, known)
+        new_count += len(set(tweet_id for tweet_id, _ in new_pairs))
+    return new_count
+
+
+def ingest_tweets(tweets, query=None):
+    """
+    Store a page of search results, and get their data entries. Only the tweets that aren't stored yet are enriched,
+    the data entries of the others are read back from the database.
+
+    :param tweets: list of tweepy Status objects
+    :param query: optional string, the query that found the tweets
+    :return: list of data entries, with every field of util.DATA_FIELDS, in the order of tweets
+    """
+    stored = load_data_entries(tweet.id for tweet in tweets)
+    new_tweets = [tweet for tweet in tweets if tweet.id not in stored]
+    new_entries = dict((tweet.id, entry) for tweet, entry in
+                       zip(new_tweets, util.search_results_to_data_entries(new_tweets)))
+    write_batch(list(new_entries.items()), get_query(query) if query is not None else None, stored)
+    return [new_entries[tweet.id] if tweet.id in new_entries else stored[tweet.id] for tweet in tweets]
+
+
+def load_data_entries(tweet_ids):
+    """
+    :param tweet_ids: iterable of tweet ids
+    :return: dictionary of tweet id to data entry, for the ids that are stored
+    """
+    return rows_to_data_entries(id__in=list(tweet_ids))
+
+
+def query_data_entries(query):
+    """
+    :param query: string, a search query
+    :return: list of the data entries of every tweet stored for the query, newest first
+    """
+    return list(rows_to_data_entries(queries__text=query).values())
+
+
+def rows_to_data_entries(**lookups):
+    """
+    :param lookups: field lookups selecting Tweets, eg. id__in=[...]
+    :return: dictionary of tweet id to data entry, newest first
+    """
+    tweet_lookups = dict(("tweet__" + name, value) for name, value in lookups.items())
+    hashtags, mentions = {}, {}
+    for tweet_id, text in Hashtag.objects.filter(**tweet_lookups).order_by("id").values_list("tweet_id", "text"):
+        hashtags.setdefault(tweet_id, []).append(text)
+    for tweet_id, name in Mention.objects.filter(**tweet_lookups).order_by("id").values_list("tweet_id",
+                                                                                              "screen_name"):
+        mentions.setdefault(tweet_id, []).append(name)
+
+    tweets = Tweet.objects.filter(**lookups).order_by("-created_at", "-id")
+    data_entries = {}
+    for tweet in tweets:
+        data_entries[tweet.id] = {
+            "raw": tweet.raw,
+            "cleaned": tweet.cleaned,
+            "created_at": format_created_at(tweet.created_at),
+            "author_num_followers": tweet.author_num_followers,
+            "author_num_favourites": tweet.author_num_favourites,
+            "hashtags": hashtags.get(tweet.id, []),
+            "mentions": mentions.get(tweet.id, []),
+            "retweets": tweet.retweets,
+            "source": tweet.source,
+            "polarity": tweet.polarity,
+            "subjectivity": tweet.subjectivity,
+            "tags": [tuple(tag) for tag in json.loads(tweet.tags)],
+        }
+    return data_entries
+
+
+def chunks(iterable, size):
+    """
+    Split an iterable into lists of at most size elements.
+    :return: generator of lists
+    """
+    chunk = []
+    for elem in iterable:
+        chunk.append(elem)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -1,3 +1,374 @@
-from django.test import TestCase
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Create your tests here.
+from unittest import mock
+
+import tweepy
+from django.test import SimpleTestCase, TestCase
+
+from . import store
+from .models import Hashtag, Query, Tweet
+from .twitter import util
+from .twitter.cache import EnrichmentCache, features_size, text_key
+from .twitter.client import ClientPool, TwitterClient
+
+
+class EmptySearchHandler(BaseHTTPRequestHandler):
+    """
+    Answers every request with an empty page of search results, keeping the connection alive.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        payload = json.dumps({"statuses": [], "search_metadata": {"count": 100}}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RateLimitedHandler(EmptySearchHandler):
+    """
+    Answers every request with a 429, asking to retry right away.
+    """
+    def do_GET(self):
+        self.send_response(429)
+        self.send_header("Retry-After", "0")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class LocalServerTestCase(SimpleTestCase):
+    """
+    Runs a local HTTP server with the handler class, for the duration of each test.
+    """
+    handler = EmptySearchHandler
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = "http://127.0.0.1:%d/1.1" % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class ClientPoolTests(LocalServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.auth_calls = 0
+
+    def create_pool(self, size):
+        def auth_factory():
+            self.auth_calls += 1
+            return None
+        return ClientPool(size=size, base_url=self.base_url, auth_factory=auth_factory)
+
+    def test_sequential_requests_reuse_client_and_connection(self):
+        """
+        Requests made one after the other share one client, and one keep-alive connection.
+        """
+        pool = self.create_pool(size=4)
+        for _ in range(5):
+            with pool.client() as api:
+                self.assertEqual(len(api.search(q="hello", count=100)), 0)
+
+        stats = pool.stats()
+        self.assertEqual(stats["clients"], 1)
+        self.assertEqual(stats["reused"], 4)
+        self.assertEqual(stats["requests"], 5)
+        self.assertEqual(stats["connections"], 1)
+        self.assertEqual(stats["connections_reused"], 4)
+
+    def test_concurrent_requests_share_credentials(self):
+        """
+        Credentials are loaded once, and no more than `size` clients are ever created.
+        """
+        pool = self.create_pool(size=2)
+
+        def search():
+            for _ in range(10):
+                with pool.client() as api:
+                    api.search(q="hello")
+
+        threads = [threading.Thread(target=search) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = pool.stats()
+        self.assertEqual(self.auth_calls, 1)
+        self.assertLessEqual(stats["clients"], 2)
+        self.assertEqual(stats["acquired"], 60)
+        self.assertEqual(stats["requests"], 60)
+        self.assertLessEqual(stats["connections"], 2)
+
+    def test_pool_usable_while_negotiating_credentials(self):
+        """
+        Negotiating the credentials doesn't hold the pool's lock, so other threads aren't stuck behind it.
+        """
+        negotiating = threading.Event()
+        negotiated = threading.Event()
+
+        def auth_factory():
+            negotiating.set()
+            negotiated.wait(5)
+            return None
+
+        pool = ClientPool(size=2, base_url=self.base_url, auth_factory=auth_factory)
+        stats_read = threading.Event()
+
+        def checkout():
+            with pool.client():
+                pass
+
+        def read_stats():
+            pool.stats()
+            stats_read.set()
+
+        thread = threading.Thread(target=checkout)
+        thread.start()
+        self.assertTrue(negotiating.wait(5))
+        threading.Thread(target=read_stats, daemon=True).start()
+        self.assertTrue(stats_read.wait(1))
+        negotiated.set()
+        thread.join()
+        self.assertEqual(pool.stats()["clients"], 1)
+
+
+class RateLimitTests(LocalServerTestCase):
+    handler = RateLimitedHandler
+
+    def test_rate_limited_request_gives_up(self):
+        """
+        A request that stays rate limited raises after max_retries retries, instead of holding its thread forever.
+        """
+        client = TwitterClient(None, self.base_url, max_retries=3)
+        with self.assertRaises(tweepy.TweepError):
+            client.search(q="hello")
+        self.assertEqual(client.requests_sent, 4)
+
+    def test_wait_is_capped(self):
+        client = TwitterClient(None, self.base_url, max_wait=1)
+        client._remaining, client._reset = 0, time.time() + 900
+        with self.assertRaises(tweepy.TweepError):
+            client.search(q="hello")
+        self.assertEqual(client.requests_sent, 0)
+
+
+class CleanTweetTests(SimpleTestCase):
+    # pieces that exercise every cleaning step, and the ways the steps interact
+    FRAGMENTS = ["RT", "RT @user: ", ":", " ", "  ", "\t", "\n", "\r\n", "\xa0", "\u2003", "#", "##", "@", "@@",
+                 "http", "https://t.co/abc", "ht", "tp", "://", "&amp;", "&#35;", "&#64;", "&#10;", "&lt;", "&",
+                 "&amp", "&#x0a;", "user_1", "Tim", "HORTONS", "caf\u00e9", "\u0130", "\u00df", "\u65e5\u672c",
+                 "\U0001f600", "_", "-", ".", "!"]
+    EDGE_CASES = ["", "RT", "RT no colon", "RT @a:", "  padded  ", "http", "http#", "ht#tp://x.com y", "#http://x",
+                  "@\nname", "@name\nmore text", "@\n\n", "@ \nx", "a\nhttp://x\nb", "@ahttp://b c",
+                  "@ab\nhttp://x", "&#35;tag &#64;user&#10;http://x", "&amp;amp;", "RT @x: RT @y: hello"]
+
+    def assert_same_as_stepwise(self, strings):
+        for s in strings:
+            self.assertEqual(util.clean_tweet(s), util.clean_tweet_stepwise(s), repr(s))
+
+    def test_edge_cases(self):
+        self.assert_same_as_stepwise(self.EDGE_CASES)
+
+    def test_randomized_corpus(self):
+        """
+        clean_tweet gives byte-identical output to the step by step cleaner, on random mixes of the fragments.
+        """
+        rng = random.Random(1234)
+        corpus = ["".join(rng.choice(self.FRAGMENTS) for _ in range(rng.randint(0, 30))) for _ in range(20000)]
+        self.assert_same_as_stepwise(corpus)
+
+    def test_clean_tweets(self):
+        self.assertEqual(util.clean_tweets(iter(self.EDGE_CASES)), [util.clean_tweet(s) for s in self.EDGE_CASES])
+
+
+class EnrichmentCacheTests(SimpleTestCase):
+    FEATURES = (0.5, 0.25, [("good", "JJ"), ("coffee", "NN")])
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "enrichment.sqlite3")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_hits_and_misses(self):
+        cache = EnrichmentCache()
+        computed = []
+
+        def compute(text):
+            computed.append(text)
+            return self.FEATURES
+
+        for text in ["good coffee", "good coffee", "bad coffee", "good coffee"]:
+            self.assertEqual(cache.get_or_compute(text, compute), self.FEATURES)
+        self.assertEqual(computed, ["good coffee", "bad coffee"])
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 2))
+
+    def result_size(self, features=FEATURES):
+        """
+        :return: int, bytes the memory layer counts for a result
+        """
+        polarity, subjectivity, tags = features
+        return features_size(text_key("a"), (polarity, subjectivity, tuple(tags)))
+
+    def test_memory_eviction_is_least_recently_used(self):
+        cache = EnrichmentCache(max_bytes=2 * self.result_size())
+        cache.put("a", self.FEATURES)
+        cache.put("b", self.FEATURES)
+        cache.get("a")
+        cache.put("c", self.FEATURES)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), self.FEATURES)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_memory_bounded_by_size(self):
+        """
+        A result with many tags takes the room of several small ones.
+        """
+        big = (0.5, 0.25, [("word%d" % i, "NN") for i in range(50)])
+        cache = EnrichmentCache(max_bytes=self.result_size(big) + self.result_size())
+        for text in ["a", "b", "c"]:
+            cache.put(text, self.FEATURES)
+        cache.put("big", big)
+        self.assertEqual(cache.get("big"), big)
+        self.assertEqual(cache.get("c"), self.FEATURES)
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertLessEqual(cache.stats()["bytes"], cache.max_bytes)
+
+    def test_cached_tags_not_shared(self):
+        cache = EnrichmentCache()
+        cache.put("good coffee", (0.5, 0.25, list(self.FEATURES[2])))
+        cache.get("good coffee")[2].append(("bad", "JJ"))
+        self.assertEqual(cache.get("good coffee"), self.FEATURES)
+
+    def test_disk_layer_survives_restarts(self):
+        cache = EnrichmentCache(path=self.path)
+        cache.put("good coffee", self.FEATURES)
+        cache.close()
+
+        reopened = EnrichmentCache(path=self.path)
+        self.assertEqual(reopened.get("good coffee"), self.FEATURES)
+        self.assertEqual(reopened.stats()["disk_hits"], 1)
+        reopened.close()
+
+    def test_disk_eviction_keeps_size_bounded(self):
+        cache = EnrichmentCache(max_bytes=self.result_size(), path=self.path, max_disk_entries=10)
+        for i in range(25):
+            cache.put("text %d" % i, self.FEATURES)
+        self.assertEqual(cache.get("text 24"), self.FEATURES)
+        self.assertIsNone(cache.get("text 0"))
+        self.assertLessEqual(cache.stats()["disk_evictions"], 15)
+        self.assertGreater(cache.stats()["disk_evictions"], 0)
+        cache.close()
+
+
+class FieldProjectionTests(SimpleTestCase):
+    RAW_TWEET = {"id": 1, "full_text": "RT @bob: Good #coffee http://t.co/abc", "retweet_count": 3,
+                 "created_at": "Wed Jun 06 20:07:10 +0000 2018",
+                 "user": {"id": 2, "screen_name": "al", "followers_count": 5, "favourites_count": 7},
+                 "entities": {"hashtags": [{"text": "Coffee"}], "user_mentions": [{"screen_name": "Bob"}]},
+                 "source": "<a href=\"http://twitter.com\">Twitter Web Client</a>"}
+    FEATURES = (0.7, 0.6, [("good", "JJ"), ("coffee", "NN")])
+
+    def setUp(self):
+        self.tweet = tweepy.models.Status.parse(None, self.RAW_TWEET)
+        self.compute = mock.patch.object(util, "compute_text_features", return_value=self.FEATURES).start()
+        self.addCleanup(mock.patch.stopall)
+        # a cache that never hits
+        mock.patch.object(util, "get_cache", return_value=EnrichmentCache(max_bytes=0)).start()
+
+    def test_all_fields_by_default(self):
+        entry = util.tweet_to_data_entry(self.tweet)
+        self.assertEqual(tuple(entry), util.DATA_FIELDS)
+        self.assertEqual(entry["cleaned"], "good coffee")
+        self.assertEqual((entry["polarity"], entry["subjectivity"], entry["tags"]), self.FEATURES)
+
+    def test_simple_fields_skip_textblob(self):
+        entries = util.search_results_to_data_entries([self.tweet], util.SIMPLE_FIELDS)
+        self.assertEqual(entries, [{"cleaned": "good coffee", "retweets": 3}])
+        self.assertEqual(util.simple_data_entries(entries), [{"text": "good coffee", "retweets": 3}])
+        self.compute.assert_not_called()
+
+    def test_sentiment_without_tags(self):
+        entry = util.tweet_to_data_entry(self.tweet, ["polarity", "source"])
+        self.assertEqual(entry, {"source": "Twitter Web Client", "polarity": 0.7})
+        self.compute.assert_called_once_with("good coffee", True, False)
+
+    def test_unknown_field(self):
+        with self.assertRaises(ValueError):
+            util.tweet_to_data_entry(self.tweet, ["cleaned", "likes"])
+
+
+class TweetStoreTests(TestCase):
+    RAW_TWEET = FieldProjectionTests.RAW_TWEET
+    FEATURES = FieldProjectionTests.FEATURES
+
+    def setUp(self):
+        self.compute = mock.patch.object(util, "compute_text_features", return_value=self.FEATURES).start()
+        self.addCleanup(mock.patch.stopall)
+        mock.patch.object(util, "get_cache", return_value=EnrichmentCache(max_bytes=0)).start()
+
+    def make_tweets(self, ids):
+        return [tweepy.models.Status.parse(None, dict(self.RAW_TWEET, id=tweet_id)) for tweet_id in ids]
+
+    def make_pairs(self, ids):
+        tweets = self.make_tweets(ids)
+        return list(zip(ids, util.search_results_to_data_entries(tweets)))
+
+    def test_ingest_twice_stores_once(self):
+        pairs = self.make_pairs([1, 2, 3])
+        self.assertEqual(store.ingest_entries(pairs, "coffee"), 3)
+        self.assertEqual(store.ingest_entries(pairs, "coffee"), 0)
+        self.assertEqual(Tweet.objects.count(), 3)
+        self.assertEqual(Hashtag.objects.count(), 3)
+        self.assertEqual(Query.objects.get(text="coffee").tweets.count(), 3)
+
+    def test_overlapping_queries_share_tweets(self):
+        store.ingest_entries(self.make_pairs([1, 2, 3]), "coffee")
+        self.assertEqual(store.ingest_entries(self.make_pairs([3, 4]), "good coffee", batch_size=1), 1)
+        self.assertEqual(Tweet.objects.count(), 4)
+        self.assertEqual(sorted(Tweet.objects.get(id=3).queries.values_list("text", flat=True)),
+                         ["coffee", "good coffee"])
+        self.assertEqual(len(store.query_data_entries("good coffee")), 2)
+
+    def test_round_trip(self):
+        pairs = self.make_pairs([1])
+        store.ingest_entries(pairs, "coffee")
+        self.assertEqual(store.query_data_entries("coffee"), [pairs[0][1]])
+
+    def test_longest_hashtag(self):
+        """
+        A hashtag as long as a tweet allows fits in its column. SQLite doesn't check lengths, MySQL fails the insert.
+        """
+        tweet_id, entry = self.make_pairs([1])[0]
+        # a tweet is at most 280 characters, "#" included
+        entry["hashtags"] = ["x" * 279]
+        self.assertGreaterEqual(Hashtag._meta.get_field("text").max_length, len(entry["hashtags"][0]))
+        store.ingest_entries([(tweet_id, entry)])
+        self.assertEqual(store.load_data_entries([tweet_id])[tweet_id]["hashtags"], entry["hashtags"])
+
+    def test_ingest_tweets_enriches_new_tweets_only(self):
+        store.ingest_entries(self.make_pairs([1, 2]), "coffee")
+        self.compute.reset_mock()
+        entries = store.ingest_tweets(self.make_tweets([2, 3, 1]), "good coffee")
+        self.assertEqual(self.compute.call_count, 1)
+        self.assertEqual([entry["created_at"] for entry in entries], ["2018-06-06 20:07:10"] * 3)
+        self.assertEqual(Query.objects.get(text="good coffee").tweets.count(), 3)
@@ -0,0 +1,233 @@
+"""
+cache.py
+
+A content-addressed cache of enrichment results (TextBlob polarity, subjectivity and PoS tags), keyed by a hash of the
+cleaned tweet text. The crawler scripts in main/ use this same cache, see main/enrich_cache.py.
+
+Lots of tweets are the same text once cleaned - copy-paste campaigns, bots, "I'm at ..." templates - and TextBlob is
+by far the most expensive part of building a data entry, so every repeat is served from the cache instead.
+
+Every process of the app has one cache, get_cache(). Results are kept in memory, and also in the sqlite file named by
+the TWEETY_ENRICHMENT_CACHE setting, if there is one, which all the worker processes share.
+
+There are two layers:
+    - an in-process LRU of the most recently used results, bounded by max_bytes, the memory its results take up
+    - optionally, an sqlite file bounded by max_disk_entries, shared by every process using the same path, and kept
+      across runs. When it grows past its size, the least recently used results are evicted.
+"""
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+MAX_BYTES = 64 * 1024 * 1024
+MAX_DISK_ENTRIES = 1000000
+# fraction of max_disk_entries evicted at once, so that eviction doesn't run on every insert
+EVICT_FRACTION = 0.1
+
+
+def text_key(cleaned_text):
+    """
+    :param cleaned_text: string, cleaned tweet text
+    :return: bytes, the cache key of the text
+    """
+    return hashlib.blake2b(cleaned_text.encode("utf-8"), digest_size=16).digest()
+
+
+def features_size(key, features):
+    """
+    :param key: bytes, cache key
+    :param features: (polarity, subjectivity, tags) tuple, with tags a tuple of (word, tag) tuples
+    :return: int, approximate number of bytes a result takes up in the memory layer
+    """
+    polarity, subjectivity, tags = features
+    size = sys.getsizeof(key) + sys.getsizeof(features) + sys.getsizeof(polarity) + sys.getsizeof(subjectivity)
+    size += sys.getsizeof(tags)
+    for tag in tags:
+        size += sys.getsizeof(tag) + sum(sys.getsizeof(part) for part in tag)
+    return size
+
+
+class EnrichmentCache:
+    """
+    Thread-safe two level cache of text features, see text_features() in util.py.
+
+    Results are kept in memory as tuples, and get() hands out a new list of tags every time, so a caller changing the
+    tags of its data entry can't change the cached result.
+
+    :param max_bytes: maximum number of bytes taken up by the results kept in memory, see features_size
+    :param path: optional string, path of the sqlite file. None to only cache in memory.
+    :param max_disk_entries: maximum number of results kept in the sqlite file
+    """
+    def __init__(self, max_bytes=MAX_BYTES, path=None, max_disk_entries=MAX_DISK_ENTRIES):
+        self.max_bytes = max_bytes
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        # key -> ((polarity, subjectivity, tags), size)
+        self._memory = collections.OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+        self._disk_inserts = 0
+
+    def _connection(self):
+        """
+        :return: sqlite connection of this process, opened on first use. A process forked from the one that opened
+                 the connection opens its own.
+        """
+        if self._db is None or self._db_pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS enrichment (key BLOB PRIMARY KEY, polarity REAL, "
+                             "subjectivity REAL, tags TEXT, used REAL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS enrichment_used ON enrichment (used)")
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _remember(self, key, features):
+        """
+        Put a result in the memory layer, evicting the least recently used results until it fits. Call with the lock
+        held.
+        :return: (polarity, subjectivity, tags) tuple, the result as it is stored
+        """
+        polarity, subjectivity, tags = features
+        features = (polarity, subjectivity, tuple(tuple(tag) for tag in tags))
+        if key in self._memory:
+            self._memory_bytes -= self._memory.pop(key)[1]
+        size = features_size(key, features)
+        self._memory[key] = (features, size)
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_bytes and self._memory:
+            self._memory_bytes -= self._memory.popitem(last=False)[1][1]
+            self.evictions += 1
+        return features
+
+    def get(self, cleaned_text):
+        """
+        :param cleaned_text: string, cleaned tweet text
+        :return: (polarity, subjectivity, tags) tuple, or None if the text isn't cached. tags is a new list.
+        """
+        key = text_key(cleaned_text)
+        with self._lock:
+            stored = self._memory.get(key)
+            if stored is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                polarity, subjectivity, tags = stored[0]
+                return polarity, subjectivity, list(tags)
+
+            if self.path is not None:
+                db = self._connection()
+                row = db.execute("SELECT polarity, subjectivity, tags FROM enrichment WHERE key = ?",
+                                 (key,)).fetchone()
+                if row is not None:
+                    db.execute("UPDATE enrichment SET used = ? WHERE key = ?", (time.time(), key))
+                    tags = [tuple(tag) for tag in json.loads(row[2])]
+                    self._remember(key, (row[0], row[1], tags))
+                    self.disk_hits += 1
+                    return row[0], row[1], tags
+
+            self.misses += 1
+            return None
+
+    def put(self, cleaned_text, features):
+        """
+        :param cleaned_text: string, cleaned tweet text
+        :param features: (polarity, subjectivity, tags) tuple of the text
+        """
+        key = text_key(cleaned_text)
+        with self._lock:
+            self._remember(key, features)
+            if self.path is None:
+                return
+
+            polarity, subjectivity, tags = features
+            db = self._connection()
+            db.execute("INSERT OR REPLACE INTO enrichment (key, polarity, subjectivity, tags, used) "
+                       "VALUES (?, ?, ?, ?, ?)", (key, polarity, subjectivity, json.dumps(tags), time.time()))
+            self._disk_inserts += 1
+            if self._disk_inserts >= max(int(self.max_disk_entries * EVICT_FRACTION), 1):
+                self._disk_inserts = 0
+                self._evict_disk(db)
+
+    def _evict_disk(self, db):
+        """
+        Bring the sqlite file back under max_disk_entries, dropping the least recently used results first.
+        """
+        size = db.execute("SELECT COUNT(*) FROM enrichment").fetchone()[0]
+        excess = size - self.max_disk_entries
+        if excess > 0:
+            db.execute("DELETE FROM enrichment WHERE key IN "
+                       "(SELECT key FROM enrichment ORDER BY used LIMIT ?)", (excess,))
+            self.disk_evictions += excess
+
+    def get_or_compute(self, cleaned_text, compute):
+        """
+        :param cleaned_text: string, cleaned tweet text
+        :param compute: function computing the features of a text that isn't cached
+        :return: (polarity, subjectivity, tags) tuple
+        """
+        features = self.get(cleaned_text)
+        if features is None:
+            features = compute(cleaned_text)
+            self.put(cleaned_text, features)
+        return features
+
+    def stats(self):
+        """
+        :return: dictionary of hit and miss counters
+        """
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                    "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                    "entries": len(self._memory), "bytes": self._memory_bytes, "evictions": self.evictions,
+                    "disk_evictions": self.disk_evictions}
+
+    def report(self):
+        """
+        :return: string, one line summary of stats()
+        """
+        stats = self.stats()
+        return ("enrichment cache: %d hits, %d disk hits, %d misses (%.1f%% hit rate), %d evictions"
+                % (stats["hits"], stats["disk_hits"], stats["misses"], stats["hit_rate"] * 100,
+                   stats["evictions"] + stats["disk_evictions"]))
+
+    def close(self):
+        """
+        Close the sqlite file, if this process opened it.
+        """
+        with self._lock:
+            if self._db is not None and self._db_pid == os.getpid():
+                self._db.close()
+            self._db = None
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    :return: EnrichmentCache, the process-wide cache, created on first use
+    """
+    from django.conf import settings
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EnrichmentCache(path=getattr(settings, "TWEETY_ENRICHMENT_CACHE", None))
+        return _cache
@@ -0,0 +1,259 @@
+"""
+client.py
+
+A process-wide pool of authenticated Twitter clients, shared by all requests to the tweety app.
+
+Building a tweepy API object for every request means reading the key file, negotiating a bearer token, and opening a
+new HTTPS connection each time - tweepy 3 even opens a new HTTP session for every single API call. Instead, the key file
+is read and the bearer token negotiated once per process, and every pooled client keeps its own requests session, so
+its connection to the API stays alive between calls.
+
+A client is only ever used by one thread at a time: take one with `with get_pool().client() as api: ...`.
+
+Response bodies are decoded with ujson when it is installed, which is several times faster than the standard library
+on full pages of extended tweets.
+"""
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+import tweepy
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+KEYPATH = "tweety/twitter/keys/auth"
+API_URL = "https://api.twitter.com/1.1"
+SEARCH_PATH = "/search/tweets.json"
+POOL_SIZE = 4
+TIMEOUT = 60
+# a request is answered or fails within this many seconds of waiting on rate limits, so it never ties up the web
+# worker serving it for a whole 15 minute window
+MAX_RATE_LIMIT_WAIT = 30
+MAX_RATE_LIMIT_RETRIES = 3
+
+
+def read_app_auth(keypath):
+    """
+    Read the consumer key and secret from the key file, and negotiate an application-only bearer token.
+    :param keypath: string, path to the key file
+    :return: tweepy.AppAuthHandler
+    """
+    with open(keypath, "r") as auth_file:
+        auth_lines = auth_file.readlines()
+        consumer_key = auth_lines[2].strip().split("=")[1]
+        consumer_secret = auth_lines[3].strip().split("=")[1]
+    return tweepy.AppAuthHandler(consumer_key, consumer_secret)
+
+
+class TwitterClient:
+    """
+    An authenticated client with a persistent HTTP session. Has the same search() as tweepy.API, and returns the same
+    tweepy models, and waits on rate limits like tweepy.API(wait_on_rate_limit=True), but only for so long: a request
+    that would wait more than max_wait seconds in total, or that is still rate limited after max_retries retries,
+    raises a TweepError instead.
+
+    :param auth: tweepy auth handler, or None for no authentication
+    :param base_url: string, root url of the API
+    :param max_wait: float, maximum seconds a request waits on rate limits
+    :param max_retries: int, maximum number of times a rate limited request is retried
+    """
+    def __init__(self, auth, base_url=API_URL, timeout=TIMEOUT, max_wait=MAX_RATE_LIMIT_WAIT,
+                 max_retries=MAX_RATE_LIMIT_RETRIES):
+        self.auth = auth
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.parser = tweepy.parsers.ModelParser()
+        self.session = requests.Session()
+        self.requests_sent = 0
+        self._remaining = None
+        self._reset = None
+
+    def _get(self, path, params):
+        """
+        Issue a GET request on the persistent session.
+
+        :param path: string, request path, relative to base_url
+        :param params: dictionary of query string parameters
+        :return: decoded JSON body
+        """
+        params = dict((k, str(v)) for k, v in params.items() if v is not None)
+        waited = 0.0
+        retries = 0
+        while True:
+            if self._remaining == 0 and self._reset is not None:
+                waited = self._wait(self._reset - time.time(), waited)
+
+            auth = self.auth.apply_auth() if self.auth is not None else None
+            try:
+                resp = self.session.get(self.base_url + path, params=params, auth=auth, timeout=self.timeout)
+            except requests.RequestException as e:
+                raise tweepy.TweepError("Failed to send request: %s" % e)
+            self.requests_sent += 1
+
+            if "x-rate-limit-remaining" in resp.headers:
+                self._remaining = int(resp.headers["x-rate-limit-remaining"])
+                self._reset = int(resp.headers.get("x-rate-limit-reset", 0))
+            if resp.status_code == 429:
+                if retries >= self.max_retries:
+                    raise tweepy.TweepError("Rate limited, still after %d retries" % retries, resp)
+                retries += 1
+                if self._remaining != 0:
+                    waited = self._wait(float(resp.headers.get("retry-after", 1)), waited)
+                continue
+            if resp.status_code != 200:
+                try:
+                    error_msg, api_code = self.parser.parse_error(resp.text)
+                except Exception:
+                    error_msg, api_code = "Twitter error response: status code = %s" % resp.status_code, None
+                raise tweepy.TweepError(error_msg, resp, api_code=api_code)
+            if ujson is not None:
+                return ujson.loads(resp.content)
+            return resp.json()
+
+    def _wait(self, seconds, waited):
+        """
+        Sleep on a rate limit, unless that would take the request past max_wait seconds of waiting.
+
+        :param seconds: float, seconds to sleep
+        :param waited: float, seconds the request already waited
+        :return: float, seconds the request waited in total
+        """
+        if seconds <= 0:
+            return waited
+        if waited + seconds > self.max_wait:
+            raise tweepy.TweepError("Rate limited for %.0fs more, longer than a request waits (%.0fs)" %
+                                    (seconds, self.max_wait))
+        time.sleep(seconds)
+        return waited + seconds
+
+    def search(self, q, count=None, max_id=None, since_id=None, lang=None, tweet_mode=None, **kwargs):
+        """
+        Same as tweepy.API.search.
+        :return: tweepy SearchResults
+        """
+        params = dict(kwargs, q=q, count=count, max_id=max_id, since_id=since_id, lang=lang, tweet_mode=tweet_mode)
+        return tweepy.models.SearchResults.parse(self, self._get(SEARCH_PATH, params))
+
+    def connections_opened(self):
+        """
+        :return: number of TCP connections this client's session has opened so far
+        """
+        total = 0
+        for adapter in self.session.adapters.values():
+            for key in adapter.poolmanager.pools.keys():
+                total += adapter.poolmanager.pools[key].num_connections
+        return total
+
+
+class ClientPool:
+    """
+    Thread-safe pool of TwitterClients sharing one set of credentials.
+
+    :param keypath: string, path to the key file, read the first time a client is needed
+    :param size: maximum number of clients. When all are in use, client() blocks until one is given back.
+    :param base_url: string, root url of the API
+    :param auth_factory: optional function returning the auth handler, instead of reading keypath
+    """
+    def __init__(self, keypath=KEYPATH, size=POOL_SIZE, base_url=API_URL, auth_factory=None):
+        self.keypath = keypath
+        self.size = size
+        self.base_url = base_url
+        self.auth_factory = auth_factory or (lambda: read_app_auth(self.keypath))
+        self.auth = None
+        self.auth_loaded = False
+        self.clients = []
+        self.acquired = 0
+        self.reused = 0
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        # number of clients created, or being created
+        self._created = 0
+        # negotiating the credentials is a network call, it holds this lock rather than _lock, so that other threads
+        # still take and give back idle clients meanwhile
+        self._auth_lock = threading.Lock()
+
+    def _load_auth(self):
+        """
+        :return: the auth handler, negotiated by the first caller, once
+        """
+        with self._auth_lock:
+            if not self.auth_loaded:
+                self.auth = self.auth_factory()
+                self.auth_loaded = True
+            return self.auth
+
+    def _take(self):
+        with self._lock:
+            self.acquired += 1
+            try:
+                client = self._idle.get_nowait()
+                self.reused += 1
+                return client
+            except queue.Empty:
+                pass
+            create = self._created < self.size
+            if create:
+                self._created += 1
+
+        if create:
+            try:
+                client = TwitterClient(self._load_auth(), self.base_url)
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+            with self._lock:
+                self.clients.append(client)
+            return client
+
+        # every client is in use, wait for one to come back
+        client = self._idle.get()
+        with self._lock:
+            self.reused += 1
+        return client
+
+    @contextmanager
+    def client(self):
+        """
+        Context manager, borrow a client from the pool for the body of the with block.
+        """
+        client = self._take()
+        try:
+            yield client
+        finally:
+            self._idle.put(client)
+
+    def stats(self):
+        """
+        Counters for how well clients and connections are being reused.
+        :return: dictionary
+        """
+        with self._lock:
+            clients = list(self.clients)
+            stats = {"clients": len(clients), "acquired": self.acquired, "reused": self.reused}
+        stats["requests"] = sum(c.requests_sent for c in clients)
+        stats["connections"] = sum(c.connections_opened() for c in clients)
+        stats["connections_reused"] = stats["requests"] - stats["connections"]
+        return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    :return: ClientPool, the process-wide pool, created on first use
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ClientPool()
+        return _pool
@@ -15,38 +15,38 @@ The output file contains all the tweets that match the query from the past 7 day
 go back in time that far), OR a max of 200,000 of the most recent tweets.
 """
 import tweepy
-import sys
-import twitter_util
+from . import util as twitter_util
+from .client import get_pool
 
-KEYPATH = "tweety/twitter/keys/auth"
 LANG = "en"
 COUNT = 100
 TWEET_MODE = "extended"
 
 
-def twitter_search(query, num_results):
+def twitter_search(query, num_results, api=None, fields=None, store=False):
     """
     Search using the tweepy API.
     :param query: The query to search for.
     :param num_results: The maximum number of results to return
+    :param api: optional API object to search with, eg. a replay API for benchmarks. By default, a client is
+                borrowed from the process-wide client pool.
+    :param fields: optional iterable of the data entry fields to extract, all of them by default. TextBlob only runs
+                   for the fields that need it.
+    :param store: if True, also write the tweets to the tweet store (see tweety/store.py). Every field is then
+                  extracted, and tweets another search already stored are read back instead of enriched again.
     :return: a list of data entries
     """
+    if api is None:
+        with get_pool().client() as pooled_api:
+            return twitter_search(query, num_results, pooled_api, fields, store)
+    fields = twitter_util.project_fields(fields)
+    if store:
+        # needs the app registry, so only imported when used
+        from .. import store as tweet_store
+
+    raw_query = query
     query = query + " -filter:retweets"
 
-    # setup auth
-    with open(KEYPATH, "r") as auth_file:
-        auth_lines = auth_file.readlines()
-        CONSUMER_KEY = auth_lines[2].strip().split("=")[1]
-        CONSUMER_SECRET = auth_lines[3].strip().split("=")[1]
-
-    auth = tweepy.AppAuthHandler(CONSUMER_KEY, CONSUMER_SECRET)
-
-    # get access to twitter API object
-    api = tweepy.API(auth, wait_on_rate_limit=True, wait_on_rate_limit_notify=True)
-    if not api:
-        print("Can't Authenticate")
-        sys.exit(-1)
-
     # helper variables
     # all tweets have an id > 0, where higher ids are further back in time
     # initialize max_id at -1 because we don't know where to start our search
@@ -58,10 +58,11 @@ def twitter_search(query, num_results):
         try:
             # first iteration - read the most recent tweets
             if max_id <= 0:
-                new_tweets = api.search(q=query, count=COUNT, tweet_mode='extended')
+                new_tweets = api.search(q=query, count=COUNT, lang=LANG, tweet_mode=TWEET_MODE)
             # subsequent iterations - start searching where the previous iteration left off
             else:
-                new_tweets = api.search(q=query, count=COUNT, max_id=str(max_id - 1), tweet_mode='extended')
+                new_tweets = api.search(q=query, count=COUNT, max_id=str(max_id - 1), lang=LANG,
+                                        tweet_mode=TWEET_MODE)
 
             # no more tweets found, exit
             if not new_tweets:
@@ -69,7 +70,11 @@ def twitter_search(query, num_results):
                 break
 
             # add new entries to list
-            data_entries = twitter_util.search_results_to_data_entries(new_tweets)
+            if store:
+                data_entries = [dict((name, entry[name]) for name in fields)
+                                for entry in tweet_store.ingest_tweets(new_tweets, raw_query)]
+            else:
+                data_entries = twitter_util.search_results_to_data_entries(new_tweets, fields)
             for entry in data_entries:
                 all_tweets.append(entry)
                 tweet_count += 1
@@ -3,28 +3,66 @@ twitter_util.py
 
 Utilities for twitter api functions.
 """
+import collections
 import html
 import re
 from textblob import TextBlob
+from .cache import get_cache
 
 
 #################
 # Data Handling #
 #################
-def search_results_to_data_entries(results):
+# how each metadata field of a data entry is extracted from a tweet, in the order of the fields in a data entry
+METADATA_EXTRACTORS = collections.OrderedDict([
+    ("raw", lambda tweet: tweet._json["full_text"]),
+    ("cleaned", lambda tweet: clean_tweet(tweet._json["full_text"])),
+    ("created_at", lambda tweet: str(tweet.created_at)),
+    ("author_num_followers", lambda tweet: tweet.author.followers_count),
+    ("author_num_favourites", lambda tweet: tweet.author.favourites_count),
+    ("hashtags", lambda tweet: list(map(lambda tag: tag["text"].lower(), tweet.entities["hashtags"]))),
+    ("mentions", lambda tweet: list(map(lambda tag: tag["screen_name"].lower(), tweet.entities["user_mentions"]))),
+    ("retweets", lambda tweet: tweet.retweet_count),
+    ("source", lambda tweet: tweet.source),
+])
+# fields computed by TextBlob from the cleaned text. Sentiment and PoS tagging are separate TextBlob stages.
+SENTIMENT_FIELDS = ("polarity", "subjectivity")
+TAG_FIELDS = ("tags",)
+DATA_FIELDS = tuple(METADATA_EXTRACTORS) + SENTIMENT_FIELDS + TAG_FIELDS
+
+
+def project_fields(fields):
+    """
+    Check a selection of data entry fields, and put it in data entry order.
+
+    :param fields: iterable of field names (see DATA_FIELDS), or None for all of them
+    :return: tuple of field names
+    """
+    if fields is None:
+        return DATA_FIELDS
+    fields = set(fields)
+    unknown = fields - set(DATA_FIELDS)
+    if unknown:
+        raise ValueError("Unknown data entry fields: %s" % ", ".join(sorted(unknown)))
+    return tuple(field for field in DATA_FIELDS if field in fields)
+
+
+def search_results_to_data_entries(results, fields=None):
     """
     Given the results of a tweepy search(), extract the most relevant features of this data.
     Specifically, we return a list of data entries.
 
     :param results: SearchResults object, the return value of tweepy's, API.search()
+    :param fields: optional iterable of the data entry fields to extract, all of them by default
     """
+    fields = project_fields(fields)
     data_entries = []
     for tweet in results:
-        data_entries.append(tweet_to_data_entry(tweet))
+        data_entries.append(tweet_to_data_entry(tweet, fields))
     return data_entries
 
 
-def tweet_to_data_entry(tweet):
+def tweet_to_data_entry(tweet, fields=None):
     """
     Takes a tweet, extracts the relevant fields, and return a data entry, a light-weight version of the tweet.
     Also adds extra features from the text, run through TextBlob.
@@ -48,41 +86,107 @@ def tweet_to_data_entry(tweet):
         "tags": TextBlob PoS tagging, list of tuples
     }
 
+    When only some fields are asked for, the data entry only has those, and only the stages they need are run: no
+    TextBlob at all without "polarity", "subjectivity" or "tags", and no PoS tagging without "tags".
+
     :param tweet: a single "Status" object, representing a tweet.
+    :param fields: optional iterable of the data entry fields to extract, all of them by default
     :return: dictionary, data entry
     """
-    # extract text from the tweet
-    tweet_text = tweet._json["full_text"]
-    cleaned_tweet_text = clean_tweet(tweet_text)
-
-    # extract other metadata from the tweet
-    creation_data = str(tweet.created_at)
-    author_num_followers = tweet.author.followers_count
-    author_num_favourites = tweet.author.favourites_count
-    hashtags = list(map(lambda tag: tag["text"].lower(), tweet.entities["hashtags"]))
-    mentions = list(map(lambda tag: tag["screen_name"].lower(), tweet.entities["user_mentions"]))
-    retweets = tweet.retweet_count
-    source = tweet.source
-
-    # get other features from the tweet text using TextBlob
-    tb = TextBlob(cleaned_tweet_text)
-    polarity = tb.sentiment.polarity
-    subjectivity = tb.sentiment.subjectivity
-    tags = tb.tags
-
-    # create the data entry
-    data_field_names = ["raw", "cleaned", "created_at", "author_num_followers", "author_num_favourites", "hashtags",
-                        "mentions", "retweets", "source", "polarity", "subjectivity", "tags"]
-    data_fields = [tweet_text, cleaned_tweet_text, creation_data, author_num_followers, author_num_favourites, hashtags,
-                   mentions, retweets, source, polarity, subjectivity, tags]
+    fields = project_fields(fields)
+    data_entry = tweet_to_metadata(tweet, fields)
+    sentiment, tags = text_stages(fields)
+    if sentiment or tags:
+        features = text_features(cleaned_text_of(tweet, data_entry), sentiment, tags)
+        add_text_features(data_entry, features, fields)
+    return data_entry
+
+
+def tweet_to_metadata(tweet, fields=None):
+    """
+    The cheap part of tweet_to_data_entry: extract the text and metadata of a tweet, without running TextBlob.
 
+    :param tweet: a single "Status" object, representing a tweet.
+    :param fields: optional iterable of the data entry fields to extract, all of them by default
+    :return: dictionary, a data entry without the "polarity", "subjectivity" and "tags" fields
+    """
+    fields = project_fields(fields)
     data_entry = {}
-    for i in range(len(data_field_names)):
-        data_entry[data_field_names[i]] = data_fields[i]
-
+    for name, extract in METADATA_EXTRACTORS.items():
+        if name in fields:
+            data_entry[name] = extract(tweet)
     return data_entry
 
 
+def text_stages(fields):
+    """
+    :param fields: tuple of data entry fields, from project_fields
+    :return: tuple (bool, bool), whether the fields need TextBlob sentiment, and PoS tags
+    """
+    return any(field in fields for field in SENTIMENT_FIELDS), any(field in fields for field in TAG_FIELDS)
+
+
+def cleaned_text_of(tweet, data_entry):
+    """
+    :return: string, the cleaned text of a tweet, taken from its data entry if it has it
+    """
+    if "cleaned" in data_entry:
+        return data_entry["cleaned"]
+    return clean_tweet(tweet._json["full_text"])
+
+
+def add_text_features(data_entry, features, fields):
+    """
+    Set the TextBlob fields of a data entry.
+
+    :param data_entry: dictionary, data entry from tweet_to_metadata
+    :param features: tuple (polarity, subjectivity, tags), from text_features
+    :param fields: tuple of data entry fields, from project_fields
+    """
+    for name, value in zip(SENTIMENT_FIELDS + TAG_FIELDS, features):
+        if name in fields:
+            data_entry[name] = value
+
+
+def text_features(cleaned_text, sentiment=True, tags=True):
+    """
+    Get features from the cleaned text of a tweet using TextBlob, served from the enrichment cache when the same text
+    was seen before.
+
+    :param cleaned_text: string, cleaned tweet text
+    :param sentiment: whether to compute polarity and subjectivity
+    :param tags: whether to compute PoS tags
+    :return: tuple (polarity, subjectivity, tags), the features that weren't asked for may be None
+    """
+    cache = get_cache()
+    if sentiment and tags:
+        return cache.get_or_compute(cleaned_text, compute_text_features)
+
+    # only complete results are cached, but a complete result serves any part of it
+    features = cache.get(cleaned_text)
+    if features is None:
+        features = compute_text_features(cleaned_text, sentiment, tags)
+    return features
+
+
+def compute_text_features(cleaned_text, sentiment=True, tags=True):
+    """
+    Same as text_features, always running TextBlob.
+
+    :param cleaned_text: string, cleaned tweet text
+    :param sentiment: whether to compute polarity and subjectivity
+    :param tags: whether to compute PoS tags
+    :return: tuple (polarity, subjectivity, tags), the features that weren't asked for are None
+    """
+    tb = TextBlob(cleaned_text)
+    polarity, subjectivity = (tb.sentiment.polarity, tb.sentiment.subjectivity) if sentiment else (None, None)
+    return polarity, subjectivity, tb.tags if tags else None
+
+
+# the fields simple_data_entry needs
+SIMPLE_FIELDS = ("cleaned", "retweets")
+
+
 def simple_data_entries(data_entries):
     """
     Return a lightweight version of these data entries.
@@ -111,10 +215,51 @@ def simple_data_entry(entry):
 ###################
 # String Cleaning #
 ###################
+URL_PATTERN = re.compile(r"http\S+")
+MENTION_PATTERN = re.compile(r"\@\w+")
+# a mention, or a newline. Newlines are removed before mentions, so a mention may have newlines anywhere in it
+NEWLINE_OR_MENTION_PATTERN = re.compile(r"\@\n*\w[\w\n]*|\n")
+
+
 def clean_tweet(s):
     """
     Take in a string representing the text field of a tweet, and clean it up.
 
+    Gives exactly the same result as clean_tweet_stepwise, in fewer passes over the string: steps that have nothing to
+    do are skipped, and newlines and mentions are removed together by a single regular expression. Hashtags and urls
+    keep their own passes, since removing "#" can make a url ("ht#tp://..."), and a url can run into a mention.
+
+    :param s: string to clean
+    :return: string: cleaned string
+    """
+    if s[0:2] == "RT":
+        s = s[s.find(":") + 2:]
+    if "&" in s:
+        s = html.unescape(s)
+    if "#" in s:
+        s = s.replace("#", "")
+    if "http" in s:
+        s = URL_PATTERN.sub("", s)
+    if "\n" in s:
+        s = NEWLINE_OR_MENTION_PATTERN.sub("", s) if "@" in s else s.replace("\n", "")
+    elif "@" in s:
+        s = MENTION_PATTERN.sub("", s)
+    return s.strip().lower()
+
+
+def clean_tweets(strings):
+    """
+    Batch version of clean_tweet.
+    :param strings: iterable of strings to clean
+    :return: list of cleaned strings, in input order
+    """
+    return [clean_tweet(s) for s in strings]
+
+
+def clean_tweet_stepwise(s):
+    """
+    Reference version of clean_tweet, one cleaning step at a time.
+
     :param s: string to clean
     :return: string: cleaned string
     """
@@ -172,7 +317,7 @@ def remove_mentions(s):
     :param s: string to clean
     :return: string: cleaned string
     """
-    return re.sub(r"\@\w+", "", s)
+    return MENTION_PATTERN.sub("", s)
 
 
 def remove_urls(s):
@@ -181,8 +326,7 @@ def remove_urls(s):
     :param s: string to clean
     :return: string: cleaned string
     """
-    cleaned_str = re.sub(r'http\S+', '', s)
-    return cleaned_str
+    return URL_PATTERN.sub("", s)
 
 
 def remove_newlines(s):
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.shortcuts import render
 from django.http import HttpResponse, JsonResponse
 from .twitter import search, util
@@ -7,7 +8,8 @@ def index(request):
 
 
 def tweet_search(request, query, num_results):
-    data = search.twitter_search(query, num_results)
+    data = search.twitter_search(query, num_results, fields=util.SIMPLE_FIELDS,
+                                 store=getattr(settings, "TWEETY_STORE_TWEETS", False))
     data = util.simple_data_entries(data)
 
     return JsonResponse(data, safe=False)